@@ -0,0 +1,68 @@
+"""Pub/Sub messages, bytes and CPU time to deliver a query result.
+
+"separate" publishes one queryResponse per entity with
+generate_separate_entity_payloads(). "batch" packs entities into
+queryResponseBatch messages with generate_batch_payloads(). Reading
+consumes every entity's relationship through the readers, as a
+downstream function would; "messages" is the number of Pub/Sub
+publishes and function invocations needed.
+
+    python benchmarks/bench_batch_messages.py --entities 2000 20000
+"""
+
+import base64
+import argparse
+from types import SimpleNamespace
+
+from bench_fanout import result_summary
+from common import make_graph, measure, report
+
+from trellisdata import codec
+from trellisdata.messages import QueryResponseWriter, read_message
+
+
+def read_separate(events, context):
+    return [read_message(event, context).relationship for event in events]
+
+
+def read_batch(events, context):
+    return [response.relationship for event in events for response in read_message(event, context)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entities", type=int, nargs="+", default=[2000, 20000])
+    parser.add_argument("--max-bytes", type=int, default=1024 * 1024)
+    args = parser.parse_args()
+
+    context = SimpleNamespace(event_id=1)
+    print(f"# JSON backend: {codec.get_backend().name}, batch budget {args.max_bytes:,} bytes")
+    for n_entities in args.entities:
+        graph = make_graph(n_entities)
+        writer = QueryResponseWriter(
+            sender="db-query",
+            seed_id=1,
+            previous_event_id=2,
+            query_name="relateFastqs",
+            result_summary=result_summary(),
+            graph=graph,
+            job_request="fastq-to-ubam")
+        print(f"# {len(graph.relationships)} relationships")
+        results = {}
+        for name, generate, read in (
+                ("separate", writer.generate_separate_entity_payloads, read_separate),
+                ("batch", lambda: writer.generate_batch_payloads(args.max_bytes), read_batch)):
+            seconds, _, payloads = measure(lambda: list(generate()), repeat=3)
+            events = [{'data': base64.b64encode(payload)} for payload in payloads]
+            read_seconds, _, _ = measure(read, events, context, repeat=3)
+            results[name] = (len(payloads), seconds, read_seconds)
+            report(f"{name} encode", seconds,
+                   extra=f"{len(payloads):,} messages, {sum(map(len, payloads)):,} bytes")
+            report(f"{name} read", read_seconds)
+        separate, batch = results["separate"], results["batch"]
+        print(f"#   {separate[0] / batch[0]:,.0f}x fewer messages, "
+              f"{separate[1] / batch[1]:.2f}x faster encode, {separate[2] / batch[2]:.2f}x faster read")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Downstream queries launched during a bulk Fastq upload, with and
+without an ActivationCoalescer.
+
+Each sample has 8 Fastqs (4 read groups x 2 mates), each related to
+the sample's PersonalisSequencing node. One trigger relates the
+sequencing to the sample (parameters: sample), so all 8 relationships
+activate it identically; another launches per read group (parameters:
+sample, read group), so mates activate it twice.
+
+    python benchmarks/bench_coalescer.py --samples 2000
+"""
+
+import argparse
+
+from types import SimpleNamespace
+
+from common import fastq_properties, measure, report
+
+from trellisdata.database_trigger import TriggerController, ActivationCoalescer
+
+
+TRIGGERS = """
+--- !DatabaseTrigger
+name: LaunchFastqToUbam
+pattern: relationship
+start:
+    label: PersonalisSequencing
+end:
+    label: Fastq
+    properties:
+        sample: sample
+        readGroup: read_group
+relationship:
+    type: GENERATED
+query: launchFastqToUbam
+--- !DatabaseTrigger
+name: RelateGenomeToFastq
+pattern: relationship
+start:
+    label: PersonalisSequencing
+end:
+    label: Fastq
+    properties:
+        sample: sample
+relationship:
+    type: GENERATED
+query: relateGenomeToFastq
+"""
+
+
+def responses(n_samples):
+    for i in range(n_samples * 8):
+        properties = fastq_properties(i)
+        yield SimpleNamespace(nodes=[], relationship={
+            "id": i,
+            "start_node": {"id": -i, "labels": ["Blob", "PersonalisSequencing"], "properties": {"sample": properties["sample"]}},
+            "end_node": {"id": i, "labels": ["Blob", "Fastq"], "properties": properties},
+            "type": "GENERATED",
+            "properties": {}})
+
+
+def evaluate_all(evaluator, query_responses):
+    return sum(len(evaluator.evaluate_trigger_conditions(response)) for response in query_responses)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--window", type=float, default=60.0)
+    args = parser.parse_args()
+
+    query_responses = list(responses(args.samples))
+    print(f"# {len(query_responses)} Fastq relationships from {args.samples} samples")
+    seconds, _, activations = measure(evaluate_all, TriggerController(TRIGGERS), query_responses)
+    report("controller", seconds / len(query_responses), extra=f"per response, {activations:,} queries launched")
+
+    controller = TriggerController(TRIGGERS)
+
+    def coalesce_all(query_responses):
+        # A fresh coalescer per run, as for one bulk upload
+        coalescer = ActivationCoalescer(controller, window=args.window)
+        return evaluate_all(coalescer, query_responses), coalescer.stats()
+
+    seconds, _, (activations, stats) = measure(coalesce_all, query_responses)
+    report("coalescer", seconds / len(query_responses),
+           extra=f"per response, {activations:,} queries launched, {stats['suppressed']:,} suppressed")
+
+
+if __name__ == "__main__":
+    main()
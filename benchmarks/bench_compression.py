@@ -0,0 +1,66 @@
+"""CPU cost and bytes saved by compressing message payloads.
+
+Payloads are a single-node queryResponse (below the default threshold,
+so never compressed in practice), a JobCreatedWriter job dict, and
+whole-sample aggregate responses of Fastq nodes.
+
+    python benchmarks/bench_compression.py --levels 1 6 9
+"""
+
+import time
+import argparse
+
+from common import query_response_message, fastq_properties, report
+
+from trellisdata import codec
+
+
+def payloads():
+    yield "single Fastq queryResponse", query_response_message("Fastq")
+    yield "jobCreated job dict", {
+        "header": {"messageKind": "jobCreated", "sender": "job-launcher", "seedId": 1, "previousEventId": 2},
+        "body": {"jobDict": {
+            "name": "fastq-to-ubam",
+            "inputs": {f"FASTQ_{i}": fastq_properties(i)["uri"] for i in range(64)},
+            "envVariables": {"SAMPLE": "SHIP000000", "READ_GROUP": "0"},
+            "labels": {"sample": "ship000000", "trellis-id": "221214-162717-045-5d709493"},
+            "inputIds": list(range(64)),
+        }}}
+    for n_nodes in (100, 2000):
+        message = query_response_message("Fastq")
+        message["body"]["nodes"] = [query_response_message("Fastq", i)["body"]["nodes"][0] for i in range(n_nodes)]
+        yield f"{n_nodes}-node Fastq aggregate", message
+
+
+def per_call(function, *args, min_seconds=0.3):
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        result = function(*args)
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return elapsed / calls, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 6, 9])
+    args = parser.parse_args()
+
+    print(f"# default threshold: {codec.DEFAULT_COMPRESSION_THRESHOLD:,} bytes")
+    for name, message in payloads():
+        payload = codec.dumps(message)
+        print(f"# {name}: {len(payload):,} bytes")
+        for level in args.levels:
+            seconds, (data, attributes) = per_call(codec.compress_payload, payload, 0, level)
+            decompress_seconds, _ = per_call(codec.decompress_payload, data, attributes)
+            saved = 1 - len(data) / len(payload)
+            report(f"zlib level {level} compress", seconds,
+                   extra=f"{len(data):,} bytes ({saved:.0%} saved), "
+                         f"{(len(payload) - len(data)) / seconds / 2**20:,.0f} MiB saved per CPU second")
+            report(f"zlib level {level} decompress", decompress_seconds)
+
+
+if __name__ == "__main__":
+    main()
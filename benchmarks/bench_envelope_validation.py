@@ -0,0 +1,66 @@
+"""Cost of validating message envelopes, and of rejecting bad messages.
+
+"validate" is envelope.validate_envelope() on an already parsed
+queryResponse. "reader (valid)" and "reader (bad)" construct a
+QueryResponseReader from an event and read its nodes; the bad messages
+are missing body fields, have a null seedId or are of the wrong kind.
+
+    python benchmarks/bench_envelope_validation.py
+"""
+
+import copy
+import time
+import base64
+
+from types import SimpleNamespace
+
+from common import query_response_message, report
+
+from trellisdata import codec
+from trellisdata import envelope
+from trellisdata.messages import QueryResponseReader
+
+
+def per_call(function, argument, min_seconds=0.5):
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        function(argument)
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return elapsed / calls
+
+
+def bad_messages():
+    message = query_response_message("Fastq")
+    missing_nodes = copy.deepcopy(message)
+    del missing_nodes["body"]["nodes"]
+    null_seed = copy.deepcopy(message)
+    null_seed["header"]["seedId"] = None
+    wrong_kind = copy.deepcopy(message)
+    wrong_kind["header"]["messageKind"] = "jobCreated"
+    return {"missing nodes": missing_nodes, "null seedId": null_seed, "wrong kind": wrong_kind}
+
+
+def main():
+    context = SimpleNamespace(event_id=1)
+    message = query_response_message("Fastq")
+
+    report("validate", per_call(lambda m: envelope.validate_envelope(m["header"], m["body"], "queryResponse"), message))
+
+    def read(event):
+        try:
+            QueryResponseReader(context, event).nodes
+        except envelope.MessageValidationError:
+            pass
+
+    event = {'data': base64.b64encode(codec.dumps(message))}
+    report("reader (valid)", per_call(read, event))
+    for name, bad_message in bad_messages().items():
+        event = {'data': base64.b64encode(codec.dumps(bad_message))}
+        report(f"reader (bad: {name})", per_call(read, event))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Cost of decoding Pub/Sub event data into a message, by payload size.
+
+"legacy" is the original MessageReader path: base64.b64decode, decode
+to a UTF-8 str, then json.loads. The other rows time the current
+reader path, read_message(): codec.event_payload() decodes the base64
+data straight to bytes and codec.split_message() parses the header.
+"header" only constructs the reader, as a consumer routing on header
+fields does; "body" also reads the body (codec.load_message_body()).
+The full path is measured with the event data as bytes and as a
+memoryview.
+
+    python benchmarks/bench_event_decode.py --sizes 1 10 100 1000 10000
+"""
+
+import json
+import time
+import base64
+import argparse
+
+from types import SimpleNamespace
+
+from common import query_response_message, report
+
+from trellisdata import codec
+from trellisdata.messages import read_message
+
+
+CONTEXT = SimpleNamespace(event_id="1", timestamp="2022-03-24T23:44:43Z")
+
+
+def legacy(event):
+    pubsub_message = base64.b64decode(event['data']).decode('utf-8')
+    return json.loads(pubsub_message)
+
+
+def read_header(event):
+    return read_message(event, CONTEXT).message_kind
+
+
+def read_body(event):
+    return read_message(event, CONTEXT).body
+
+
+def per_call(function, argument, min_seconds=0.5):
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        function(argument)
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return elapsed / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000, 10000],
+                        help="Number of Fastq nodes per message")
+    args = parser.parse_args()
+
+    print(f"# JSON backend: {codec.get_backend().name}")
+    for n_nodes in args.sizes:
+        message = query_response_message("Fastq")
+        message["body"]["nodes"] = [query_response_message("Fastq", i)["body"]["nodes"][0] for i in range(n_nodes)]
+        data = base64.b64encode(codec.dumps(message))
+        print(f"# {n_nodes} nodes, {len(data) / 1024:,.1f} KiB event data")
+
+        legacy_seconds = per_call(legacy, {'data': data})
+        report("legacy b64decode+str+json.loads", legacy_seconds)
+        for name, function, event in (("read_message header(bytes)", read_header, {'data': data}),
+                                      ("read_message body(bytes)", read_body, {'data': data}),
+                                      ("read_message body(memoryview)", read_body, {'data': memoryview(data)})):
+            seconds = per_call(function, event)
+            report(name, seconds, extra=f"{legacy_seconds / seconds:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Cost of fanning a query result out into one message per entity.
+
+"before" encodes every dict from generate_separate_entity_jsons(), which
+re-serializes the header, query name, job request and result summary
+for each entity. "after" is generate_separate_entity_payloads(), which
+serializes those shared fragments once.
+
+    python benchmarks/bench_fanout.py --entities 2000 20000
+"""
+
+import argparse
+from types import SimpleNamespace
+
+from common import make_graph, measure, report
+
+from trellisdata import codec
+from trellisdata.messages import QueryResponseWriter
+
+
+def result_summary():
+    return SimpleNamespace(
+        metadata={},
+        server=None,
+        query="MATCH (a:Fastq)-[r:GENERATED]->(b:Fastq) RETURN a, r, b",
+        parameters={"sample": "SHIP000000"},
+        query_type="rw",
+        plan=None,
+        profile=None,
+        notifications=None,
+        result_available_after=1,
+        result_consumed_after=3,
+        counters=SimpleNamespace(relationships_created=1))
+
+
+def before(writer):
+    return [codec.dumps(message, default=str) for message in writer.generate_separate_entity_jsons()]
+
+
+def after(writer):
+    return list(writer.generate_separate_entity_payloads())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entities", type=int, nargs="+", default=[2000, 20000])
+    args = parser.parse_args()
+
+    print(f"# JSON backend: {codec.get_backend().name}")
+    for n_entities in args.entities:
+        graph = make_graph(n_entities)
+        writer = QueryResponseWriter(
+            sender="db-query",
+            seed_id=1,
+            previous_event_id=2,
+            query_name="relateFastqs",
+            result_summary=result_summary(),
+            graph=graph,
+            job_request="fastq-to-ubam")
+        print(f"# {len(graph.relationships)} relationships")
+        before_seconds, before_peak, _ = measure(before, writer, repeat=3)
+        report("before (dict per entity)", before_seconds, before_peak)
+        seconds, peak, _ = measure(after, writer, repeat=3)
+        report("after (shared fragments)", seconds, peak, extra=f"{before_seconds / seconds:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
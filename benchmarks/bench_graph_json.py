@@ -0,0 +1,49 @@
+"""Compare the buffered and streaming graph JSON encoders.
+
+The buffered encoder is the original translate_graph_to_json(): it builds
+complete lists of node and relationship dicts and then encodes them in a
+single json.dumps() call. The streaming encoder writes each entity to the
+sink as soon as it has been encoded, so its peak memory should not grow
+with the graph when the sink does not hold the whole document.
+
+    python benchmarks/bench_graph_json.py --entities 100000 200000
+"""
+
+import os
+import json
+import argparse
+
+from common import make_graph, measure, report
+
+from trellisdata import messaging
+
+
+def buffered_to_sink(graph, sink):
+    nodes = [messaging._get_node_dict(node) for node in graph.nodes]
+    relationships = [messaging._get_relationship_dict(rel) for rel in graph.relationships]
+    sink.write(json.dumps({"nodes": nodes, "relationships": relationships}))
+
+
+def streaming_to_sink(graph, sink):
+    messaging.write_graph_json(graph, sink)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entities", type=int, nargs="+", default=[100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with open(os.devnull, "w") as sink:
+        for n_entities in args.entities:
+            graph = make_graph(n_entities)
+            print(f"# {n_entities} entities")
+            for name, function in (
+                    ("buffered json.dumps", buffered_to_sink),
+                    ("streaming write_graph_json", streaming_to_sink)):
+                seconds, peak, _ = measure(function, graph, sink, repeat=args.repeat)
+                report(name, seconds, peak)
+
+
+if __name__ == "__main__":
+    main()
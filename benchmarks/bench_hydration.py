@@ -0,0 +1,61 @@
+"""Per-message cost of hydrating graph JSON into a neo4j.graph.Graph.
+
+"before" reproduces the original translate_json_to_graph(): a new
+HydrationHandler per call, two hydration scopes and one **kwargs call
+per entity. "after" reuses a GraphJsonHydrator, with and without the
+JSON already parsed by the caller.
+
+    python benchmarks/bench_hydration.py --entities 1 100 10000
+"""
+
+import time
+import argparse
+
+from common import make_graph, report
+
+from neo4j._codec.hydration.v2 import HydrationHandler
+
+from trellisdata import codec
+from trellisdata import messaging
+
+
+def before(graph_json):
+    hydration_handler = HydrationHandler()
+    hydration_scope = hydration_handler.new_hydration_scope()
+    graph_dict = codec.loads(graph_json)
+    hydration_scope = hydration_handler.new_hydration_scope()
+    for node in graph_dict['nodes']:
+        hydration_scope._graph_hydrator.hydrate_node(**node)
+    for rel in graph_dict['relationships']:
+        hydration_scope._graph_hydrator.hydrate_relationship(**rel)
+    return hydration_scope.get_graph()
+
+
+def per_call(function, argument, min_seconds=0.5):
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        function(argument)
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return elapsed / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entities", type=int, nargs="+", default=[1, 100, 10000])
+    args = parser.parse_args()
+
+    hydrator = messaging.GraphJsonHydrator()
+    for n_entities in args.entities:
+        graph_json = messaging.translate_graph_to_json(make_graph(n_entities))
+        graph_dict = codec.loads(graph_json)
+        print(f"# {n_entities} entities")
+        report("before: handler per call, **kwargs", per_call(before, graph_json))
+        report("after: reused hydrator, from JSON", per_call(hydrator.hydrate, graph_json))
+        report("after: reused hydrator, parsed dict", per_call(hydrator.hydrate_many, graph_dict))
+
+
+if __name__ == "__main__":
+    main()
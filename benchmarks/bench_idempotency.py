@@ -0,0 +1,81 @@
+"""Cost of checking events for redelivery with IdempotencyCache.
+
+Replays queryResponse events of which --duplicates are redeliveries
+and times is_duplicate() and mark_done() per event with the in-memory
+cache and with the on-disk store, keyed on event ID and on content. The
+atomic IdempotencyCache.seen() is timed on the on-disk store too.
+
+    python benchmarks/bench_idempotency.py --messages 20000 --duplicates 0.1
+"""
+
+import os
+import time
+import base64
+import random
+import argparse
+import tempfile
+
+from types import SimpleNamespace
+
+from common import query_response_message, report
+
+from trellisdata import codec
+from trellisdata.messages import QueryResponseReader
+from trellisdata.idempotency import IdempotencyCache, message_key
+
+
+def replay(readers, cache):
+    start = time.perf_counter()
+    duplicates = 0
+    for reader in readers:
+        if reader.is_duplicate(cache):
+            duplicates += 1
+        else:
+            reader.mark_done(cache)
+    return time.perf_counter() - start, duplicates
+
+
+def replay_seen(readers, cache):
+    # One atomic check-and-record per event
+    start = time.perf_counter()
+    duplicates = sum(cache.seen(message_key(reader)) for reader in readers)
+    return time.perf_counter() - start, duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--duplicates", type=float, default=0.1)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    n_unique = int(args.messages * (1 - args.duplicates))
+    indexes = list(range(n_unique)) + [rng.randrange(n_unique) for _ in range(args.messages - n_unique)]
+    rng.shuffle(indexes)
+    events = [{'data': base64.b64encode(codec.dumps(query_response_message("Fastq", i)))} for i in range(n_unique)]
+
+    print(f"# {args.messages} events, {args.messages - n_unique} redeliveries")
+    with tempfile.TemporaryDirectory() as directory:
+        for key in ("event", "content"):
+            for store in ("memory", "sqlite"):
+                # Readers are rebuilt per replay since content keys parse the body
+                readers = [
+                    QueryResponseReader(SimpleNamespace(event_id=i if key == "event" else None), events[i])
+                    for i in indexes]
+                path = os.path.join(directory, f"{key}.sqlite") if store == "sqlite" else None
+                cache = IdempotencyCache(max_entries=args.messages, path=path)
+                seconds, duplicates = replay(readers, cache)
+                report(f"{key} key, {store}", seconds / len(readers),
+                       extra=f"per event, {duplicates} duplicates, hit rate {cache.hit_rate:.1%}")
+                cache.close()
+
+        readers = [QueryResponseReader(SimpleNamespace(event_id=i), events[i]) for i in indexes]
+        cache = IdempotencyCache(max_entries=args.messages, path=os.path.join(directory, "seen.sqlite"))
+        seconds, duplicates = replay_seen(readers, cache)
+        report("event key, sqlite, seen()", seconds / len(readers),
+               extra=f"per event, {duplicates} duplicates, hit rate {cache.hit_rate:.1%}")
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
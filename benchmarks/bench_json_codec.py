@@ -0,0 +1,64 @@
+"""Compare encode and decode throughput of the available JSON backends.
+
+Payloads are queryResponse messages carrying a single Fastq, Gvcf or
+CromwellStep node, the shape published by db-query for each entity,
+plus a 1,000-node aggregate Fastq response. The "legacy" row is the
+old publish path: json.dumps(indent=4, sort_keys=True, default=str).
+
+    python benchmarks/bench_json_codec.py --iterations 20000
+"""
+
+import json
+import time
+import argparse
+
+from common import query_response_message, report
+
+from trellisdata import codec
+
+
+def payloads():
+    yield "Fastq node", query_response_message("Fastq")
+    yield "Gvcf node", query_response_message("Gvcf")
+    yield "CromwellStep relationship", query_response_message("CromwellStep", relationship=True)
+    aggregate = query_response_message("Fastq")
+    aggregate["body"]["nodes"] = [query_response_message("Fastq", i)["body"]["nodes"][0] for i in range(1000)]
+    yield "Fastq x1000 aggregate", aggregate
+
+
+def throughput(function, argument, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function(argument)
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    legacy_dumps = lambda message: json.dumps(message, indent=4, sort_keys=True, default=str).encode('utf-8')
+
+    for name, message in payloads():
+        iterations = args.iterations if len(message["body"]["nodes"]) < 2 else max(1, args.iterations // 1000)
+        print(f"# {name} ({iterations} iterations)")
+
+        legacy = legacy_dumps(message)
+        seconds = throughput(legacy_dumps, message, iterations)
+        report("legacy encode", seconds, extra=f"{len(legacy)} bytes")
+        seconds = throughput(json.loads, legacy, iterations)
+        report("legacy decode", seconds)
+
+        for backend_name in codec.available_backends():
+            backend = codec.set_backend(backend_name)
+            data = backend.dumps(message)
+            seconds = throughput(backend.dumps, message, iterations)
+            report(f"{backend_name} encode", seconds, extra=f"{len(data)} bytes, {1 / seconds:,.0f} msg/s")
+            seconds = throughput(backend.loads, data, iterations)
+            report(f"{backend_name} decode", seconds, extra=f"{1 / seconds:,.0f} msg/s")
+    codec.set_backend()
+
+
+if __name__ == "__main__":
+    main()
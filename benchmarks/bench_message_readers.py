@@ -0,0 +1,106 @@
+"""Time and memory of replaying queryResponse events through the readers.
+
+"eager" is the previous QueryResponseReader, which copied the header
+and every body field into an instance __dict__ when it was created.
+"lazy" is the current slotted reader. Each replay constructs a reader
+per event and keeps all of them, as a batch consumer would; "route"
+only reads header fields, "full" also reads the nodes and result
+summary.
+
+    python benchmarks/bench_message_readers.py --messages 10000 --nodes 1 20
+"""
+
+import time
+import base64
+import argparse
+import tracemalloc
+
+from types import SimpleNamespace
+
+from common import query_response_message, report
+
+from trellisdata import codec
+from trellisdata.messages import QueryResponseReader
+
+
+class EagerQueryResponseReader:
+
+    def __init__(self, context, event):
+        data = codec.loads(codec.event_payload(event))
+        seed_id = int(data['header'].get('seedId'))
+        previous_event_id = int(data['header'].get('previousEventId'))
+        self.context = context
+        self.message_kind = data['header']['messageKind']
+        self.header = data['header']
+        self.body = data['body']
+        self.sender = data['header']['sender']
+        self.event_id = context.event_id
+        self.seed_id = seed_id
+        self.previous_event_id = previous_event_id or seed_id
+        self.query_name = self.body['queryName']
+        self.result_summary = self.body['resultSummary']
+        self.nodes = [dict(node, properties=codec.decode_properties(node['properties'])) for node in self.body['nodes']]
+        self.relationship = self.body['relationship']
+        self.job_request = self.body['jobRequest']
+
+
+def route(reader_class, context, events):
+    readers = []
+    for event in events:
+        reader = reader_class(context, event)
+        if reader.message_kind == "queryResponse" and reader.seed_id:
+            readers.append(reader)
+    return readers
+
+
+def full(reader_class, context, events):
+    readers = route(reader_class, context, events)
+    for reader in readers:
+        reader.nodes
+        reader.result_summary
+    return readers
+
+
+def run(function, reader_class, context, events, repeat=3):
+    seconds = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(reader_class, context, events)
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    tracemalloc.start()
+    readers = function(reader_class, context, events)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del readers
+    return seconds, retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1, 20],
+                        help="Fastq nodes per message")
+    args = parser.parse_args()
+
+    context = SimpleNamespace(event_id=1)
+    print(f"# JSON backend: {codec.get_backend().name}")
+    for n_nodes in args.nodes:
+        events = []
+        for i in range(args.messages):
+            message = query_response_message("Fastq", i)
+            message["body"]["nodes"] = [query_response_message("Fastq", i + j)["body"]["nodes"][0] for j in range(n_nodes)]
+            events.append({'data': base64.b64encode(codec.dumps(message))})
+        print(f"# {args.messages} messages with {n_nodes} nodes")
+        for function in (route, full):
+            eager_seconds, eager_retained = run(function, EagerQueryResponseReader, context, events)
+            report(f"eager {function.__name__}", eager_seconds,
+                   extra=f"{eager_retained / 2**20:.1f} MiB retained")
+            seconds, retained = run(function, QueryResponseReader, context, events)
+            report(f"lazy {function.__name__}", seconds,
+                   extra=f"{retained / 2**20:.1f} MiB retained, {eager_seconds / seconds:.2f}x faster")
+
+
+if __name__ == "__main__":
+    main()
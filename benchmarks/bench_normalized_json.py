@@ -0,0 +1,54 @@
+"""Payload size and translation time of the graph JSON layouts.
+
+"embedded" is the layout QueryResponseWriter uses for relationships,
+with full start_node and end_node dictionaries inside every
+relationship. "standard" is translate_graph_to_json() and "normalized"
+is translate_graph_to_normalized_json().
+
+    python benchmarks/bench_normalized_json.py --entities 1000 100000
+"""
+
+import argparse
+
+from common import make_graph, measure, report
+
+from trellisdata import codec
+from trellisdata import messaging
+
+
+def embedded(graph):
+    def node_dict(node):
+        return {"id": node.id, "labels": list(node.labels), "properties": dict(node.items())}
+    relationships = [{
+        "id": rel.id,
+        "start_node": node_dict(rel.start_node),
+        "end_node": node_dict(rel.end_node),
+        "type": rel.type,
+        "properties": dict(rel.items())}
+        for rel in graph.relationships]
+    return codec.dumps_str({"nodes": [node_dict(node) for node in graph.nodes], "relationships": relationships})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entities", type=int, nargs="+", default=[1000, 100000])
+    args = parser.parse_args()
+
+    for n_entities in args.entities:
+        graph = make_graph(n_entities)
+        print(f"# {n_entities} entities")
+        sizes = {}
+        for name, encode in (("embedded", embedded),
+                             ("standard", messaging.translate_graph_to_json),
+                             ("normalized", messaging.translate_graph_to_normalized_json)):
+            seconds, _, graph_json = measure(encode, graph)
+            sizes[name] = len(graph_json)
+            report(f"{name} encode", seconds, extra=f"{len(graph_json):,} bytes, "
+                   f"{sizes['embedded'] / len(graph_json):.2f}x smaller than embedded")
+            if name != "embedded":
+                seconds, _, _ = measure(messaging.translate_json_to_graph, graph_json)
+                report(f"{name} hydrate", seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Compare PackStream and JSON graph payloads.
+
+Both encodings are measured the way they travel through Pub/Sub:
+base64-encoded event data that the reader decodes and hydrates into a
+neo4j.graph.Graph.
+
+    python benchmarks/bench_packstream.py --entities 1 100 10000
+"""
+
+import base64
+import argparse
+
+from common import make_graph, measure, report
+
+from trellisdata import codec
+from trellisdata import messaging
+
+
+def json_encode(graph):
+    return base64.b64encode(messaging.translate_graph_to_json(graph).encode('utf-8'))
+
+
+def json_decode(event_data):
+    return messaging.translate_json_to_graph(base64.b64decode(event_data))
+
+
+def packstream_encode(graph):
+    return base64.b64encode(messaging.translate_graph_to_packstream(graph))
+
+
+def packstream_decode(event_data):
+    return messaging.translate_packstream_to_graph(base64.b64decode(event_data))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entities", type=int, nargs="+", default=[1, 100, 10000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"# JSON backend: {codec.get_backend().name}")
+    for n_entities in args.entities:
+        graph = make_graph(n_entities)
+        print(f"# {n_entities} entities")
+        for name, encode, decode in (
+                ("json+base64", json_encode, json_decode),
+                ("packstream+base64", packstream_encode, packstream_decode)):
+            seconds, _, event_data = measure(encode, graph, repeat=args.repeat)
+            report(f"{name} encode", seconds, extra=f"{len(event_data)} bytes")
+            seconds, peak, _ = measure(decode, event_data, repeat=args.repeat)
+            report(f"{name} decode", seconds, peak)
+
+
+if __name__ == "__main__":
+    main()
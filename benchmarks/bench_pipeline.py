@@ -0,0 +1,135 @@
+"""End-to-end throughput and latency of a two-function pipeline.
+
+A load generator publishes queryRequest messages, written with
+QueryRequestWriter, to an InMemoryBroker at a target rate. A "db-query"
+function reads each request and publishes a QueryResponseWriter result
+of --entities relationships, one message per entity or packed with
+--batch. A "trigger" function reads the responses. A request's latency
+is the time from its publish until the trigger has read all of its
+entities. Reader latency records are then broken down per hop by
+latency.LatencyAnalyzer.
+
+    python benchmarks/bench_pipeline.py --requests 200 --entities 20 --rate 0
+    python benchmarks/bench_pipeline.py --requests 200 --entities 20 --batch --workers 4
+"""
+
+import time
+import argparse
+import threading
+
+from bench_fanout import result_summary
+from common import make_graph, report
+
+from trellisdata import codec
+from trellisdata.latency import LatencyAnalyzer
+from trellisdata.pubsub import BatchPublisher, InMemoryBroker
+from trellisdata.messages import QueryRequestWriter, QueryResponseWriter, QueryRequestReader, read_message
+
+
+PROJECT = "load-test"
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class Pipeline:
+
+    def __init__(self, broker, graph, batch, workers):
+        self.graph = graph
+        self.batch = batch
+        self.entities_per_request = len(graph.relationships)
+        self.sent = {}
+        self.latencies = []
+        self.analyzer = LatencyAnalyzer(clock='monotonic')
+        self._received = {}
+        self._lock = threading.Lock()
+
+        self.publisher = BatchPublisher(broker, PROJECT, max_latency=0.005)
+        broker.subscribe(broker.topic_path(PROJECT, "query-requests"), self.db_query, workers=workers)
+        broker.subscribe(broker.topic_path(PROJECT, "query-responses"), self.trigger, workers=workers)
+
+    def db_query(self, event, context):
+        request = QueryRequestReader(context, event)
+        self.analyzer.add_reader(request)
+        writer = QueryResponseWriter(
+                                     sender="db-query",
+                                     seed_id=request.seed_id,
+                                     previous_event_id=request.event_id,
+                                     query_name=request.query_name,
+                                     result_summary=result_summary(),
+                                     graph=self.graph,
+                                     job_request=None)
+        payloads = writer.generate_batch_payloads() if self.batch else writer.generate_separate_entity_payloads()
+        for payload in payloads:
+            self.publisher.publish_bytes("query-responses", payload)
+        self.publisher.flush()
+
+    def trigger(self, event, context):
+        reader = read_message(event, context)
+        responses = list(reader) if reader.message_kind == "queryResponseBatch" else [reader]
+        for response in responses:
+            response.relationship
+        seed_id = reader.seed_id
+        self.analyzer.add_reader(reader)
+        with self._lock:
+            received = self._received.get(seed_id, 0) + len(responses)
+            self._received[seed_id] = received
+            if received == self.entities_per_request:
+                self.latencies.append(time.perf_counter() - self.sent[seed_id])
+
+    def send(self, n_requests, rate):
+        interval = 1 / rate if rate else 0
+        start = time.perf_counter()
+        for i in range(n_requests):
+            if interval:
+                delay = start + i * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            # Seeds are event IDs; keep them apart from the broker's
+            seed_id = 10**9 + i
+            message = QueryRequestWriter(
+                                         sender="load-generator",
+                                         seed_id=seed_id,
+                                         previous_event_id=seed_id,
+                                         query_name="relateFastqs",
+                                         query_parameters={"sample": f"SHIP{i:06d}"}).format_json_message()
+            self.sent[seed_id] = time.perf_counter()
+            self.publisher.publish("query-requests", message)
+        self.publisher.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--entities", type=int, default=20, help="relationships per query result")
+    parser.add_argument("--rate", type=float, default=0, help="requests per second, 0 for unthrottled")
+    parser.add_argument("--workers", type=int, default=1, help="threads per function")
+    parser.add_argument("--batch", action="store_true", help="publish queryResponseBatch messages")
+    args = parser.parse_args()
+
+    broker = InMemoryBroker(keep_messages=False)
+    pipeline = Pipeline(broker, make_graph(args.entities * 2 + 1), args.batch, args.workers)
+    print(f"# JSON backend: {codec.get_backend().name}, {args.requests} requests of "
+          f"{pipeline.entities_per_request} relationships, {'batched' if args.batch else 'separate'} responses")
+
+    start = time.perf_counter()
+    pipeline.send(args.requests, args.rate)
+    broker.join()
+    seconds = time.perf_counter() - start
+    pipeline.publisher.close()
+    broker.close()
+
+    messages = sum(
+        subscription.delivered
+        for subscriptions in broker.subscriptions.values()
+        for subscription in subscriptions)
+    latencies = sorted(pipeline.latencies)
+    report("total", seconds, extra=f"{args.requests / seconds:,.0f} requests/s, {messages / seconds:,.0f} messages/s")
+    for fraction in (0.5, 0.9, 0.99):
+        report(f"p{fraction * 100:g} latency", percentile(latencies, fraction))
+    print(pipeline.analyzer.format_summary())
+
+
+if __name__ == "__main__":
+    main()
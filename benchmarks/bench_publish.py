@@ -0,0 +1,54 @@
+"""Publish throughput of a fan-out loop against a simulated Pub/Sub round trip.
+
+"blocking" is utils.publish_bytes_to_topic(), which waits for every
+acknowledgement. "batched" is BatchPublisher, waiting once at the end.
+Both publish the per-entity payloads of a queryResponse fan-out to an
+InMemoryPublisher whose acknowledgements take --latency seconds.
+
+    python benchmarks/bench_publish.py --messages 200 5000 --latency 0.005
+"""
+
+import time
+import argparse
+
+from common import query_response_message
+
+from trellisdata import codec
+from trellisdata import utils
+from trellisdata.pubsub import BatchPublisher, InMemoryPublisher
+
+
+def blocking(client, payloads):
+    for payload in payloads:
+        utils.publish_bytes_to_topic(client, "project", "topic", payload)
+
+
+def batched(client, payloads):
+    with BatchPublisher(client, "project") as publisher:
+        for payload in payloads:
+            publisher.publish_bytes("topic", payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, nargs="+", default=[200, 5000])
+    parser.add_argument("--latency", type=float, default=0.005)
+    args = parser.parse_args()
+
+    print(f"# simulated acknowledgement latency: {args.latency * 1000:.1f} ms")
+    for n_messages in args.messages:
+        payloads = [codec.dumps(query_response_message("Fastq", i)) for i in range(n_messages)]
+        print(f"# {n_messages} messages")
+        for name, publish in (("blocking", blocking), ("batched", batched)):
+            if name == "blocking" and n_messages * args.latency > 10:
+                print(f"{name:<40} skipped (>10 s)")
+                continue
+            client = InMemoryPublisher(latency=args.latency)
+            start = time.perf_counter()
+            publish(client, payloads)
+            seconds = time.perf_counter() - start
+            print(f"{name:<40} {seconds * 1000:>10.1f} ms {n_messages / seconds:>10,.0f} messages/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Time to read a replay of mixed queryRequest, queryResponse and
+jobCreated events.
+
+"probe" is how a worker consuming mixed topics had to pick a reader
+before read_message(): construct a MessageReader to learn the
+messageKind, then construct the matching reader, decoding the event
+twice. "read_message" decodes each event once.
+
+    python benchmarks/bench_read_message.py --messages 30000
+"""
+
+import time
+import base64
+import argparse
+
+from types import SimpleNamespace
+
+from common import query_response_message, report
+
+from trellisdata import codec
+from trellisdata.messages import MessageReader, READER_CLASSES, read_message
+
+
+def messages():
+    header = {"sender": "bench", "seedId": 1, "previousEventId": 2}
+    yield {"header": dict(header, messageKind="queryRequest"), "body": {
+        "queryName": "relateFastqs", "queryParameters": {"sample": "SHIP000000"}, "custom": False}}
+    yield query_response_message("Fastq")
+    yield {"header": dict(header, messageKind="jobCreated"), "body": {
+        "jobDict": {"name": "fastq-to-ubam", "inputIds": [1, 2]}}}
+
+
+def probe(events, context):
+    return [READER_CLASSES[MessageReader(context, event).message_kind](context, event) for event in events]
+
+
+def dispatch(events, context):
+    return [read_message(event, context) for event in events]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=30000)
+    args = parser.parse_args()
+
+    context = SimpleNamespace(event_id=1)
+    kinds = [{'data': base64.b64encode(codec.dumps(message))} for message in messages()]
+    events = [kinds[i % len(kinds)] for i in range(args.messages)]
+    print(f"# JSON backend: {codec.get_backend().name}")
+    print(f"# {args.messages} events of {len(kinds)} kinds")
+    results = {}
+    for name, function in (("probe", probe), ("read_message", dispatch)):
+        seconds = None
+        for _ in range(3):
+            start = time.perf_counter()
+            function(events, context)
+            elapsed = time.perf_counter() - start
+            seconds = elapsed if seconds is None else min(seconds, elapsed)
+        results[name] = seconds
+        report(name, seconds, extra=f"{results['probe'] / seconds:.2f}x faster than probe")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Activations avoided by trigger property conditions, and their cost.
+
+CromwellStep nodes are evaluated against one trigger per WDL call
+alias, as our per-task triggers are. "labels only" triggers activate
+for every CromwellStep node, so each query runs in Neo4j and matches
+nothing for all but one alias. "conditions" triggers declare the alias
+with an `in` condition and a shard range, so only matching triggers
+are activated.
+
+    python benchmarks/bench_trigger_conditions.py --aliases 3 20 --nodes 20000
+"""
+
+import argparse
+
+from common import cromwell_step_properties, measure, report
+
+from trellisdata.database_trigger import TriggerController
+
+
+def trigger_document(aliases, conditions):
+    documents = []
+    for alias in aliases:
+        condition = f"""
+    conditions:
+        wdlCallAlias:
+            in: [{alias}]
+        shardIndex:
+            gte: 0
+            lt: 24""" if conditions else ""
+        documents.append(f"""--- !DatabaseTrigger
+name: Launch{alias}
+pattern: node
+start:
+    label: CromwellStep
+    properties:
+        cromwellWorkflowId: workflow_id
+        shardIndex: shard{condition}
+query: launch{alias}
+""")
+    return "".join(documents)
+
+
+def evaluate_all(controller, nodes):
+    return sum(len(controller._match_node_triggers(node)) for node in nodes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--aliases", type=int, nargs="+", default=[3, 20])
+    parser.add_argument("--nodes", type=int, default=20000)
+    args = parser.parse_args()
+
+    for n_aliases in args.aliases:
+        aliases = [f"Task{i}" for i in range(n_aliases)]
+        nodes = []
+        for i in range(args.nodes):
+            properties = cromwell_step_properties(i)
+            properties["wdlCallAlias"] = aliases[i % n_aliases]
+            nodes.append({"id": i, "labels": ["CromwellStep"], "properties": properties})
+
+        print(f"# {n_aliases} alias triggers, {args.nodes} CromwellStep nodes")
+        plain_seconds, _, plain_activations = measure(
+            evaluate_all, TriggerController(trigger_document(aliases, False)), nodes, repeat=3)
+        report("labels only", plain_seconds / args.nodes, extra=f"per node, {plain_activations:,} activated queries")
+        seconds, _, activations = measure(
+            evaluate_all, TriggerController(trigger_document(aliases, True)), nodes, repeat=3)
+        report("conditions", seconds / args.nodes,
+               extra=f"per node, {activations:,} activated queries, "
+                     f"{plain_activations - activations:,} wasted queries avoided")
+
+
+if __name__ == "__main__":
+    main()
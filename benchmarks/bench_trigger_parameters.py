@@ -0,0 +1,101 @@
+"""Per-activation cost of getting a trigger's query parameters.
+
+"walk" is the previous extraction: a loop over each property to
+parameter mapping with a dict lookup in a try block per property.
+"compiled" is DatabaseTrigger.extract_parameters(), which calls one
+operator.itemgetter per mapping compiled when the triggers are loaded.
+Relationship triggers map --properties properties of the start node,
+the end node and the relationship.
+
+    python benchmarks/bench_trigger_parameters.py --properties 1 3 8
+"""
+
+import time
+import argparse
+
+from common import fastq_properties, report
+
+from trellisdata.database_trigger import TriggerController
+
+
+def get_parameter_values(parameter_mapping, properties, parameters, entity_label):
+    for property_name, parameter_name in parameter_mapping.items():
+        try:
+            parameters[parameter_name] = properties[property_name]
+        except KeyError:
+            raise KeyError(f"{entity_label} is missing property {property_name}.")
+    return parameters
+
+
+def walk(trigger, start_properties, end_properties, rel_properties):
+    start_parameters = trigger.start.get('properties')
+    end_parameters = trigger.end.get('properties')
+    rel_parameters = trigger.relationship.get('properties')
+
+    parameters = {}
+    if start_parameters:
+        parameters = get_parameter_values(start_parameters, start_properties, parameters, trigger.start['label'])
+    if end_parameters:
+        parameters = get_parameter_values(end_parameters, end_properties, parameters, trigger.end['label'])
+    if rel_parameters:
+        parameters = get_parameter_values(rel_parameters, rel_properties, parameters, trigger.relationship['type'])
+    return parameters
+
+
+def compiled(trigger, start_properties, end_properties, rel_properties):
+    return trigger.extract_parameters(start_properties, end_properties, rel_properties)
+
+
+def trigger_document(property_names):
+    def mapping(prefix):
+        return "".join(f"\n        {name}: {prefix}_{name}" for name in property_names)
+    return f"""--- !DatabaseTrigger
+name: LaunchFastqToUbam
+pattern: relationship
+start:
+    label: Fastq
+    properties:{mapping("start")}
+end:
+    label: Fastq
+    properties:{mapping("end")}
+relationship:
+    type: GENERATED
+    properties:{mapping("rel")}
+query: launchFastqToUbam
+"""
+
+
+def per_call(function, args, min_seconds=0.3):
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        for _ in range(1000):
+            function(*args)
+        calls += 1000
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return elapsed / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--properties", type=int, nargs="+", default=[1, 3, 8])
+    args = parser.parse_args()
+
+    properties = fastq_properties(0)
+    for n_properties in args.properties:
+        property_names = sorted(properties)[:n_properties]
+        controller = TriggerController(trigger_document(property_names))
+        trigger = controller.relationship_triggers["Fastq"][0]
+        call_args = (trigger, properties, fastq_properties(1), properties)
+        assert walk(*call_args) == compiled(*call_args)
+
+        print(f"# {n_properties} properties per entity, {3 * n_properties} parameters")
+        walk_seconds = per_call(walk, call_args)
+        report("walk", walk_seconds)
+        seconds = per_call(compiled, call_args)
+        report("compiled", seconds, extra=f"{walk_seconds / seconds:.2f}x faster")
+
+
+if __name__ == "__main__":
+    main()
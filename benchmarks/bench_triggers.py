@@ -0,0 +1,137 @@
+"""Time to match relationship query responses against many triggers.
+
+Triggers are generated over --labels node labels and 8 relationship
+types. Every start label has --triggers / --labels triggers, so the
+previous matching, which scanned all triggers of the start node's
+labels comparing relationship type and end label ("scan"), slows down
+as triggers are added. The controller's (start, type, end) index
+("index") probes once per start and end label combination. Nodes carry
+a shared "Blob" label plus one or more specific labels, as ours do.
+
+"evaluate_many" evaluates all responses in one call and groups the
+activations by query with duplicate parameter sets removed; the number
+of batched queries to issue is compared with the one query per
+activation issued when responses are evaluated one by one.
+
+    python benchmarks/bench_triggers.py --triggers 100 1000 5000
+"""
+
+import random
+import logging
+import argparse
+
+from types import SimpleNamespace
+
+from common import measure, report
+
+from trellisdata.database_trigger import TriggerController
+
+
+RELATIONSHIP_TYPES = ["GENERATED", "HAS_INDEX", "WAS_USED_BY", "HAS_SEQUENCING_READS",
+                      "HAS_BIOLOGICAL_OME", "INPUT_TO", "OUTPUT", "STATUS"]
+
+
+class ScanTriggerController(TriggerController):
+    """Relationship matching as it was before the triple index."""
+
+    def _evaluate_relationship_triggers(self, query_response):
+        relationship = query_response.relationship
+        start_labels = relationship['start_node']['labels']
+
+        start_triggers = []
+        for label in start_labels:
+            label_triggers = self.relationship_triggers.get(label)
+            if label_triggers:
+                start_triggers.extend(label_triggers)
+        candidate_triggers = set(start_triggers)
+
+        trigger_names = [trigger.name for trigger in candidate_triggers]
+        logging.info(f"#> Triggers that match start node '{start_labels}': {trigger_names}.")
+
+        end_labels = relationship['end_node']['labels']
+        relationship_type = relationship['type']
+
+        activated_triggers = []
+        for trigger in candidate_triggers:
+            if (
+                trigger.relationship['type'] == relationship_type and
+                trigger.end['label'] in end_labels):
+                parameters = self._get_relationship_trigger_parameters(
+                    trigger,
+                    relationship['start_node']['properties'],
+                    relationship['end_node']['properties'],
+                    relationship['properties'])
+                activated_triggers.append((trigger, parameters))
+            else:
+                logging.debug(f"#> {trigger.name} not activated. " +
+                    f"Triple relationship {relationship_type} does not match {trigger.relationship['type']} " +
+                    f"or trigger label '{trigger.end['label']}' not in end node labels: {end_labels}.")
+        return activated_triggers
+
+
+def trigger_document(n_triggers, labels, rng):
+    documents = []
+    for i in range(n_triggers):
+        documents.append(f"""--- !DatabaseTrigger
+name: Trigger{i}
+pattern: relationship
+start:
+    label: {labels[i % len(labels)]}
+end:
+    label: {rng.choice(labels)}
+    properties:
+        sample: sample
+relationship:
+    type: {rng.choice(RELATIONSHIP_TYPES)}
+query: query{i}
+""")
+    return "".join(documents)
+
+
+def responses(n_responses, labels, labels_per_node, n_samples, rng):
+    for i in range(n_responses):
+        def node(node_id):
+            return {"id": node_id, "labels": ["Blob"] + rng.sample(labels, labels_per_node),
+                    "properties": {"sample": f"SHIP{rng.randrange(n_samples):06d}"}}
+        yield SimpleNamespace(nodes=[], relationship={
+            "id": i, "start_node": node(2 * i), "end_node": node(2 * i + 1),
+            "type": rng.choice(RELATIONSHIP_TYPES), "properties": {}})
+
+
+def evaluate_all(controller, query_responses):
+    return sum(len(controller.evaluate_trigger_conditions(response)) for response in query_responses)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--triggers", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--labels", type=int, default=50)
+    parser.add_argument("--labels-per-node", type=int, default=2)
+    parser.add_argument("--responses", type=int, default=5000)
+    parser.add_argument("--samples", type=int, default=100, help="distinct sample property values")
+    args = parser.parse_args()
+
+    # Cloud Functions log at INFO
+    logging.basicConfig(level=logging.INFO, handlers=[logging.NullHandler()])
+    rng = random.Random(0)
+    labels = [f"Label{i}" for i in range(args.labels)]
+    query_responses = list(responses(args.responses, labels, args.labels_per_node, args.samples, rng))
+
+    for n_triggers in args.triggers:
+        document = trigger_document(n_triggers, labels, rng)
+        print(f"# {n_triggers} triggers, {args.responses} responses")
+        scan_seconds, _, scan_matches = measure(evaluate_all, ScanTriggerController(document), query_responses, repeat=3)
+        report("scan", scan_seconds / args.responses, extra=f"per response, {scan_matches} activations")
+        seconds, _, matches = measure(evaluate_all, TriggerController(document), query_responses, repeat=3)
+        assert matches == scan_matches
+        report("index", seconds / args.responses, extra=f"per response, {scan_seconds / seconds:.1f}x faster")
+        controller = TriggerController(document)
+        many_seconds, _, activations = measure(controller.evaluate_many, query_responses, repeat=3)
+        parameter_sets = sum(map(len, activations.values()))
+        report("evaluate_many", many_seconds / args.responses,
+               extra=f"per response, {len(activations)} batched queries of {parameter_sets} "
+                     f"parameter sets instead of {matches} queries")
+
+
+if __name__ == "__main__":
+    main()
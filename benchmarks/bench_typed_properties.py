@@ -0,0 +1,53 @@
+"""Cost of encoding entity properties that hold Neo4j temporal values.
+
+"default=str" is the previous publish path, which flattens every
+DateTime to a string that cannot be hydrated again. "encode_value" tags
+values through codec's type-dispatch table so they round-trip.
+
+    python benchmarks/bench_typed_properties.py --nodes 10000
+    TRELLIS_JSON_BACKEND=json python benchmarks/bench_typed_properties.py
+"""
+
+import argparse
+
+from neo4j.time import Date, DateTime
+
+from common import fastq_properties, measure, report
+
+from trellisdata import codec
+
+
+def properties(n_nodes):
+    for i in range(n_nodes):
+        node_properties = fastq_properties(i)
+        node_properties["timeCreated"] = DateTime(2022, 3, 24, 23, 44, 43, 241000000 + i)
+        node_properties["timeUpdated"] = DateTime(2022, 3, 25, 1, 2, 3, i)
+        node_properties["dateCreated"] = Date(2022, 3, 24)
+        yield node_properties
+
+
+def before(entities):
+    return [codec.dumps(entity, default=str) for entity in entities]
+
+
+def after(entities):
+    return [codec.dumps(entity, default=codec.encode_value) for entity in entities]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nodes", type=int, nargs="+", default=[10000])
+    args = parser.parse_args()
+
+    print(f"# JSON backend: {codec.get_backend().name}")
+    for n_nodes in args.nodes:
+        entities = list(properties(n_nodes))
+        print(f"# {n_nodes} Fastq property dicts with 3 temporal values each")
+        before_seconds, _, _ = measure(before, entities, repeat=3)
+        report("default=str", before_seconds)
+        seconds, _, _ = measure(after, entities, repeat=3)
+        report("encode_value", seconds, extra=f"{before_seconds / seconds:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
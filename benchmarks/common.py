@@ -0,0 +1,195 @@
+"""Shared fixtures for the trellisdata benchmark scripts.
+
+The scripts in this directory are run by hand, e.g.
+
+    python benchmarks/bench_graph_json.py --entities 100000
+
+and expect trellisdata to be importable (installed, or src/ on PYTHONPATH).
+"""
+
+import time
+import tracemalloc
+
+from neo4j._codec.hydration.v2 import HydrationHandler
+
+
+def fastq_properties(index):
+    """Properties shaped like a Fastq node created by trellis-create-blob-node."""
+    sample = f"SHIP{index // 8:06d}"
+    read_group = (index // 2) % 4
+    mate_pair = index % 2 + 1
+    name = f"{sample}_{read_group}_R{mate_pair}"
+    path = f"va_mvp_phase2/DVALABP000123/{sample}/FASTQ/{name}.fastq.gz"
+    return {
+        "basename": f"{name}.fastq.gz",
+        "bucket": "va-big-data-bucket",
+        "componentCount": 1,
+        "crc32c": "QeBQQg==",
+        "dirname": f"va_mvp_phase2/DVALABP000123/{sample}/FASTQ",
+        "etag": "CLyInPH23/YCEAg=",
+        "extension": "fastq.gz",
+        "filetype": "gz",
+        "generation": str(1648165483119676 + index),
+        "gitCommitHash": "80423e1",
+        "id": f"va-big-data-bucket/{path}/{1648165483119676 + index}",
+        "kind": "storage#object",
+        "matePair": mate_pair,
+        "name": name,
+        "nodeCreated": 1671062439357 + index,
+        "nodeIteration": "initial",
+        "path": path,
+        "plate": "DVALABP000123",
+        "readGroup": read_group,
+        "sample": sample,
+        "size": 6495426765,
+        "storageClass": "REGIONAL",
+        "timeCreatedEpoch": 1648165483.241,
+        "timeCreatedIso": "2022-03-24T23:44:43.241000+00:00",
+        "trellisUuid": "c404391b-6f1d-45b0-a7fe-99677a3543af",
+        "uri": f"gs://va-big-data-bucket/{path}",
+    }
+
+
+def gvcf_properties(index):
+    """Properties shaped like a Gvcf node produced by the GATK workflow."""
+    sample = f"SHIP{index:06d}"
+    path = f"va_mvp_phase2/DVALABP000123/{sample}/gatk-5-dollar/210301-000000-000-abcd1234/output/germline_single_sample_workflow/a1b2c3/call-MergeVCFs/{sample}.g.vcf.gz"
+    return {
+        "basename": f"{sample}.g.vcf.gz",
+        "bucket": "va-big-data-output-bucket",
+        "crc32c": "Zm9vYg==",
+        "extension": "g.vcf.gz",
+        "filetype": "gz",
+        "generation": str(1614556800000000 + index),
+        "id": f"va-big-data-output-bucket/{path}/{1614556800000000 + index}",
+        "name": sample,
+        "nodeCreated": 1614556800000 + index,
+        "path": path,
+        "plate": "DVALABP000123",
+        "sample": sample,
+        "size": 7316582134,
+        "cromwellWorkflowId": "a1b2c3d4-0000-4000-8000-000000000000",
+        "cromwellWorkflowName": "germline_single_sample_workflow",
+        "wdlCallAlias": "MergeVCFs",
+        "trellisTaskId": "210301-000000-000-abcd1234",
+        "uri": f"gs://va-big-data-output-bucket/{path}",
+    }
+
+
+def cromwell_step_properties(index):
+    """Properties shaped like a CromwellStep node created from a Cromwell log."""
+    return {
+        "cromwellWorkflowId": "a1b2c3d4-0000-4000-8000-000000000000",
+        "cromwellWorkflowName": "germline_single_sample_workflow",
+        "wdlCallAlias": ["HaplotypeCaller", "MergeVCFs", "BaseRecalibrator"][index % 3],
+        "instanceName": f"google-pipelines-worker-{index:032x}",
+        "instanceId": str(6433280663749256939 + index),
+        "startTime": "2021-11-04T23:16:53.95614Z",
+        "startTimeEpoch": 1636067813.95614,
+        "stopTime": "2021-11-05T02:16:53.95614Z",
+        "stopTimeEpoch": 1636078613.95614,
+        "status": "STOPPED",
+        "shardIndex": index % 24,
+        "attempt": 1,
+        "preemptible": True,
+        "zones": ["us-west1-a", "us-west1-b"],
+    }
+
+
+PROPERTY_FACTORIES = {
+    "Fastq": fastq_properties,
+    "Gvcf": gvcf_properties,
+    "CromwellStep": cromwell_step_properties,
+}
+
+
+def query_response_message(label, index=0, relationship=False):
+    """A queryResponse message dict as published by db-query for one entity."""
+    properties = PROPERTY_FACTORIES[label](index)
+    node = {"id": index, "labels": ["Blob", label], "properties": properties}
+    body = {
+        "queryName": f"relate{label}",
+        "jobRequest": None,
+        "nodes": [],
+        "relationship": {},
+        "resultSummary": {
+            "query": "MATCH (n) RETURN n",
+            "parameters": {"sample": properties.get("sample", "SHIP000000")},
+            "query_type": "r",
+            "plan": None,
+            "profile": None,
+            "notifications": None,
+            "counters": {},
+            "result_available_after": 1,
+            "result_consumed_after": 3,
+        },
+    }
+    if relationship:
+        body["relationship"] = {
+            "id": index,
+            "start_node": node,
+            "end_node": {"id": index + 1, "labels": ["Sample"], "properties": {"sample": properties.get("sample")}},
+            "type": "GENERATED",
+            "properties": {},
+        }
+    else:
+        body["nodes"] = [node]
+    return {
+        "header": {
+            "messageKind": "queryResponse",
+            "sender": "db-query",
+            "seedId": 1062325217821887,
+            "previousEventId": 1062332838591023,
+        },
+        "body": body,
+    }
+
+
+def make_graph(n_entities):
+    """Build a neo4j.graph.Graph with roughly n_entities nodes and relationships.
+
+    Every Fastq node is connected to the following one by a GENERATED
+    relationship, which is the shape of our provenance chains.
+    """
+    n_nodes = max(1, (n_entities + 1) // 2)
+    scope = HydrationHandler().new_hydration_scope()
+    hydrator = scope._graph_hydrator
+    for i in range(n_nodes):
+        hydrator.hydrate_node(i, ["Blob", "Fastq"], fastq_properties(i), f"4:db:{i}")
+    for i in range(n_nodes - 1):
+        hydrator.hydrate_relationship(
+            i, i, i + 1, "GENERATED", {"ordinal": i},
+            f"5:db:{i}", f"4:db:{i}", f"4:db:{i + 1}")
+    return scope.get_graph()
+
+
+def measure(function, *args, repeat=1, **kwargs):
+    """Run a function and report its best wall time and peak traced memory.
+
+    Returns:
+        (seconds, peak_bytes, result)
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    function(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def report(name, seconds, peak_bytes=None, extra=""):
+    if seconds < 0.01:
+        line = f"{name:<40} {seconds * 1e6:>10.2f} us"
+    else:
+        line = f"{name:<40} {seconds * 1000:>10.1f} ms"
+    if peak_bytes is not None:
+        line += f" {peak_bytes / 2**20:>10.1f} MiB peak"
+    if extra:
+        line += f"  {extra}"
+    print(line)
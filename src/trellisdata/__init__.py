@@ -1,5 +1,6 @@
 from .database_trigger import TriggerController
 from .database_trigger import DatabaseTrigger
+from .database_trigger import ActivationCoalescer
 
 #from .database_trigger import Node
 #from .database_trigger import Relationship
@@ -10,6 +11,14 @@ from .messages import QueryRequestWriter
 from .messages import QueryRequestReader
 from .messages import QueryResponseWriter
 from .messages import QueryResponseReader
+from .messages import QueryResponseBatchReader
+from .messages import JobCreatedReader
+from .messages import read_message
+from .messages import register_reader
+from .messages import MessageDispatcher
+from .envelope import MessageValidationError
+from .idempotency import IdempotencyCache
+from .latency import LatencyAnalyzer
 #from .messages import JobLauncherResponse
 
 from .operation_grapher import OperationGrapher
@@ -21,4 +30,19 @@ from .job_launcher import JobRequest
 
 from .messaging import translate_graph_to_json
 from .messaging import translate_json_to_graph
+from .messaging import GraphJsonHydrator
+from .messaging import split_json_graph_entities
 from .messaging import translate_record_to_json
+from .messaging import translate_records_to_json
+from .messaging import iter_records_to_json
+from .messaging import iter_graph_json
+from .messaging import write_graph_json
+from .messaging import translate_graph_to_normalized_json
+from .messaging import translate_graph_to_packstream
+from .messaging import translate_packstream_to_graph
+
+from .lazy_graph import LazyGraph
+
+from .pubsub import BatchPublisher
+from .pubsub import InMemoryPublisher
+from .pubsub import InMemoryBroker
@@ -0,0 +1,645 @@
+"""JSON and PackStream encoding for Trellis messages.
+
+Every messaging path (graph translation, message readers and the
+Pub/Sub publish helpers) encodes and decodes through this module so
+that the JSON library can be swapped in one place. A native backend
+(orjson, installed by the trellisdata[orjson] extra) is used when it is
+installed; otherwise the standard library json module is used. Both
+produce compact UTF-8 bytes with no whitespace between tokens.
+
+The backend can be forced with the TRELLIS_JSON_BACKEND environment
+variable or set_backend().
+
+Messages can also be sent as PackStream, the binary format used by the
+Neo4j Bolt protocol. PackStream payloads start with a version byte
+(PACKSTREAM_V1) that can never begin a JSON document, so
+decode_message() detects the format from the first byte.
+
+Payloads larger than a threshold are zlib compressed before they are
+published, and flagged with the CONTENT_ENCODING_ATTRIBUTE Pub/Sub
+message attribute; event_payload() decompresses them transparently.
+
+JSON has no temporal, spatial or byte types, so those property values
+are encoded as small tagged objects, e.g. {"$dt": "2022-03-24T23:44:43Z"}
+or {"$pt": [4326, -122.1, 37.4]}, by passing encode_value() as the
+default= hook and restored by decode_properties(). Neo4j property values
+can never be maps, so any object found in a property value is a tag.
+Other message fields, such as query parameters, are restored by
+decode_values(). Duration and Point values are tuples, which the
+standard library encoder writes as lists without calling the hook, so
+property dictionaries are tagged by tag_tuple_values() first.
+"""
+
+import os
+import re
+import json
+import zlib
+import base64
+import binascii
+import datetime
+
+import pytz
+
+from neo4j.time import (
+    Date,
+    DateTime,
+    Duration,
+    Time,
+)
+from neo4j.spatial import (
+    CartesianPoint,
+    Point,
+    WGS84Point,
+)
+from neo4j._codec.hydration.v1.spatial import hydrate_point
+
+from neo4j._codec.hydration.v2 import HydrationHandler
+from neo4j._codec.hydration import BrokenHydrationObject
+from neo4j._codec.packstream.v1 import (
+    Packer,
+    PackableBuffer,
+    Unpacker,
+    UnpackableBuffer,
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+PACKSTREAM_V1 = 0x01
+
+WIRE_FORMATS = ['json', 'packstream']
+
+# Pub/Sub message attribute marking compressed payloads
+CONTENT_ENCODING_ATTRIBUTE = 'contentEncoding'
+ZLIB_ENCODING = 'zlib'
+
+# Payloads smaller than this are published uncompressed so small
+# messages do not pay compression latency. Pub/Sub allows up to 10 MB.
+DEFAULT_COMPRESSION_THRESHOLD = 64 * 1024
+DEFAULT_COMPRESSION_LEVEL = 1
+
+
+class JsonBackend:
+    """Base class for JSON backends.
+
+    Subclasses implement dumps(), returning UTF-8 bytes, and loads(),
+    accepting str, bytes, bytearray or memoryview.
+    """
+    name = None
+
+    def dumps(self, obj, default=None):
+        raise NotImplementedError
+
+    def loads(self, data):
+        raise NotImplementedError
+
+
+class StdlibJsonBackend(JsonBackend):
+    """JSON backend using the standard library json module.
+
+    Its C encoder writes tuple subclasses, such as neo4j Duration and
+    Point, as lists without calling default, so property dictionaries
+    are passed through tag_tuple_values() before they are encoded.
+    """
+    name = 'json'
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(separators=(',', ':'))
+        # default callable -> encoder that calls it
+        self._default_encoders = {}
+
+    def dumps(self, obj, default=None):
+        encoder = self._encoder
+        if default is not None:
+            encoder = self._default_encoders.get(default)
+            if encoder is None:
+                encoder = json.JSONEncoder(separators=(',', ':'), default=default)
+                self._default_encoders[default] = encoder
+        return encoder.encode(obj).encode('utf-8')
+
+    def loads(self, data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+
+class OrjsonBackend(JsonBackend):
+    name = 'orjson'
+
+    def dumps(self, obj, default=None):
+        # Pass datetimes to default= like the stdlib backend does, instead
+        # of serializing them as untagged strings.
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+_BACKENDS = {StdlibJsonBackend.name: StdlibJsonBackend}
+if orjson is not None:
+    _BACKENDS[OrjsonBackend.name] = OrjsonBackend
+
+_backend = None
+
+
+def available_backends():
+    """Names of the JSON backends that can be used in this environment,
+    fastest first.
+    """
+    return sorted(_BACKENDS, key=lambda name: name == StdlibJsonBackend.name)
+
+
+def set_backend(name=None):
+    """Select the JSON backend used by dumps() and loads().
+
+    Args:
+        name (str): Backend name (see available_backends()). If None,
+            use TRELLIS_JSON_BACKEND or the fastest available backend.
+
+    Returns:
+        backend (JsonBackend): The active backend.
+    """
+    global _backend, dumps, loads
+
+    if name is None:
+        name = os.environ.get('TRELLIS_JSON_BACKEND') or available_backends()[0]
+    if name not in _BACKENDS:
+        raise ValueError(f"JSON backend '{name}' is not available. Available backends: {available_backends()}.")
+
+    _backend = _BACKENDS[name]()
+    # Bind the module-level functions directly to the backend methods
+    # so that hot paths pay for a single call.
+    dumps = _backend.dumps
+    loads = _backend.loads
+    return _backend
+
+
+def get_backend():
+    return _backend
+
+
+def dumps(obj, default=None):
+    """Encode obj as compact JSON.
+
+    Returns:
+        (bytes): UTF-8 encoded JSON.
+    """
+    return _backend.dumps(obj, default=default)
+
+
+def loads(data):
+    """Decode JSON from str, bytes, bytearray or memoryview."""
+    return _backend.loads(data)
+
+
+def dumps_str(obj, default=None):
+    """Encode obj as compact JSON and return it as str."""
+    return dumps(obj, default=default).decode('utf-8')
+
+
+def _tag_datetime(value, iso_datetime):
+    tagged = {'$dt': iso_datetime}
+    # Keep named time zones, which an ISO offset alone cannot express.
+    zone = getattr(value.tzinfo, 'zone', None)
+    if zone is not None:
+        tagged['$tz'] = zone
+    return tagged
+
+def _encode_timedelta(value):
+    return {'$du': [0, value.days, value.seconds, value.microseconds * 1000]}
+
+def _encode_point(value):
+    return {'$pt': [value.srid, *value]}
+
+# Exact type -> encoder, used as the JSON default= hook. The encoders
+# only call the hook for values they cannot serialize themselves, so
+# plain property values never reach it.
+_PROPERTY_ENCODERS = {
+    DateTime: lambda value: _tag_datetime(value, value.iso_format()),
+    Date: lambda value: {'$d': value.iso_format()},
+    Time: lambda value: {'$t': value.iso_format()},
+    Duration: lambda value: {'$du': [value.months, value.days, value.seconds, value.nanoseconds]},
+    datetime.datetime: lambda value: _tag_datetime(value, value.isoformat()),
+    datetime.date: lambda value: {'$d': value.isoformat()},
+    datetime.time: lambda value: {'$t': value.isoformat()},
+    datetime.timedelta: _encode_timedelta,
+    Point: _encode_point,
+    CartesianPoint: _encode_point,
+    WGS84Point: _encode_point,
+    bytes: lambda value: {'$b': base64.b64encode(value).decode('ascii')},
+    bytearray: lambda value: {'$b': base64.b64encode(value).decode('ascii')},
+}
+
+def _decode_datetime(tagged):
+    value = DateTime.from_iso_format(tagged['$dt'])
+    zone = tagged.get('$tz')
+    if zone is not None:
+        value = value.astimezone(pytz.timezone(zone))
+    return value
+
+_PROPERTY_DECODERS = {
+    '$dt': _decode_datetime,
+    '$d': lambda tagged: Date.from_iso_format(tagged['$d']),
+    '$t': lambda tagged: Time.from_iso_format(tagged['$t']),
+    '$du': lambda tagged: Duration(
+        months=tagged['$du'][0],
+        days=tagged['$du'][1],
+        seconds=tagged['$du'][2],
+        nanoseconds=tagged['$du'][3]),
+    '$pt': lambda tagged: hydrate_point(*tagged['$pt']),
+    '$b': lambda tagged: base64.b64decode(tagged['$b']),
+}
+
+
+def encode_value(value):
+    """JSON default= hook that tags temporal, spatial and byte values.
+
+    Raises:
+        TypeError: If value has no tagged encoding.
+    """
+    encoder = _PROPERTY_ENCODERS.get(value.__class__)
+    if encoder is None:
+        raise TypeError(f"Object of type {value.__class__.__name__} is not JSON serializable")
+    return encoder(value)
+
+
+# Property types that are tuples, which encoders write as lists
+# unless they are tagged first
+_TUPLE_PROPERTY_TYPES = frozenset((Duration, Point, CartesianPoint, WGS84Point))
+
+
+def tag_tuple_values(properties):
+    """Tag the Duration and Point values of a property dictionary.
+
+    Other values are left for the default= hook of the encoder.
+
+    Args:
+        properties (dict): Property values, modified in place.
+
+    Returns:
+        (dict): properties.
+    """
+    types = set(map(type, properties.values()))
+    if types.isdisjoint(_TUPLE_PROPERTY_TYPES) and list not in types:
+        return properties
+    for key, value in properties.items():
+        cls = value.__class__
+        if cls in _TUPLE_PROPERTY_TYPES:
+            properties[key] = _PROPERTY_ENCODERS[cls](value)
+        elif cls is list and value and value[0].__class__ in _TUPLE_PROPERTY_TYPES:
+            properties[key] = [_PROPERTY_ENCODERS[item.__class__](item) for item in value]
+    return properties
+
+
+def decode_property_value(value):
+    """Restore a property value tagged by encode_value().
+
+    Raises:
+        ValueError: If value is an object with an unknown tag.
+    """
+    if value.__class__ is dict:
+        for tag in value:
+            decoder = _PROPERTY_DECODERS.get(tag)
+            if decoder is not None:
+                return decoder(value)
+        raise ValueError(f"Property value {value} is not a tagged temporal, spatial or byte value.")
+    if value.__class__ is list and value and value[0].__class__ is dict:
+        return [decode_property_value(item) for item in value]
+    return value
+
+
+def decode_properties(properties):
+    """Restore the property values tagged by encode_value().
+
+    Args:
+        properties (dict): Decoded JSON properties.
+
+    Returns:
+        (dict): properties itself if nothing was tagged, otherwise a
+            copy with the tagged values restored.
+    """
+    decoded = properties
+    for key, value in properties.items():
+        if value.__class__ is dict or (value.__class__ is list and value and value[0].__class__ is dict):
+            if decoded is properties:
+                decoded = dict(properties)
+            decoded[key] = decode_property_value(value)
+    return decoded
+
+
+_TAG_KEYS = frozenset(_PROPERTY_DECODERS) | {'$tz'}
+
+def decode_values(value):
+    """Restore the values tagged by encode_value() anywhere in a decoded
+    JSON value, such as query parameters or a job dictionary.
+
+    Unlike property values, these may contain maps, so only objects
+    whose keys are all tag keys are decoded.
+
+    Returns:
+        value itself if nothing was tagged, otherwise a copy with the
+            tagged values restored.
+    """
+    cls = value.__class__
+    if cls is dict:
+        if value and value.keys() <= _TAG_KEYS:
+            for tag in value:
+                decoder = _PROPERTY_DECODERS.get(tag)
+                if decoder is not None:
+                    return decoder(value)
+        decoded = value
+        for key, item in value.items():
+            decoded_item = decode_values(item)
+            if decoded_item is not item:
+                if decoded is value:
+                    decoded = dict(value)
+                decoded[key] = decoded_item
+        return decoded
+    if cls is list:
+        decoded = value
+        for i, item in enumerate(value):
+            decoded_item = decode_values(item)
+            if decoded_item is not item:
+                if decoded is value:
+                    decoded = list(value)
+                decoded[i] = decoded_item
+        return decoded
+    return value
+
+
+def may_contain_tags(data):
+    """Return False if encoded JSON cannot contain tagged values, so
+    decoding them can be skipped.
+
+    Every tag is an object key starting with '$', so the encoded text
+    is scanned for '$', which is rare enough to be found with a single
+    memchr. Other buffers are assumed to contain tags.
+    """
+    cls = data.__class__
+    if cls is bytes or cls is bytearray:
+        return b'$' in data
+    if cls is str:
+        return '$' in data
+    return True
+
+
+def encode_default(value):
+    """JSON default= fallback for message fields outside entity properties.
+
+    Tags temporal, spatial and byte values, and falls back to str().
+    """
+    encoder = _PROPERTY_ENCODERS.get(value.__class__)
+    if encoder is not None:
+        return encoder(value)
+    return str(value)
+
+
+# Temporal and spatial values are converted to and from their Bolt
+# structures, so they survive a PackStream round trip.
+_packstream_handler = HydrationHandler()
+_packstream_dehydration_hooks = Packer._inject_hooks(_packstream_handler.dehydration_hooks)
+
+
+def new_packstream_packer():
+    """Create a Packer writing into a buffer that already holds the
+    PackStream version byte.
+
+    Returns:
+        (packer, buffer): buffer.data is the payload once packing is done.
+    """
+    buffer = PackableBuffer()
+    buffer.write(bytes((PACKSTREAM_V1,)))
+    return Packer(buffer), buffer
+
+
+def pack_value(packer, value):
+    """Pack a value, dehydrating temporal and spatial types."""
+    packer._pack(value, dehydration_hooks=_packstream_dehydration_hooks)
+
+
+def pack_structure(packer, tag, fields):
+    """Pack a PackStream structure, dehydrating temporal and spatial fields."""
+    packer._pack_struct(tag, fields, dehydration_hooks=_packstream_dehydration_hooks)
+
+
+def new_packstream_unpacker(data):
+    """Create an Unpacker positioned after the PackStream version byte.
+
+    Raises:
+        ValueError: If the payload is not PackStream or has an
+            unsupported version.
+    """
+    if not data or data[0] != PACKSTREAM_V1:
+        raise ValueError("Payload is not a version 1 PackStream message.")
+    buffer = UnpackableBuffer(data)
+    buffer.p = 1
+    return Unpacker(buffer)
+
+
+def unpack_value(unpacker, hydration_hooks):
+    """Unpack the next value and raise if any part of it failed to hydrate."""
+    value = unpacker.unpack(hydration_hooks)
+    if isinstance(value, BrokenHydrationObject):
+        raise ValueError(f"Could not hydrate PackStream value: {value.error}") from value.error
+    return value
+
+
+def dumps_packstream(obj):
+    """Encode obj as a versioned PackStream payload.
+
+    Returns:
+        (bytes): Version byte followed by the packed value.
+    """
+    packer, buffer = new_packstream_packer()
+    pack_value(packer, obj)
+    return bytes(buffer.data)
+
+
+def loads_packstream(data):
+    """Decode a payload produced by dumps_packstream()."""
+    unpacker = new_packstream_unpacker(data)
+    hydration_scope = _packstream_handler.new_hydration_scope()
+    return unpack_value(unpacker, hydration_scope.hydration_hooks)
+
+
+def encode_message(message, wire_format='json', default=None):
+    """Encode a message dictionary for publishing.
+
+    Args:
+        message (dict): Dictionary with header and body fields.
+        wire_format (str): 'json' or 'packstream'.
+        default (callable): JSON fallback for unsupported types.
+
+    Returns:
+        (bytes): Message payload.
+    """
+    if wire_format == 'json':
+        return dumps(message, default=default)
+    elif wire_format == 'packstream':
+        return dumps_packstream(message)
+    else:
+        raise ValueError(f"Wire format '{wire_format}' not in supported formats: {WIRE_FORMATS}.")
+
+
+def decode_message(data):
+    """Decode a JSON or PackStream message payload, detected by its first byte."""
+    if data and data[0] == PACKSTREAM_V1:
+        return loads_packstream(data)
+    return loads(data)
+
+
+def compress_payload(payload, threshold=DEFAULT_COMPRESSION_THRESHOLD, level=DEFAULT_COMPRESSION_LEVEL):
+    """Compress a payload if it is at least threshold bytes long.
+
+    Args:
+        payload (bytes): Encoded message.
+        threshold (int): Minimum size to compress. None disables compression.
+        level (int): zlib compression level.
+
+    Returns:
+        (payload, attributes): The payload to publish and the Pub/Sub
+            message attributes that describe its encoding.
+    """
+    if threshold is None or len(payload) < threshold:
+        return payload, {}
+    return zlib.compress(payload, level), {CONTENT_ENCODING_ATTRIBUTE: ZLIB_ENCODING}
+
+
+def decompress_payload(payload, attributes=None):
+    """Reverse compress_payload() using the message attributes.
+
+    Raises:
+        ValueError: If the content encoding is not supported.
+    """
+    encoding = attributes.get(CONTENT_ENCODING_ATTRIBUTE) if attributes else None
+    if encoding is None:
+        return payload
+    elif encoding == ZLIB_ENCODING:
+        return zlib.decompress(payload)
+    else:
+        raise ValueError(f"Unsupported message content encoding '{encoding}'.")
+
+
+def event_payload(event):
+    """Base64 decode and decompress the payload of a Pub/Sub event.
+
+    The base64 event data (str, bytes or memoryview) is decoded straight
+    to bytes, ready for split_message(); no intermediate UTF-8 str copy
+    of the payload is made.
+
+    Args:
+        event (dict): Pub/Sub event with base64 encoded 'data' and
+            optional 'attributes'.
+
+    Returns:
+        payload (bytes): Encoded message.
+    """
+    payload = binascii.a2b_base64(event['data'])
+    return decompress_payload(payload, event.get('attributes'))
+
+
+def _decode_message_dict(payload):
+    data = decode_message(payload)
+
+    # Some publishers JSON-encode an already encoded message string.
+    # Decode the inner document strictly rather than evaluating it.
+    if isinstance(data, str):
+        data = loads(data)
+    if not isinstance(data, dict):
+        raise ValueError(f"Message data decoded to {type(data).__name__}, expected a JSON object.")
+    return data
+
+
+# Message writers put a small, ASCII header before the body, so the
+# header can be parsed from the start of the payload on its own.
+_HEADER_SCAN_BYTES = 512
+_HEADER_KEY = re.compile(r'\{\s*"header"\s*:\s*')
+_BODY_KEY = re.compile(r'\s*,\s*"body"\s*:\s*')
+_header_decoder = json.JSONDecoder()
+_JSON_WHITESPACE = b' \t\n\r'
+
+
+def _closing_brace(payload):
+    """Return the offset of the brace that closes an encoded object, or
+    -1 if the payload does not end with one.
+
+    Scans back from the end instead of stripping trailing whitespace,
+    which would copy the payload.
+    """
+    end = len(payload) - 1
+    while end >= 0 and payload[end] in _JSON_WHITESPACE:
+        end -= 1
+    if end >= 0 and payload[end] == 0x7d:
+        return end
+    return -1
+
+
+def split_message(payload):
+    """Parse the header of an encoded message and locate its body.
+
+    The body of a {"header": {...}, "body": {...}} JSON message is left
+    unparsed; pass body_start to load_message_body() to parse it.
+    Other payloads (PackStream, double encoded or differently ordered
+    JSON) are parsed in full.
+
+    Args:
+        payload (bytes): Encoded message.
+
+    Returns:
+        (header, body, body_start): body is None and body_start is the
+            offset of the body if it was not parsed; otherwise body is
+            the parsed body and body_start is None. header and body are
+            None if the message does not have them.
+
+    Raises:
+        ValueError: If the payload is not a JSON object or PackStream map.
+    """
+    # Decoding as ASCII maps every byte to one character, so offsets in
+    # prefix are byte offsets in payload.
+    prefix = payload[:_HEADER_SCAN_BYTES].decode('ascii', 'replace')
+    match = _HEADER_KEY.match(prefix)
+    if match is not None and _closing_brace(payload) > 0:
+        header_start = match.end()
+        # Headers are flat, so they usually end at the first closing
+        # brace; fall back to scanning for the end of the object.
+        header_end = prefix.find('}', header_start) + 1
+        try:
+            header = loads(payload[header_start:header_end])
+        except ValueError:
+            try:
+                header, header_end = _header_decoder.raw_decode(prefix, header_start)
+            except ValueError:
+                header = None
+            # Non-ASCII bytes were replaced in prefix
+            if '\ufffd' in prefix[header_start:header_end]:
+                header = None
+        body_match = _BODY_KEY.match(prefix, header_end)
+        if header.__class__ is dict and body_match is not None:
+            return header, None, body_match.end()
+
+    data = _decode_message_dict(payload)
+    return data.get('header'), data.get('body'), None
+
+
+def load_message_body(payload, body_start):
+    """Parse the body of a message located by split_message().
+
+    Raises:
+        ValueError: If the body is not a JSON object.
+    """
+    end = _closing_brace(payload)
+    if end < 0:
+        raise ValueError("Message payload does not end with a JSON object.")
+    try:
+        body = loads(memoryview(payload)[body_start:end])
+    except ValueError:
+        # Keys after the body, for instance
+        body = _decode_message_dict(payload).get('body')
+    if not isinstance(body, dict):
+        raise ValueError(f"Message body decoded to {type(body).__name__}, expected a JSON object.")
+    return body
+
+
+set_backend()
@@ -2,7 +2,13 @@ import json
 import yaml
 import neo4j
 import base64
+import time
 import logging
+import operator
+import threading
+import collections
+
+from .idempotency import IdempotencyCache
 
 class TriggerController:
 
@@ -18,12 +24,16 @@ class TriggerController:
 
         self.node_triggers = {}
         self.relationship_triggers = {}
+        # (start label, relationship type, end label) -> triggers
+        self.relationship_index = {}
         self.supported_patterns = ["node", "relationship"]
 
         # Separate triggers by type
         for trigger in triggers:
 
             self._validate_trigger_content(trigger)
+            trigger.compile_parameter_extractor()
+            trigger.compile_conditions()
 
             if trigger.pattern == 'node':
                 if trigger.start['label'] in self.node_triggers.keys():
@@ -35,6 +45,8 @@ class TriggerController:
                     self.relationship_triggers[trigger.start['label']].append(trigger)
                 else:
                     self.relationship_triggers[trigger.start['label']] = [trigger]
+                triple = (trigger.start['label'], trigger.relationship['type'], trigger.end['label'])
+                self.relationship_index.setdefault(triple, []).append(trigger)
             else:
                 raise ValueError(f"{trigger.pattern} is not a supported trigger pattern.")
 
@@ -56,6 +68,51 @@ class TriggerController:
             raise ValueError(f"#> Response pattern '{response_pattern}' is not a supported trigger pattern.")
         return activated_triggers
 
+    def evaluate_many(self, query_responses):
+        """Evaluate triggers for a batch of query responses in one pass.
+
+        Every node and relationship of every response is evaluated, so
+        responses may hold several nodes (see
+        QueryResponseWriter.return_json_with_all_nodes()), and
+        QueryResponseBatchReader messages are expanded into their
+        entities.
+
+        args:
+            query_responses (iterable): trellisdata.QueryResponseReader
+                or QueryResponseBatchReader objects.
+
+        returns:
+            activations (dict): trigger.query -> list of distinct
+                query parameter dictionaries, in the order first seen.
+        """
+        activations = {}
+        seen = set()
+        for query_response in self._iter_entity_responses(query_responses):
+            entity_activations = []
+            if query_response.relationship:
+                entity_activations.extend(self._match_relationship_triggers(query_response.relationship))
+            for node in query_response.nodes:
+                entity_activations.extend(self._match_node_triggers(node))
+
+            for trigger, parameters in entity_activations:
+                try:
+                    key = (trigger.query, frozenset(parameters.items()))
+                except TypeError:
+                    # Unhashable parameter values, such as lists
+                    key = (trigger.query, json.dumps(parameters, sort_keys=True, default=str))
+                if key in seen:
+                    continue
+                seen.add(key)
+                activations.setdefault(trigger.query, []).append(parameters)
+        return activations
+
+    def _iter_entity_responses(self, query_responses):
+        for query_response in query_responses:
+            if getattr(query_response, 'message_kind', None) == 'queryResponseBatch':
+                yield from query_response
+            else:
+                yield query_response
+
     def _determine_result_pattern(self, query_response):
         len_nodes = len(query_response.nodes)
         len_relationships = len(query_response.relationship)
@@ -75,7 +132,9 @@ class TriggerController:
         When evaluating node triggers, the only criterion is 
         whether the node label matches the trigger label.
         """
-        node = query_response.nodes[0]
+        return self._match_node_triggers(query_response.nodes[0])
+
+    def _match_node_triggers(self, node):
         node_labels = node['labels']
 
         # New logic to handle multiple labels
@@ -91,6 +150,10 @@ class TriggerController:
         for trigger in candidate_triggers:
             node_properties = node['properties']
 
+            match_conditions = trigger.match_conditions
+            if match_conditions is not None and not match_conditions(node_properties):
+                continue
+
             query_parameters = self._get_node_trigger_parameters(
                                     trigger,
                                     node_properties)
@@ -114,48 +177,44 @@ class TriggerController:
                 "only single relationship patterns supported.")
         """
 
-        relationship = query_response.relationship
-        start_labels = relationship['start_node']['labels']
-
-        # Get relevant triggers
-        start_triggers = []
-        for label in start_labels:
-            label_triggers = self.relationship_triggers.get(label)
-            if label_triggers:
-                start_triggers.extend(label_triggers)
-        candidate_triggers = set(start_triggers)
-
-        trigger_names = [trigger.name for trigger in candidate_triggers]
-        logging.info(f"#> Triggers that match start node '{start_labels}': {trigger_names}.")
+        return self._match_relationship_triggers(query_response.relationship)
 
+    def _match_relationship_triggers(self, relationship):
+        start_labels = relationship['start_node']['labels']
         end_labels = relationship['end_node']['labels']
         relationship_type = relationship['type']
 
+        # Each trigger is indexed under a single triple, so probing
+        # every start and end label combination finds it at most once.
+        index = self.relationship_index
+        matched_triggers = []
+        for start_label in start_labels:
+            for end_label in end_labels:
+                triple_triggers = index.get((start_label, relationship_type, end_label))
+                if triple_triggers:
+                    matched_triggers.extend(triple_triggers)
+
+        if matched_triggers and logging.getLogger().isEnabledFor(logging.INFO):
+            trigger_names = [trigger.name for trigger in matched_triggers]
+            logging.info(f"#> Triggers that match ({start_labels})-[{relationship_type}]->({end_labels}): {trigger_names}.")
+
         activated_triggers = []
-        for trigger in candidate_triggers:
-            #if (start_label == trigger.start['label'] # This is redundant
-            #        and end_label == trigger.end['label'] 
-            #        and relationship_type == trigger.relationship['type']):
-            if (
-                trigger.relationship['type'] == relationship_type and
-                trigger.end['label'] in end_labels):
-
-                start_properties = relationship['start_node']['properties']
-                end_properties = relationship['end_node']['properties']
-                rel_properties = relationship['properties']
-
-                # TODO: Get query parameters for relationship triggers
-                parameters = self._get_relationship_trigger_parameters(
-                    trigger,
-                    start_properties,
-                    end_properties,
-                    rel_properties)
-                trigger_tuple = (trigger, parameters)
-                activated_triggers.append(trigger_tuple)
-            else:
-                logging.debug(f"#> {trigger.name} not activated. " +
-                    f"Triple relationship {relationship_type} does not match {trigger.relationship['type']} " +
-                    f"or trigger label '{trigger.end['label']}' not in end node labels: {end_labels}.")
+        for trigger in matched_triggers:
+            start_properties = relationship['start_node']['properties']
+            end_properties = relationship['end_node']['properties']
+            rel_properties = relationship['properties']
+
+            match_conditions = trigger.match_conditions
+            if match_conditions is not None and not match_conditions(start_properties, end_properties, rel_properties):
+                continue
+
+            parameters = self._get_relationship_trigger_parameters(
+                trigger,
+                start_properties,
+                end_properties,
+                rel_properties)
+            trigger_tuple = (trigger, parameters)
+            activated_triggers.append(trigger_tuple)
         return activated_triggers
 
     def _get_relationship_trigger_parameters(
@@ -164,44 +223,13 @@ class TriggerController:
                                              start_properties,
                                              end_properties,
                                              rel_properties):
-
-        start_parameters = trigger.start.get('properties')
-        end_parameters = trigger.end.get('properties')
-        rel_parameters = trigger.relationship.get('properties')
-
-        parameters = {}
-        if start_parameters:
-            parameters = self._get_parameter_values(start_parameters, start_properties, parameters, trigger.start['label'])
-        if end_parameters:
-            parameters = self._get_parameter_values(end_parameters, end_properties, parameters, trigger.end['label'])
-        if rel_parameters:
-            parameters = self._get_parameter_values(rel_parameters, rel_properites, parameters, trigger.relationship['type'])
-        return parameters
+        return trigger.extract_parameters(start_properties, end_properties, rel_properties)
 
     def _get_node_trigger_parameters(
                                      self,
                                      trigger,
                                      node_properties):
-        node_parameters = trigger.start.get('properties')
-
-        parameters = {}
-        if node_parameters:
-            parameters = self._get_parameter_values(
-                                        node_parameters,
-                                        node_properties,
-                                        parameters,
-                                        trigger.start['label'])
-        return parameters
-
-    def _get_parameter_values(self, parameter_mapping, properties, parameters, entity_label):
-        # Parameters describe values that must be provided to the activated query.
-        # Properties come from database response entities (node or relationship).
-        for property_name, parameter_name in parameter_mapping.items():
-            try:
-                parameters[parameter_name] = properties[property_name]
-            except KeyError:
-                raise KeyError(f"{entity_label} is missing property {property_name}.")
-        return parameters
+        return trigger.extract_parameters(node_properties)
 
     def _validate_trigger_content(self, trigger):
         if not hasattr(trigger, "name"):
@@ -241,6 +269,90 @@ class TriggerController:
                 raise ValueError(f"#> Trigger end node missing label.")
 
 
+class ActivationCoalescer:
+    """Suppress repeated activations of the same query with the same
+    parameters within a time window.
+
+    During bulk uploads many responses activate the same trigger with
+    the same parameters within seconds. The first activation is
+    passed on and identical activations in the following window
+    seconds are dropped, whether they come from one batch or from
+    later invocations of a long-lived worker. Give a cache with an
+    on-disk store to coalesce across processes on the same machine.
+
+    args:
+        controller (TriggerController): Evaluates the triggers.
+        window (float): Seconds duplicates are suppressed for.
+        max_entries (int): Activations remembered; the oldest are
+            forgotten first.
+        cache (idempotency.IdempotencyCache): Remembers activations.
+            Defaults to an in-memory cache of window and max_entries.
+    """
+
+    def __init__(
+                 self,
+                 controller,
+                 window=5.0,
+                 max_entries=10000,
+                 cache=None):
+
+        self.controller = controller
+        self.window = window
+        if cache is None:
+            cache = IdempotencyCache(max_entries=max_entries, ttl=window, clock=time.monotonic)
+        self.cache = cache
+
+        self.emitted = 0
+        self.suppressed = 0
+        self.suppressed_by_query = collections.Counter()
+        self._lock = threading.Lock()
+
+    def evaluate_trigger_conditions(self, query_response):
+        """Evaluate a response and return the activations that are not
+        duplicates, as (trigger, parameters) tuples.
+        """
+        activated_triggers = self.controller.evaluate_trigger_conditions(query_response)
+        return [
+            (trigger, parameters) for trigger, parameters in activated_triggers
+            if self._emit(trigger.query, parameters)]
+
+    def evaluate_many(self, query_responses):
+        """Like TriggerController.evaluate_many(), without duplicates."""
+        activations = {}
+        for query, parameter_sets in self.controller.evaluate_many(query_responses).items():
+            parameter_sets = [parameters for parameters in parameter_sets if self._emit(query, parameters)]
+            if parameter_sets:
+                activations[query] = parameter_sets
+        return activations
+
+    def stats(self):
+        """Return the counters as a dictionary, for logging."""
+        with self._lock:
+            return {
+                "emitted": self.emitted,
+                "suppressed": self.suppressed,
+                "suppressedByQuery": dict(self.suppressed_by_query),
+            }
+
+    def _emit(self, query, parameters):
+        try:
+            key = (query, frozenset(parameters.items()))
+        except TypeError:
+            # Unhashable parameter values, such as lists
+            key = None
+        if key is None or self.cache.path is not None:
+            # The on-disk store needs str keys
+            key = f"{query}:{json.dumps(parameters, sort_keys=True, default=str)}"
+        duplicate = self.cache.seen(key)
+        with self._lock:
+            if duplicate:
+                self.suppressed += 1
+                self.suppressed_by_query[query] += 1
+            else:
+                self.emitted += 1
+        return not duplicate
+
+
 class DatabaseTrigger(yaml.YAMLObject):
     """
     Inspired by docs: https://pyyaml.org/wiki/PyYAMLDocumentation
@@ -259,4 +371,217 @@ class DatabaseTrigger(yaml.YAMLObject):
         self.query = query
 
         self.end = end
-        self.relationship = relationship
\ No newline at end of file
+        self.relationship = relationship
+        self.compile_parameter_extractor()
+        self.compile_conditions()
+
+    def compile_parameter_extractor(self):
+        """Compile the trigger's property to parameter mappings into
+        extract_parameters(start_properties, end_properties=None,
+        rel_properties=None).
+
+        Parameters describe values that must be provided to the
+        activated query. Properties come from the start node, end node
+        and relationship of the database response. Each mapping is
+        compiled into one operator.itemgetter, so an activation costs
+        a getter call per mapped entity and one dict construction.
+
+        returns:
+            extract_parameters (callable): Returns the query parameters
+                and raises KeyError naming the trigger if a mapped
+                property is missing.
+        """
+        getters = []
+        parameter_names = []
+        mappings = []
+        # Triggers loaded from YAML only have the attributes in their
+        # document; node triggers have no end or relationship.
+        for entity, name_key in (
+                                 (self.start, 'label'),
+                                 (getattr(self, 'end', None), 'label'),
+                                 (getattr(self, 'relationship', None), 'type')):
+            mapping = entity.get('properties') if isinstance(entity, dict) else None
+            if not mapping:
+                getters.append(_no_properties)
+                continue
+            property_names = list(mapping.keys())
+            names = list(mapping.values())
+            if len(property_names) == 1:
+                # A single-item itemgetter returns a bare value instead
+                # of a tuple; getting the item twice keeps it a tuple.
+                property_names *= 2
+                names *= 2
+            getters.append(operator.itemgetter(*property_names))
+            parameter_names.extend(names)
+            mappings.append((len(getters) - 1, entity[name_key], mapping))
+
+        get_start, get_end, get_relationship = getters
+        parameter_names = tuple(parameter_names)
+
+        def extract_parameters(start_properties, end_properties=None, rel_properties=None):
+            try:
+                values = get_start(start_properties) + get_end(end_properties) + get_relationship(rel_properties)
+            except KeyError:
+                entity_properties = (start_properties, end_properties, rel_properties)
+                for position, entity_name, mapping in mappings:
+                    for property_name in mapping:
+                        if property_name not in entity_properties[position]:
+                            raise KeyError(
+                                f"Trigger {getattr(self, 'name', None)}: {entity_name} is missing property {property_name}.") from None
+                raise
+            return dict(zip(parameter_names, values))
+
+        self.extract_parameters = extract_parameters
+        return extract_parameters
+
+    def compile_conditions(self):
+        """Compile the trigger's property conditions into
+        match_conditions(start_properties, end_properties=None,
+        rel_properties=None), which returns True if the activating
+        entities satisfy every condition.
+
+        Conditions are listed under the start, end or relationship of
+        the trigger, by property name:
+
+            start:
+                label: CromwellStep
+                conditions:
+                    wdlCallAlias:
+                        in: [MergeVCFs, HaplotypeCaller]
+                    sample:
+                        prefix: SHIP
+                    size:
+                        gte: 1000000
+                    cromwellWorkflowId:
+                        exists: true
+                    status: STOPPED
+
+        A bare value is an equality condition. match_conditions is None
+        if the trigger has no conditions.
+
+        raises:
+            ValueError: If a condition uses an unsupported operator or
+                an operand of the wrong type.
+        """
+        checks = []
+        for position, entity in enumerate((
+                                           self.start,
+                                           getattr(self, 'end', None),
+                                           getattr(self, 'relationship', None))):
+            conditions = entity.get('conditions') if isinstance(entity, dict) else None
+            for property_name, condition in (conditions or {}).items():
+                checks.append((position, _compile_condition(getattr(self, 'name', None), property_name, condition)))
+
+        if not checks:
+            self.match_conditions = None
+            return None
+
+        checks = tuple(checks)
+
+        def match_conditions(start_properties, end_properties=None, rel_properties=None):
+            entity_properties = (start_properties, end_properties, rel_properties)
+            for position, check in checks:
+                if not check(entity_properties[position]):
+                    return False
+            return True
+
+        self.match_conditions = match_conditions
+        return match_conditions
+
+
+def _no_properties(properties):
+    return ()
+
+
+SUPPORTED_CONDITION_OPERATORS = ('eq', 'in', 'prefix', 'gt', 'gte', 'lt', 'lte', 'exists')
+
+_RANGE_OPERATORS = {
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+}
+
+# Distinguishes a missing property from a property set to None
+_MISSING = object()
+
+
+def _invalid_operand(trigger_name, property_name, operator_name, operand, expected):
+    return ValueError(
+        f"#> Trigger {trigger_name} condition on '{property_name}': '{operator_name}' " +
+        f"operand {operand!r} is not {expected}.")
+
+
+def _compile_condition(trigger_name, property_name, condition):
+    """Compile one property condition into a predicate on a properties dict."""
+    if not isinstance(condition, dict):
+        condition = {'eq': condition}
+
+    unsupported = set(condition) - set(SUPPORTED_CONDITION_OPERATORS)
+    if unsupported:
+        raise ValueError(
+            f"#> Trigger {trigger_name} condition on '{property_name}' uses unsupported operators " +
+            f"{sorted(unsupported)}; supported operators: {list(SUPPORTED_CONDITION_OPERATORS)}.")
+
+    # Check operands now rather than when a message fails to match.
+    # bool is an int subclass and YAML reads unquoted dates as dates,
+    # so types are compared exactly.
+    if 'exists' in condition and condition['exists'].__class__ is not bool:
+        raise _invalid_operand(trigger_name, property_name, 'exists', condition['exists'], "true or false")
+    if 'in' in condition and not isinstance(condition['in'], list):
+        raise _invalid_operand(trigger_name, property_name, 'in', condition['in'], "a list")
+    if 'prefix' in condition:
+        prefix = condition['prefix']
+        if not (isinstance(prefix, str)
+                or (isinstance(prefix, list) and prefix and all(isinstance(item, str) for item in prefix))):
+            raise _invalid_operand(trigger_name, property_name, 'prefix', prefix, "a string or a list of strings")
+    for name in _RANGE_OPERATORS:
+        if name in condition and condition[name].__class__ not in (int, float):
+            raise _invalid_operand(trigger_name, property_name, name, condition[name], "a number")
+
+    predicates = []
+    if 'exists' in condition:
+        exists = condition['exists']
+        predicates.append(lambda properties: (property_name in properties) is exists)
+    if 'eq' in condition:
+        expected = condition['eq']
+        predicates.append(lambda properties: properties.get(property_name, _MISSING) == expected)
+    if 'in' in condition:
+        options = condition['in']
+        try:
+            options = frozenset(options)
+        except TypeError:
+            # Unhashable options, such as lists, are compared in turn
+            options = tuple(options)
+        def is_option(properties):
+            try:
+                return properties.get(property_name, _MISSING) in options
+            except TypeError:
+                return False
+        predicates.append(is_option)
+    if 'prefix' in condition:
+        prefix = condition['prefix']
+        if not isinstance(prefix, str):
+            prefix = tuple(prefix)
+        def has_prefix(properties):
+            value = properties.get(property_name)
+            return isinstance(value, str) and value.startswith(prefix)
+        predicates.append(has_prefix)
+    bounds = tuple(
+        (_RANGE_OPERATORS[name], bound)
+        for name, bound in condition.items() if name in _RANGE_OPERATORS)
+    if bounds:
+        def in_range(properties):
+            value = properties.get(property_name)
+            if value.__class__ not in (int, float):
+                return False
+            for compare, bound in bounds:
+                if not compare(value, bound):
+                    return False
+            return True
+        predicates.append(in_range)
+
+    if len(predicates) == 1:
+        return predicates[0]
+    predicates = tuple(predicates)
+    return lambda properties: all(predicate(properties) for predicate in predicates)
@@ -0,0 +1,173 @@
+"""Validation of Trellis message envelopes.
+
+Every message is a {"header": {...}, "body": {...}} object. The header
+fields are the same for every message kind; the required body fields
+depend on the header's messageKind. The schemas below are compiled once
+into validators that check a header or body in a single pass and
+return a description of the first problem, or None, so readers can
+reject malformed messages before doing any other work.
+"""
+
+
+class MessageValidationError(ValueError):
+    """A message does not match the envelope schema of its messageKind."""
+
+
+def _is_str(value):
+    return value.__class__ is str
+
+def _is_int(value):
+    return value.__class__ is int
+
+def _is_dict(value):
+    return value.__class__ is dict
+
+def _is_list(value):
+    return value.__class__ is list
+
+def _is_flag(value):
+    # Readers apply bool(), so 0 and 1 are accepted too
+    cls = value.__class__
+    return cls is bool or cls is int
+
+def _is_event_id(value):
+    # Pub/Sub event IDs are published as ints or as strings of digits
+    cls = value.__class__
+    return cls is int or (cls is str and value.isdigit())
+
+def _is_optional_str(value):
+    return value is None or value.__class__ is str
+
+
+HEADER_SCHEMA = {
+    'messageKind': _is_str,
+    'sender': _is_str,
+    'seedId': _is_event_id,
+    'previousEventId': _is_event_id,
+}
+
+# Header fields checked only if present (see latency.py)
+HEADER_OPTIONAL_SCHEMA = {
+    'sentAtNs': _is_int,
+    'sentMonotonicNs': _is_int,
+}
+
+# Required body fields by messageKind, and fields checked only if present
+BODY_SCHEMAS = {
+    'queryRequest': ({
+        'queryName': _is_str,
+        'queryParameters': _is_dict,
+        'custom': _is_flag,
+    }, {
+        'cypher': _is_str,
+        'writeTransaction': _is_flag,
+        'aggregateResults': _is_flag,
+    }),
+    'queryResponse': ({
+        'queryName': _is_str,
+        'nodes': _is_list,
+        'relationship': _is_dict,
+        'resultSummary': _is_dict,
+    }, {
+        'jobRequest': _is_optional_str,
+    }),
+    'queryResponseBatch': ({
+        'queryName': _is_str,
+        'entities': _is_list,
+        'resultSummary': _is_dict,
+    }, {
+        'jobRequest': _is_optional_str,
+    }),
+    'jobCreated': ({
+        'jobDict': _is_dict,
+    }, {}),
+}
+
+# Sub-header field of each entity in a queryResponseBatch body, copied
+# into the header of its QueryResponseReader
+BATCH_INDEX_FIELD = 'batchIndex'
+
+# Fields of each entity in a queryResponseBatch body
+BATCH_ENTITY_SCHEMA = {
+    'header': _is_dict,
+    'nodes': _is_list,
+    'relationship': _is_dict,
+}
+
+# Body fields that custom query requests must also have
+CUSTOM_QUERY_FIELDS = frozenset(('cypher', 'writeTransaction', 'aggregateResults'))
+
+
+def compile_validator(section, required, optional=None):
+    """Compile field predicates into a validator for one envelope section.
+
+    Args:
+        section (str): Section name used in error descriptions.
+        required (dict): Field name -> predicate for required fields.
+        optional (dict): Field name -> predicate for fields that are
+            only checked when present.
+
+    Returns:
+        validate (callable): Takes the section and returns None if it is
+            valid or a description of the first problem.
+    """
+    required_fields = frozenset(required)
+    checks = tuple(required.items()) + tuple((optional or {}).items())
+
+    def validate(value):
+        if value.__class__ is not dict:
+            return f"Message {section} is a {type(value).__name__}, expected an object."
+        missing = required_fields - value.keys()
+        if missing:
+            return f"Message {section} is missing {', '.join(sorted(missing))}."
+        for field, is_valid in checks:
+            if field in value and not is_valid(value[field]):
+                return f"Message {section} field '{field}' has invalid value {value[field]!r}."
+        return None
+
+    return validate
+
+
+validate_header = compile_validator('header', HEADER_SCHEMA, HEADER_OPTIONAL_SCHEMA)
+
+validate_batch_entity = compile_validator('queryResponseBatch entity', BATCH_ENTITY_SCHEMA)
+
+_body_validators = {
+    message_kind: compile_validator(f"{message_kind} body", required, optional)
+    for message_kind, (required, optional) in BODY_SCHEMAS.items()}
+
+def _validate_query_request_body(body, _validate=_body_validators['queryRequest']):
+    error = _validate(body)
+    if error is None and body['custom']:
+        missing = CUSTOM_QUERY_FIELDS - body.keys()
+        if missing:
+            error = f"Custom queryRequest body is missing {', '.join(sorted(missing))}."
+    return error
+
+_body_validators['queryRequest'] = _validate_query_request_body
+
+
+def get_body_validator(message_kind):
+    """Return the compiled body validator of a messageKind, or None."""
+    return _body_validators.get(message_kind)
+
+
+def validate_envelope(header, body=None, message_kind=None):
+    """Validate a message header, and its body if it has been parsed.
+
+    Args:
+        header (dict): Message header.
+        body (dict): Message body, or None to only check the header.
+        message_kind (str): Expected messageKind, if any.
+
+    Returns:
+        error (str): Description of the first problem, or None.
+    """
+    error = validate_header(header)
+    if error is None and message_kind is not None and header['messageKind'] != message_kind:
+        error = f"Message is of kind '{header['messageKind']}', expected '{message_kind}'."
+    if error is None and body is not None:
+        validate_body = _body_validators.get(header['messageKind'])
+        if validate_body is not None:
+            error = validate_body(body)
+    return error
@@ -0,0 +1,285 @@
+"""Detection of redelivered Pub/Sub events.
+
+Pub/Sub delivers every message at least once, so a function can be
+invoked again with an event it has already handled: a redelivered
+queryRequest would run its Cypher again and a redelivered queryResponse
+would activate triggers again. IdempotencyCache remembers the keys of
+handled messages so readers can check MessageReader.is_duplicate()
+before doing that work, and call MessageReader.mark_done() once it has
+succeeded. A message whose handling failed is not recorded, so its
+redelivery is handled again.
+
+Messages are keyed on their Pub/Sub event ID, which is the same for
+every delivery of a message. Messages without an event ID are keyed on
+their seedId, previousEventId and a hash of their content. The entities
+of a queryResponseBatch message share its event ID, so their keys also
+hold their batchIndex.
+
+Keys are kept in a bounded in-memory LRU, which lasts as long as the
+function instance. Give the cache a path to also keep them in a local
+SQLite database that is shared by processes on the same machine and
+survives restarts.
+"""
+
+import time
+import hashlib
+import sqlite3
+import threading
+
+from collections import OrderedDict
+
+from . import codec
+from . import envelope
+
+
+def content_key(reader):
+    """Key a message on its seedId, previousEventId and content hash.
+
+    Args:
+        reader (messages.MessageReader): Message to key. Its body is
+            parsed if it has not been.
+
+    Returns:
+        key (str)
+    """
+    # Parsing preserves the order of body fields, so every delivery of
+    # a message encodes to the same bytes.
+    content = codec.dumps(
+                          [reader.message_kind, reader.sender, reader.body],
+                          default=codec.encode_default)
+    digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+    return _with_batch_index(f"content:{reader.seed_id}:{reader.previous_event_id}:{digest}", reader)
+
+
+def message_key(reader):
+    """Key a message on its event ID, or its content if it has none."""
+    event_id = reader.event_id
+    if event_id is None:
+        return content_key(reader)
+    return _with_batch_index(f"event:{event_id}", reader)
+
+
+def _with_batch_index(key, reader):
+    batch_index = reader.header.get(envelope.BATCH_INDEX_FIELD)
+    if batch_index is None:
+        return key
+    return f"{key}:{batch_index}"
+
+
+# Expired keys are deleted from the on-disk store every this many writes
+PURGE_INTERVAL = 1000
+
+
+class IdempotencyCache:
+    """Remember which messages have been handled.
+
+    seen() records a key and reports whether it had already been
+    recorded, in one atomic step, also across processes that share the
+    on-disk store. check() and add() do the same in two steps, so that
+    work can be done in between. A key is forgotten ttl seconds after it
+    was recorded, or earlier if max_entries newer keys have been
+    recorded since it was last seen; entries in the on-disk store only
+    expire.
+
+    Hit and miss counters are kept so the redelivery rate can be logged.
+
+    Args:
+        max_entries (int): Keys kept in memory.
+        ttl (float): Seconds a key is remembered. Pub/Sub stops
+            redelivering a message after its retention period, at most
+            7 days, but most redeliveries happen within minutes.
+        path (str): SQLite database file to also store keys in.
+        clock (callable): Returns the current time in seconds.
+    """
+
+    def __init__(
+                 self,
+                 max_entries=10000,
+                 ttl=3600.0,
+                 path=None,
+                 clock=time.time):
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # key -> expiry time, least recently seen first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._writes = 0
+        if path is not None:
+            # Statements commit on their own; _claim() begins its
+            # transaction explicitly.
+            self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            # A write-ahead log without a sync per commit keeps a write
+            # to tens of microseconds; a power loss can lose the latest
+            # keys, which only allows a rare redelivery through.
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY, expires REAL NOT NULL)")
+
+    @property
+    def hit_rate(self):
+        """Fraction of seen() and check() calls that found a duplicate."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        """Return the counters as a dictionary, for logging."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": self.hit_rate,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+        }
+
+    def seen(self, key):
+        """Record a key and return True if it was already recorded."""
+        now = self.clock()
+        with self._lock:
+            if self._connection is None:
+                duplicate = self._contains(key, now)
+                if not duplicate:
+                    self._remember(key, now + self.ttl)
+            else:
+                duplicate = not self._claim(key, now)
+            self._count(duplicate)
+            return duplicate
+
+    def check(self, key):
+        """Return True if a key is recorded, counting a hit or miss."""
+        now = self.clock()
+        with self._lock:
+            duplicate = self._contains(key, now)
+            self._count(duplicate)
+            return duplicate
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._contains(key, self.clock())
+
+    def add(self, key):
+        """Record a key without counting a hit or miss."""
+        with self._lock:
+            self._add(key, self.clock())
+
+    def discard(self, key):
+        """Forget a key, e.g. when handling a message recorded by seen()
+        failed and it should be handled again when it is redelivered.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            if self._connection is not None:
+                self._connection.execute("DELETE FROM seen WHERE key = ?", (key,))
+
+    def clear(self):
+        """Forget every key and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+            if self._connection is not None:
+                self._connection.execute("DELETE FROM seen")
+
+    def close(self):
+        """Close the on-disk store, if any."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _count(self, duplicate):
+        if duplicate:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def _contains_in_memory(self, key, now):
+        expires = self._entries.get(key)
+        if expires is not None:
+            if expires > now:
+                self._entries.move_to_end(key)
+                return True
+            del self._entries[key]
+        return False
+
+    def _contains(self, key, now):
+        if self._contains_in_memory(key, now):
+            return True
+        if self._connection is not None:
+            row = self._connection.execute(
+                "SELECT expires FROM seen WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[0] > now:
+                self._remember(key, row[0])
+                return True
+        return False
+
+    def _add(self, key, now):
+        expires = now + self.ttl
+        self._remember(key, expires)
+        if self._connection is not None:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO seen (key, expires) VALUES (?, ?)", (key, expires))
+            self._purge(now)
+
+    def _claim(self, key, now):
+        """Record a key in the on-disk store unless another process has,
+        and return True if this call recorded it.
+        """
+        if self._contains_in_memory(key, now):
+            return False
+        expires = now + self.ttl
+        connection = self._connection
+        # The write lock is taken up front, so the conditional insert
+        # and the read of a row another process recorded see one state.
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            claimed = connection.execute(
+                "INSERT INTO seen (key, expires) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET expires = excluded.expires "
+                "WHERE seen.expires <= ?",
+                (key, expires, now)).rowcount == 1
+            if not claimed:
+                expires = connection.execute(
+                    "SELECT expires FROM seen WHERE key = ?", (key,)).fetchone()[0]
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        self._remember(key, expires)
+        if claimed:
+            self._purge(now)
+        return claimed
+
+    def _purge(self, now):
+        self._writes += 1
+        if self._writes % PURGE_INTERVAL == 0:
+            self._connection.execute("DELETE FROM seen WHERE expires <= ?", (now,))
+
+    def _remember(self, key, expires):
+        entries = self._entries
+        entries[key] = expires
+        entries.move_to_end(key)
+        if len(entries) > self.max_entries:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+
+_default_cache = None
+
+def get_default_cache():
+    """Return the process-wide cache used by MessageReader.is_duplicate().
+
+    Module state persists across invocations of a warm Cloud Function
+    instance, so the cache catches redeliveries to the same instance.
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = IdempotencyCache()
+    return _default_cache
@@ -0,0 +1,205 @@
+"""Per-hop latency of messages through a Trellis pipeline.
+
+Writers stamp the time a message is sent into its header (sentAtNs, a
+wall clock time, and sentMonotonicNs) and readers record when they
+received it. Every message names the event it was sent in response to
+as its previousEventId and the message that started the chain as its
+seedId, so logged reader records can be linked into lineage chains:
+
+    record = reader.latency_record()
+    logging.info(json.dumps(record))
+
+LatencyAnalyzer rebuilds the chains from those records and reports,
+for each stage, the queueing latency from a message being sent until it
+is received and the processing latency from a function receiving a
+message until it sends the next message of the chain.
+
+Wall clock times compare across machines, to within their clock skew.
+Monotonic times only compare within one process, such as an
+InMemoryBroker pipeline, where they are more precise.
+"""
+
+import time
+import collections
+
+
+SENT_AT_FIELD = 'sentAtNs'
+SENT_MONOTONIC_FIELD = 'sentMonotonicNs'
+_ENCODED_STAMPS = f',"{SENT_AT_FIELD}":%d,"{SENT_MONOTONIC_FIELD}":%d}}'.encode()
+
+
+def stamp_header(header):
+    """Add send times to a message header and return it."""
+    header[SENT_AT_FIELD] = time.time_ns()
+    header[SENT_MONOTONIC_FIELD] = time.monotonic_ns()
+    return header
+
+
+def stamp_message(message):
+    """Return a copy of a message dictionary with fresh send times.
+
+    The caller's message is not changed. Messages without a header
+    dictionary are returned as they are.
+    """
+    header = message.get('header')
+    if not isinstance(header, dict):
+        return message
+    return dict(message, header=stamp_header(dict(header)))
+
+
+def stamp_encoded_header(header):
+    """Add send times to an encoded, non-empty header object.
+
+    Lets a writer encode a header once and stamp each message it
+    builds from it.
+
+    Args:
+        header (bytes): JSON object ending with '}'.
+
+    Returns:
+        header (bytes): The object with sentAtNs and sentMonotonicNs.
+    """
+    return header[:-1] + _ENCODED_STAMPS % (time.time_ns(), time.monotonic_ns())
+
+
+# Latency of one message. processing is None if the message that
+# caused it was not recorded.
+Hop = collections.namedtuple('Hop', ['seed_id', 'event_id', 'stage', 'queueing_ns', 'processing_ns'])
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class LatencyAnalyzer:
+    """Rebuild lineage chains from reader latency records.
+
+    Args:
+        clock (str): 'wall' or 'monotonic', the stamps to compare.
+    """
+
+    def __init__(self, clock='wall'):
+        if clock == 'wall':
+            self._sent_field, self._received_field = SENT_AT_FIELD, 'receivedAtNs'
+        elif clock == 'monotonic':
+            self._sent_field, self._received_field = SENT_MONOTONIC_FIELD, 'receivedMonotonicNs'
+        else:
+            raise ValueError(f"Clock '{clock}' is not 'wall' or 'monotonic'.")
+        self.clock = clock
+        # str(eventId), with ':batchIndex' for queryResponseBatch
+        # entities -> record
+        self.records = {}
+        # str(eventId) -> first record of the event
+        self._event_records = {}
+
+    def add(self, record):
+        """Add a record from MessageReader.latency_record()."""
+        # Context event IDs are strings but readers parse
+        # previousEventId as an int
+        event_id = str(record['eventId'])
+        # The entities of a batch share its event ID
+        batch_index = record.get('batchIndex')
+        key = event_id if batch_index is None else f"{event_id}:{batch_index}"
+        self.records[key] = record
+        self._event_records.setdefault(event_id, record)
+
+    def add_reader(self, reader):
+        self.add(reader.latency_record())
+
+    def chains(self):
+        """Return seedId -> records of the chain, in order received."""
+        chains = collections.defaultdict(list)
+        for record in self.records.values():
+            chains[record['seedId']].append(record)
+        received = self._received_field
+        for chain in chains.values():
+            chain.sort(key=lambda record: record[received])
+        return dict(chains)
+
+    def hops(self):
+        """Yield a Hop for every record that has a send stamp.
+
+        The stage of a hop is the sender and messageKind of the message.
+        """
+        sent, received = self._sent_field, self._received_field
+        event_records = self._event_records
+        for record in self.records.values():
+            sent_ns = record.get(sent)
+            if sent_ns is None:
+                continue
+            # Entities of a batch that caused this message were
+            # received together, so any of them gives the receipt time
+            cause = event_records.get(str(record['previousEventId']))
+            processing_ns = None
+            if cause is not None and cause is not record:
+                processing_ns = sent_ns - cause[received]
+            yield Hop(
+                      record['seedId'],
+                      record['eventId'],
+                      (record['sender'], record['messageKind']),
+                      record[received] - sent_ns,
+                      processing_ns)
+
+    def end_to_end(self):
+        """Return seedId -> ns from the first send to the last receipt."""
+        sent, received = self._sent_field, self._received_field
+        latencies = {}
+        for seed_id, chain in self.chains().items():
+            sent_times = [record[sent] for record in chain if record.get(sent) is not None]
+            if sent_times:
+                latencies[seed_id] = chain[-1][received] - min(sent_times)
+        return latencies
+
+    def summary(self, percentiles=(0.5, 0.9, 0.99)):
+        """Summarize latencies per stage and end to end.
+
+        Returns:
+            summary (dict): (sender, messageKind), or 'endToEnd' ->
+                {'count': int, 'queueing'/'processing'/'total':
+                {percentile: milliseconds}}.
+        """
+        queueing = collections.defaultdict(list)
+        processing = collections.defaultdict(list)
+        for hop in self.hops():
+            queueing[hop.stage].append(hop.queueing_ns)
+            if hop.processing_ns is not None:
+                processing[hop.stage].append(hop.processing_ns)
+
+        def distribution(values):
+            values = sorted(values)
+            return {fraction: _percentile(values, fraction) / 1e6 for fraction in percentiles} if values else {}
+
+        summary = {
+            stage: {
+                'count': len(values),
+                'queueing': distribution(values),
+                'processing': distribution(processing[stage]),
+            }
+            for stage, values in queueing.items()}
+        end_to_end = list(self.end_to_end().values())
+        summary['endToEnd'] = {'count': len(end_to_end), 'total': distribution(end_to_end)}
+        return summary
+
+    def format_summary(self, percentiles=(0.5, 0.9, 0.99)):
+        """Return the summary as a text table, slowest stage first."""
+        summary = self.summary(percentiles)
+        end_to_end = summary.pop('endToEnd')
+        labels = ' '.join(f"{'p%g' % (fraction * 100):>9}" for fraction in percentiles)
+        lines = [f"{'stage':<40} {'count':>7}  {'latency':<10} {labels}  (ms)"]
+
+        def row(name, count, kind, distribution):
+            values = ' '.join(f"{distribution[fraction]:>9.3f}" for fraction in percentiles)
+            return f"{name:<40} {count:>7}  {kind:<10} {values}"
+
+        def slowest(item):
+            stage = item[1]
+            return -sum(distribution.get(percentiles[0], 0) for distribution in (stage['queueing'], stage['processing']))
+
+        for (sender, message_kind), stage in sorted(summary.items(), key=slowest):
+            name = f"{sender} {message_kind}"
+            lines.append(row(name, stage['count'], 'queueing', stage['queueing']))
+            if stage['processing']:
+                lines.append(row('', '', 'processing', stage['processing']))
+        if end_to_end['total']:
+            lines.append(row('end to end', end_to_end['count'], 'total', end_to_end['total']))
+        return '\n'.join(lines)
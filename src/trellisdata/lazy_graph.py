@@ -0,0 +1,156 @@
+from . import codec
+from . import messaging
+
+
+class LazyGraph:
+    """Read-only view of a graph JSON payload that decodes entities on access.
+
+    Most consumers of a graph payload only look at labels and a few
+    properties. A LazyGraph keeps the raw payload until it is first
+    read, and then keeps the parsed node and relationship dictionaries.
+    Driver Node/Relationship objects are only built for the entities a
+    caller asks for, and never in dict_only mode.
+
+    Args:
+        payload (bytes, str, memoryview or dict): Graph JSON in the
+            translate_graph_to_json() or normalized format, or its
+            parsed dictionary.
+        dict_only (bool): Return entity dictionaries instead of
+            neo4j.graph.Node and neo4j.graph.Relationship objects.
+            Their temporal, spatial and byte property values stay
+            tagged (see codec.decode_properties()).
+        hydrator (messaging.GraphJsonHydrator): Hydrator to use for
+            driver objects. Defaults to the shared messaging hydrator.
+    """
+
+    def __init__(self, payload, dict_only=False, hydrator=None):
+        self.dict_only = dict_only
+        self._payload = payload
+        self._graph_dict = None
+        self._hydrator = hydrator or messaging._hydrator
+        self._hydration_scope = None
+        self._node_index = None
+        self._relationship_index = None
+
+    def _get_graph_dict(self):
+        if self._graph_dict is None:
+            if isinstance(self._payload, dict):
+                self._graph_dict = self._payload
+            else:
+                self._graph_dict = codec.loads(self._payload)
+            if self._graph_dict.get('format') == messaging.NORMALIZED_FORMAT:
+                self._graph_dict = messaging.expand_normalized_graph(self._graph_dict)
+            # The parsed dictionary replaces the raw payload
+            self._payload = None
+        return self._graph_dict
+
+    @property
+    def node_dicts(self):
+        return self._get_graph_dict()['nodes']
+
+    @property
+    def relationship_dicts(self):
+        return self._get_graph_dict()['relationships']
+
+    def _get_node_index(self):
+        if self._node_index is None:
+            self._node_index = {node['element_id']: node for node in self.node_dicts}
+        return self._node_index
+
+    def _get_relationship_index(self):
+        if self._relationship_index is None:
+            self._relationship_index = {rel['element_id']: rel for rel in self.relationship_dicts}
+        return self._relationship_index
+
+    def _get_graph_hydrator(self):
+        # All entities hydrated from this view share one Graph, so
+        # relationships point at the same Node objects as nodes().
+        if self._hydration_scope is None:
+            self._hydration_scope = self._hydrator.hydration_handler.new_hydration_scope()
+        return self._hydration_scope._graph_hydrator
+
+    def _hydrate_node(self, node):
+        return self._get_graph_hydrator().hydrate_node(
+            node['id_'],
+            node['labels'],
+            codec.decode_properties(node['properties']),
+            node['element_id'])
+
+    def _hydrate_relationship(self, rel):
+        graph_hydrator = self._get_graph_hydrator()
+        # Hydrate endpoints from the payload first so that they carry
+        # their labels and properties, not just their ids.
+        node_index = self._get_node_index()
+        for element_id in (rel['n0_element_id'], rel['n1_element_id']):
+            node = node_index.get(element_id)
+            if node is not None:
+                self._hydrate_node(node)
+        return graph_hydrator.hydrate_relationship(
+            rel['id_'],
+            rel['n0_id'],
+            rel['n1_id'],
+            rel['type_'],
+            codec.decode_properties(rel['properties']),
+            rel['element_id'],
+            rel['n0_element_id'],
+            rel['n1_element_id'])
+
+    def nodes(self, label=None):
+        """Iterate over nodes, optionally only those with a given label.
+
+        Args:
+            label (str): Only yield nodes that have this label.
+
+        Yields:
+            node (dict or neo4j.graph.Node)
+        """
+        for node in self.node_dicts:
+            if label is not None and label not in node['labels']:
+                continue
+            yield node if self.dict_only else self._hydrate_node(node)
+
+    def relationships(self, type=None):
+        """Iterate over relationships, optionally only those of a given type.
+
+        Args:
+            type (str): Only yield relationships of this type.
+
+        Yields:
+            relationship (dict or neo4j.graph.Relationship)
+        """
+        for rel in self.relationship_dicts:
+            if type is not None and rel['type_'] != type:
+                continue
+            yield rel if self.dict_only else self._hydrate_relationship(rel)
+
+    def get(self, element_id, default=None):
+        """Look up a node or relationship by element_id.
+
+        Returns:
+            entity (dict, neo4j.graph.Node or neo4j.graph.Relationship),
+                or default if there is no such entity.
+        """
+        node = self._get_node_index().get(element_id)
+        if node is not None:
+            return node if self.dict_only else self._hydrate_node(node)
+        rel = self._get_relationship_index().get(element_id)
+        if rel is not None:
+            return rel if self.dict_only else self._hydrate_relationship(rel)
+        return default
+
+    def __contains__(self, element_id):
+        return element_id in self._get_node_index() or element_id in self._get_relationship_index()
+
+    def __len__(self):
+        return len(self.node_dicts) + len(self.relationship_dicts)
+
+    def labels(self):
+        """Set of all node labels in the payload."""
+        labels = set()
+        for node in self.node_dicts:
+            labels.update(node['labels'])
+        return labels
+
+    def to_graph(self):
+        """Hydrate the whole payload into a new neo4j.graph.Graph."""
+        return self._hydrator.hydrate_many(self._get_graph_dict())
@@ -1,10 +1,17 @@
 import json
+import time
 import neo4j
-import base64
+import functools
+import contextlib
 
 import json
 from neo4j.graph import Graph
 
+from . import codec
+from . import envelope
+from . import idempotency
+from . import latency
+
 class QueryResponseHandler():
 
     #def __init__(self):
@@ -46,7 +53,7 @@ class QueryResponseHandler():
         node_dict = {
             "id": node.id,
             "labels": list(node.labels),
-            "properties": dict(node.items())
+            "properties": codec.tag_tuple_values(dict(node.items()))
 
         }
         return node_dict
@@ -68,11 +75,15 @@ class QueryResponseHandler():
             "start_node": self._get_node_dict(relationship.start_node),
             "end_node": self._get_node_dict(relationship.end_node),
             "type": relationship.type,
-            "properties": dict(relationship.items())
+            "properties": codec.tag_tuple_values(dict(relationship.items()))
         }
         return relationship_dict
 
 
+# Pub/Sub accepts messages of up to 10 MB; stay well below it
+DEFAULT_BATCH_BYTES = 1024 * 1024
+
+
 class MessageWriter(object):
 
     def __init__(
@@ -86,15 +97,20 @@ class MessageWriter(object):
         self.seed_id = seed_id
         self.previous_event_id = previous_event_id
 
+    def _format_header(self):
+        # Header without send times, for writers that stamp each
+        # message they encode from it
+        return {
+                "messageKind": self.message_kind,
+                "sender": self.sender,
+                "seedId": self.seed_id,
+                "previousEventId": self.previous_event_id,
+        }
+
     def format_json_header(self):
 
         message = {
-           "header": {
-                      "messageKind": self.message_kind,
-                      "sender": self.sender,
-                      "seedId": self.seed_id,
-                      "previousEventId": self.previous_event_id,
-           }
+           "header": latency.stamp_header(self._format_header())
         }
         return message
 
@@ -136,7 +152,7 @@ class QueryRequestWriter(MessageWriter):
         body = {
                 "body": {
                     "queryName": self.query_name,
-                    "queryParameters": self.query_parameters,
+                    "queryParameters": codec.tag_tuple_values(dict(self.query_parameters)),
                     # Adding support for custom queries
                     "custom": self.custom
                 }
@@ -249,6 +265,104 @@ class QueryResponseWriter(MessageWriter):
         else:
             raise ValueError(f"Pattern '{self.pattern}' not in supported patterns: {self.supported_patterns}.")
 
+    def generate_separate_entity_payloads(self):
+        """Yield ready-to-publish bytes for each node or relationship.
+
+        Produces the same messages as generate_separate_entity_jsons(),
+        but the header, queryName, jobRequest and resultSummary are
+        encoded once and spliced into every message; only the entity
+        itself and the send times in the header are encoded per
+        message.
+
+        Yields:
+            payload (bytes): Encoded queryResponse message.
+        """
+        dumps = codec.dumps
+        default = codec.encode_default
+        summary_dict = self._get_result_summary_dict(self.result_summary)
+        stamp = latency.stamp_encoded_header
+        header = dumps(self._format_header(), default=default)
+
+        shared_prefix = b''.join([
+            b',"body":{"queryName":', dumps(self.query_name, default=default),
+            b',"jobRequest":', dumps(self.job_request, default=default),
+            b',"resultSummary":', dumps(summary_dict, default=default)])
+
+        if self.pattern == "node":
+            prefix = shared_prefix + b',"nodes":['
+            suffix = b'],"relationship":{}}}'
+            for node in self.nodes:
+                entity = dumps(self._get_node_dict(node), default=default)
+                yield b''.join([b'{"header":', stamp(header), prefix, entity, suffix])
+        elif self.pattern == "relationship":
+            prefix = shared_prefix + b',"nodes":[],"relationship":'
+            suffix = b'}}'
+            for relationship in self.relationships:
+                entity = dumps(self._get_relationship_dict(relationship), default=default)
+                yield b''.join([b'{"header":', stamp(header), prefix, entity, suffix])
+        else:
+            raise ValueError(f"Pattern '{self.pattern}' not in supported patterns: {self.supported_patterns}.")
+
+    def generate_batch_payloads(self, max_bytes=DEFAULT_BATCH_BYTES):
+        """Yield queryResponseBatch messages packing many entities each.
+
+        Each entity is encoded as it would be in its own queryResponse
+        message, with a sub-header holding its batchIndex, the position
+        of the entity in the query result. Entities are added to a
+        message until the next one would push it past max_bytes; an
+        entity that alone exceeds max_bytes is sent in its own message.
+        Each message is stamped with its send times as it is yielded.
+        Read the messages with QueryResponseBatchReader.
+
+        Args:
+            max_bytes (int): Size budget of each encoded message.
+
+        Yields:
+            payload (bytes): Encoded queryResponseBatch message.
+        """
+        dumps = codec.dumps
+        default = codec.encode_default
+        summary_dict = self._get_result_summary_dict(self.result_summary)
+        stamp = latency.stamp_encoded_header
+        header = dumps(dict(self._format_header(), messageKind='queryResponseBatch'), default=default)
+
+        prefix = b''.join([
+            b',"body":{"queryName":', dumps(self.query_name, default=default),
+            b',"jobRequest":', dumps(self.job_request, default=default),
+            b',"resultSummary":', dumps(summary_dict, default=default),
+            b',"entities":['])
+        suffix = b']}}'
+
+        if self.pattern == "node":
+            entity_parts = (
+                (b'"nodes":[' + dumps(self._get_node_dict(node), default=default) + b'],"relationship":{}}')
+                for node in self.nodes)
+        elif self.pattern == "relationship":
+            entity_parts = (
+                (b'"nodes":[],"relationship":' + dumps(self._get_relationship_dict(relationship), default=default) + b'}')
+                for relationship in self.relationships)
+        else:
+            raise ValueError(f"Pattern '{self.pattern}' not in supported patterns: {self.supported_patterns}.")
+
+        # Size the header by one stamp; a later stamp is at most a
+        # digit longer, well within Pub/Sub's limit
+        envelope_bytes = len(b'{"header":') + len(stamp(header)) + len(prefix) + len(suffix)
+        batch = []
+        batch_bytes = envelope_bytes
+        for batch_index, entity_part in enumerate(entity_parts):
+            entity = b'{"header":{"batchIndex":%d},%s' % (batch_index, entity_part)
+            # Entities after the first are preceded by a comma
+            entity_bytes = len(entity) + (1 if batch else 0)
+            if batch and batch_bytes + entity_bytes > max_bytes:
+                yield b''.join([b'{"header":', stamp(header), prefix, b','.join(batch), suffix])
+                batch = []
+                batch_bytes = envelope_bytes
+                entity_bytes -= 1
+            batch.append(entity)
+            batch_bytes += entity_bytes
+        if batch:
+            yield b''.join([b'{"header":', stamp(header), prefix, b','.join(batch), suffix])
+
     def _get_result_summary_dict(self, result_summary):
         # Create a copy of the dict so that metadata and server
         # elements are preserved in self.result_summary.
@@ -284,7 +398,7 @@ class QueryResponseWriter(MessageWriter):
             "start_node": self._get_node_dict(relationship.start_node),
             "end_node": self._get_node_dict(relationship.end_node),
             "type": relationship.type,
-            "properties": dict(relationship.items())
+            "properties": codec.tag_tuple_values(dict(relationship.items()))
         }
         return relationship_dict
 
@@ -303,7 +417,7 @@ class QueryResponseWriter(MessageWriter):
         node_dict = {
             "id": node.id,
             "labels": list(node.labels),
-            "properties": dict(node.items())
+            "properties": codec.tag_tuple_values(dict(node.items()))
 
         }
         return node_dict
@@ -318,13 +432,12 @@ class JobCreatedWriter(MessageWriter):
                  previous_event_id,
                  job_dict):
 
-        self.message_kind = 'jobCreated'
-
         super().__init__(
                          sender,
                          seed_id,
                          previous_event_id)
 
+        self.message_kind = 'jobCreated'
         self.job_dict = job_dict
 
     def format_json_message(self):
@@ -340,95 +453,429 @@ class JobCreatedWriter(MessageWriter):
 
 
 class MessageReader(object):
+    """Read a Trellis message from a Pub/Sub event.
+
+    The header is parsed when the reader is created; the body is only
+    parsed when it, or a field read from it, is first accessed. Readers
+    that are only used to route on header fields never parse the body.
+
+    The header is validated when the reader is created and the body when
+    it is parsed (see envelope.py).
+
+    Raises:
+        envelope.MessageValidationError: If the message does not match
+            the envelope schema of its messageKind, or is not of the
+            kind the reader class expects.
+    """
+
+    __slots__ = (
+                 'context',
+                 'header',
+                 'message_kind',
+                 'sender',
+                 'event_id',
+                 'seed_id',
+                 'previous_event_id',
+                 'received_at_ns',
+                 'received_monotonic_ns',
+                 '_payload',
+                 '_body_start',
+                 '_body')
+
+    # messageKind accepted by the reader class; None accepts any kind.
+    expected_message_kind = None
 
     def __init__(
                  self, 
                  context, 
                  event):
 
-        self.context = context
+        # Payload may be JSON or PackStream; the codec detects which
+        # and also unwraps messages that were JSON-encoded twice.
+        payload = codec.event_payload(event)
+        self._read(context, payload, *codec.split_message(payload))
 
-        pubsub_message = base64.b64decode(event['data']).decode('utf-8')
-        data = json.loads(pubsub_message)
+    @classmethod
+    def from_payload(cls, context, payload, message_parts=None):
+        """Create a reader from a decoded event payload.
 
-        # Not sure what cases caused me to add this to db-query,
-        # but keeping it in because I don't see any harm
-        if type(data) == str:
-            logging.warn("#> Message data not correctly loaded as JSON. " +
-                         "Used eval to convert from string.")
-            data = eval(data)
+        Args:
+            context (google.cloud.functions.Context): Event metadata.
+            payload (bytes): Base64 decoded and decompressed event data.
+            message_parts (tuple): The result of
+                codec.split_message(payload), if it has been called.
 
-        seed_id = int(data['header'].get('seedId'))
-        previous_event_id = int(data['header'].get('previousEventId'))
+        Returns:
+            reader (MessageReader)
+        """
+        reader = cls.__new__(cls)
+        reader._read(context, payload, *(message_parts or codec.split_message(payload)))
+        return reader
+
+    def _read(self, context, payload, header, body, body_start):
+        # Reject malformed messages before any reader state is set
+        if body is None and body_start is None:
+            raise envelope.MessageValidationError("Message is missing body.")
+        error = envelope.validate_envelope(header, body, self.expected_message_kind)
+        if error is not None:
+            raise envelope.MessageValidationError(error)
+
+        seed_id = int(header.get('seedId'))
+        previous_event_id = int(header.get('previousEventId'))
         if not previous_event_id:
             previous_event_id = seed_id
 
         self.context = context
-        self.message_kind = data['header']['messageKind']
-        self.header = data['header']
-        self.body = data['body']
-        self.sender = data['header']['sender']
+        self.message_kind = header['messageKind']
+        self.header = header
+        self.sender = header['sender']
         self.event_id = context.event_id
         self.seed_id = seed_id
         self.previous_event_id = previous_event_id
+        self.received_at_ns = time.time_ns()
+        self.received_monotonic_ns = time.monotonic_ns()
+
+        self._body = body
+        self._body_start = body_start
+        # Only keep the payload while the body is unparsed
+        self._payload = payload if body is None else None
+
+    def latency_record(self):
+        """Return the send and receive times of the message, for logging
+        and latency.LatencyAnalyzer. Send times are None if the writer
+        did not stamp them.
+        """
+        header = self.header
+        return {
+            "eventId": self.event_id,
+            "batchIndex": header.get(envelope.BATCH_INDEX_FIELD),
+            "seedId": self.seed_id,
+            "previousEventId": self.previous_event_id,
+            "sender": self.sender,
+            "messageKind": self.message_kind,
+            "sentAtNs": header.get(latency.SENT_AT_FIELD),
+            "sentMonotonicNs": header.get(latency.SENT_MONOTONIC_FIELD),
+            "receivedAtNs": self.received_at_ns,
+            "receivedMonotonicNs": self.received_monotonic_ns,
+        }
+
+    def is_duplicate(self, cache=None):
+        """Return True if this message has already been handled.
+
+        Call before doing work that should not be repeated when Pub/Sub
+        redelivers the message, and call mark_done() once the work has
+        succeeded. If handling fails the message is not recorded, so a
+        redelivery is handled again.
+
+        Args:
+            cache (idempotency.IdempotencyCache): Defaults to the
+                process-wide cache.
+
+        Returns:
+            duplicate (bool)
+        """
+        if cache is None:
+            cache = idempotency.get_default_cache()
+        return cache.check(idempotency.message_key(self))
+
+    def mark_done(self, cache=None):
+        """Record this message as handled (see is_duplicate())."""
+        if cache is None:
+            cache = idempotency.get_default_cache()
+        cache.add(idempotency.message_key(self))
+
+    @contextlib.contextmanager
+    def handle_once(self, cache=None):
+        """Check for a redelivery and record the message as handled if
+        the block does not raise:
+
+            with reader.handle_once() as duplicate:
+                if duplicate:
+                    return
+                ...
+
+        Yields:
+            duplicate (bool)
+        """
+        duplicate = self.is_duplicate(cache)
+        yield duplicate
+        if not duplicate:
+            self.mark_done(cache)
+
+    @property
+    def body(self):
+        body = self._body
+        if body is None:
+            body = codec.load_message_body(self._payload, self._body_start)
+            validate_body = envelope.get_body_validator(self.message_kind)
+            if validate_body is not None:
+                error = validate_body(body)
+                if error is not None:
+                    raise envelope.MessageValidationError(error)
+            self._body = body
+            self._payload = None
+        return body
 
 
 class QueryRequestReader(MessageReader):
 
-    def __init__(
-                 self,
-                 context,
-                 event):
+    __slots__ = ('_query_parameters',)
 
-        super().__init__(context, event)
+    expected_message_kind = 'queryRequest'
 
-        if self.message_kind != 'queryRequest':
-            return ValueError
+    def _read(self, *args):
+        super()._read(*args)
+        self._query_parameters = None
+
+    @property
+    def query_name(self):
+        return self.body['queryName']
 
-        self.query_name = self.body['queryName']
-        self.query_parameters = self.body['queryParameters']
-        self.custom = bool(self.body['custom'])
+    @property
+    def query_parameters(self):
+        # Parameters copied from node properties may hold tagged values
+        if self._query_parameters is None:
+            self._query_parameters = codec.decode_values(self.body['queryParameters'])
+        return self._query_parameters
 
+    @property
+    def custom(self):
+        return bool(self.body['custom'])
+
+    def _get_custom_body(self, field):
         # Should only be populated for custom queries
-        if self.custom:
-            self.cypher = self.body['cypher']
-            self.write_transaction = bool(self.body['writeTransaction'])
-            self.aggregate_results = bool(self.body['aggregateResults'])
-            self.publish_to = self.body.get('publishTo')
-            self.returns = self.body.get('returns')
+        if not self.custom:
+            raise AttributeError(f"'{field}' is only set for custom queries.")
+        return self.body
+
+    @property
+    def cypher(self):
+        return self._get_custom_body('cypher')['cypher']
+
+    @property
+    def write_transaction(self):
+        return bool(self._get_custom_body('write_transaction')['writeTransaction'])
+
+    @property
+    def aggregate_results(self):
+        return bool(self._get_custom_body('aggregate_results')['aggregateResults'])
+
+    @property
+    def publish_to(self):
+        return self._get_custom_body('publish_to').get('publishTo')
+
+    @property
+    def returns(self):
+        return self._get_custom_body('returns').get('returns')
+
+
+def _decode_node_dict(node_dict):
+    """Restore tagged property values in a QueryResponseWriter node dict."""
+    properties = codec.decode_properties(node_dict['properties'])
+    if properties is node_dict['properties']:
+        return node_dict
+    return dict(node_dict, properties=properties)
+
+
+def _decode_relationship_dict(relationship_dict):
+    """Restore tagged property values in a QueryResponseWriter relationship dict."""
+    if not relationship_dict:
+        return relationship_dict
+    return dict(
+        relationship_dict,
+        start_node=_decode_node_dict(relationship_dict['start_node']),
+        end_node=_decode_node_dict(relationship_dict['end_node']),
+        properties=codec.decode_properties(relationship_dict['properties']))
 
 
 class QueryResponseReader(MessageReader):
 
-    def __init__(
-                 self,
-                 context,
-                 event):
+    __slots__ = ('_nodes', '_relationship')
 
-        super().__init__(context, event)
-        
-        if self.message_kind != 'queryResponse':
-            return ValueError
+    expected_message_kind = 'queryResponse'
+
+    def _read(self, *args):
+        super()._read(*args)
+        self._nodes = None
+        self._relationship = None
+
+    @property
+    def query_name(self):
+        return self.body['queryName']
+
+    @property
+    def result_summary(self):
+        return self.body['resultSummary']
+
+    @property
+    def nodes(self):
+        if self._nodes is None:
+            self._nodes = [_decode_node_dict(node) for node in self.body['nodes']]
+        return self._nodes
+
+    @property
+    def relationship(self):
+        if self._relationship is None:
+            self._relationship = _decode_relationship_dict(self.body['relationship'])
+        return self._relationship
+
+    @property
+    def job_request(self):
+        return self.body['jobRequest']
+
+
+class QueryResponseBatchReader(MessageReader):
+    """Read a queryResponseBatch message from
+    QueryResponseWriter.generate_batch_payloads().
+
+    Iterating the reader yields a QueryResponseReader per entity, which
+    is created when it is reached. Entity readers share the batch's
+    body fields and header, with messageKind 'queryResponse' and the
+    entity's sub-header fields (batchIndex) added to the header.
+    """
+
+    __slots__ = ()
+
+    expected_message_kind = 'queryResponseBatch'
+
+    @property
+    def query_name(self):
+        return self.body['queryName']
 
-        self.query_name = self.body['queryName']
-        self.result_summary = self.body['resultSummary']
-        self.nodes = self.body['nodes']
-        self.relationship = self.body['relationship']
-        self.job_request = self.body['jobRequest']
+    @property
+    def result_summary(self):
+        return self.body['resultSummary']
+
+    @property
+    def job_request(self):
+        return self.body['jobRequest']
+
+    @property
+    def entities(self):
+        """Encoded entities with their sub-headers, as published."""
+        return self.body['entities']
+
+    def __len__(self):
+        return len(self.entities)
+
+    def __iter__(self):
+        body = self.body
+        header = dict(self.header, messageKind='queryResponse')
+        shared_body = {
+            'queryName': body['queryName'],
+            'jobRequest': body.get('jobRequest'),
+            'resultSummary': body['resultSummary'],
+        }
+        for entity in body['entities']:
+            error = envelope.validate_batch_entity(entity)
+            if error is not None:
+                raise envelope.MessageValidationError(error)
+            reader = QueryResponseReader.__new__(QueryResponseReader)
+            reader._read(
+                         self.context,
+                         None,
+                         dict(header, **entity['header']),
+                         dict(shared_body, nodes=entity['nodes'], relationship=entity['relationship']),
+                         None)
+            yield reader
 
 
 class JobCreatedReader(MessageReader):
-    def __init__(
-                 self,
-                 context,
-                 event):
 
-        super().__init__(context, event)
+    __slots__ = ('_job_dict',)
+
+    expected_message_kind = 'jobCreated'
+
+    def _read(self, *args):
+        super()._read(*args)
+        self._job_dict = None
+
+    @property
+    def job_dict(self):
+        if self._job_dict is None:
+            self._job_dict = codec.decode_values(self.body['jobDict'])
+        return self._job_dict
+
+
+# messageKind -> reader class used by read_message()
+READER_CLASSES = {
+    reader_class.expected_message_kind: reader_class
+    for reader_class in (QueryRequestReader, QueryResponseReader, QueryResponseBatchReader, JobCreatedReader)}
+
+
+def register_reader(reader_class):
+    """Make read_message() use reader_class for its expected_message_kind.
 
-        if self.message_kind != 'jobCreated':
-            return ValueError("Message is not of type 'jobCreated'.")
+    Can be used as a class decorator.
+    """
+    READER_CLASSES[reader_class.expected_message_kind] = reader_class
+    return reader_class
 
-        self.job_dict = self.body['jobDict']
+
+def read_message(event, context):
+    """Decode a Pub/Sub event once and read it with the reader for its kind.
+
+    Messages of kinds without a registered reader are read with the
+    generic MessageReader.
+
+    Args:
+        event (dict): Pub/Sub event with base64 encoded 'data'.
+        context (google.cloud.functions.Context): Event metadata.
+
+    Returns:
+        reader (MessageReader): Reader of the registered class.
+
+    Raises:
+        envelope.MessageValidationError: If the message is malformed.
+    """
+    payload = codec.event_payload(event)
+    message_parts = codec.split_message(payload)
+    header = message_parts[0]
+    message_kind = header.get('messageKind') if header.__class__ is dict else None
+    reader_class = READER_CLASSES.get(message_kind, MessageReader)
+    return reader_class.from_payload(context, payload, message_parts)
+
+
+class MessageDispatcher:
+    """Route messages of mixed kinds to handlers registered per messageKind.
+
+    A dispatcher is callable with the (event, context) arguments of a
+    Pub/Sub Cloud Function, so it can be used as the entry point:
+
+        dispatcher = MessageDispatcher()
+
+        @dispatcher.register('queryResponse')
+        def handle_response(reader):
+            ...
+
+    Args:
+        default (callable): Handler for messages of unregistered kinds.
+            If None, such messages raise ValueError.
+    """
+
+    def __init__(self, default=None):
+        self.default = default
+        self._handlers = {}
+
+    def register(self, message_kind, handler=None):
+        """Register a handler, which is called with the message reader.
+
+        Returns the handler, or a decorator if handler is None.
+        """
+        if handler is None:
+            return functools.partial(self.register, message_kind)
+        self._handlers[message_kind] = handler
+        return handler
+
+    def dispatch(self, event, context):
+        """Read an event and return the result of its kind's handler."""
+        reader = read_message(event, context)
+        handler = self._handlers.get(reader.message_kind, self.default)
+        if handler is None:
+            raise ValueError(f"No handler registered for messageKind '{reader.message_kind}'.")
+        return handler(reader)
+
+    __call__ = dispatch
 
 
 """
@@ -5,13 +5,15 @@
 # other serverless functions, data will be manipulated
 # by these functions.
 
-import json
-import base64
+import io
+
+from . import codec
 
 from neo4j._codec.hydration.v2 import HydrationHandler
 
 from neo4j.graph import (
     Node,
+    Path,
     Relationship
 )
 
@@ -31,7 +33,7 @@ def _get_node_dict(node):
         "id_": node.id,
         "element_id": node.element_id,
         "labels": list(node.labels),
-        "properties": dict(node.items())
+        "properties": codec.tag_tuple_values(dict(node.items()))
     }
     return node_dict
 
@@ -55,7 +57,7 @@ def _get_relationship_dict(relationship):
         "n0_id": relationship.start_node.id,
         "n1_id": relationship.end_node.id,
         "type_": relationship.type,
-        "properties": dict(relationship.items()),
+        "properties": codec.tag_tuple_values(dict(relationship.items())),
         "element_id": relationship.element_id,
         "n0_element_id": relationship.start_node.element_id,
         "n1_element_id": relationship.end_node.element_id
@@ -64,40 +66,358 @@ def _get_relationship_dict(relationship):
     }
     return relationship_dict
 
+def iter_graph_json(graph):
+    """Encode a neo4j.graph.Graph as JSON, one chunk at a time.
+
+    Walks graph.nodes and graph.relationships once and yields the
+    encoding of each entity as soon as it is built, so only one
+    entity dictionary is alive at a time. Joining the chunks gives
+    the same document as translate_graph_to_json().
+
+    Args:
+        graph (neo4j.graph.Graph): Graph to encode.
+
+    Yields:
+        chunk (bytes): Consecutive pieces of the UTF-8 graph JSON document.
+    """
+    dumps = codec.dumps
+    encode_value = codec.encode_value
+
+    yield b'{"nodes":['
+    separator = b''
+    for node in graph.nodes:
+        yield separator + dumps(_get_node_dict(node), default=encode_value)
+        separator = b','
+
+    yield b'],"relationships":['
+    separator = b''
+    for rel in graph.relationships:
+        yield separator + dumps(_get_relationship_dict(rel), default=encode_value)
+        separator = b','
+    yield b']}'
+
+def write_graph_json(graph, sink):
+    """Stream the JSON encoding of a graph into a sink.
+
+    Args:
+        graph (neo4j.graph.Graph): Graph to encode.
+        sink: Text file-like object, binary file-like object
+            (e.g. io.BytesIO, socket file) or bytearray.
+    """
+    chunks = iter_graph_json(graph)
+    if isinstance(sink, bytearray):
+        for chunk in chunks:
+            sink.extend(chunk)
+    elif isinstance(sink, io.TextIOBase):
+        for chunk in chunks:
+            sink.write(chunk.decode('utf-8'))
+    else:
+        for chunk in chunks:
+            sink.write(chunk)
+
 def translate_graph_to_json(graph):
-    nodes = []
-    relationships = []
+    return b''.join(iter_graph_json(graph)).decode('utf-8')
+
+NORMALIZED_FORMAT = "normalized"
+
+def _intern(table, index, value):
+    position = index.get(value)
+    if position is None:
+        position = index[value] = len(table)
+        table.append(value)
+    return position
 
+def translate_graph_to_normalized_json(graph):
+    """Encode a graph as JSON with a node table and interned strings.
+
+    Label, relationship type and property key strings are stored once in
+    lookup tables and referenced by position. Relationships refer to
+    their endpoints by row in the node table instead of repeating node
+    ids. Layout:
+
+        {"format": "normalized",
+         "labels": [label, ...], "types": [type, ...], "keys": [key, ...],
+         "nodes": [[id, element_id, [label index, ...], [key index, value, ...]], ...],
+         "relationships": [[id, element_id, type index, start row, end row,
+                            [key index, value, ...]], ...]}
+
+    translate_json_to_graph() detects and hydrates this layout.
+
+    Args:
+        graph (neo4j.graph.Graph): Graph to encode.
+
+    Returns:
+        graph_json (str): Normalized graph JSON.
+    """
+    labels, label_index = [], {}
+    types, type_index = [], {}
+    keys, key_index = [], {}
+    node_rows = {}
+
+    def encode_properties(entity):
+        encoded = []
+        for key, value in codec.tag_tuple_values(dict(entity.items())).items():
+            encoded.append(_intern(keys, key_index, key))
+            encoded.append(value)
+        return encoded
+
+    nodes = []
     for node in graph.nodes:
-        node_dict = _get_node_dict(node)
-        nodes.append(node_dict)
+        node_rows[node.element_id] = len(nodes)
+        nodes.append([
+            node.id,
+            node.element_id,
+            [_intern(labels, label_index, label) for label in node.labels],
+            encode_properties(node)])
 
+    relationships = []
     for rel in graph.relationships:
-        rel_dict = _get_relationship_dict(rel)
-        relationships.append(rel_dict)
-    
-    # Create a dictionary representing the graph
+        relationships.append([
+            rel.id,
+            rel.element_id,
+            _intern(types, type_index, rel.type),
+            node_rows[rel.start_node.element_id],
+            node_rows[rel.end_node.element_id],
+            encode_properties(rel)])
+
     graph_dict = {
+        "format": NORMALIZED_FORMAT,
+        "labels": labels,
+        "types": types,
+        "keys": keys,
         "nodes": nodes,
         "relationships": relationships}
+    return codec.dumps_str(graph_dict, default=codec.encode_value)
 
-    # Convert the graph dictionary to JSON
-    graph_json = json.dumps(graph_dict)
+def _decode_normalized_properties(keys, encoded):
+    return codec.decode_properties(
+        {keys[encoded[i]]: encoded[i + 1] for i in range(0, len(encoded), 2)})
 
-    return graph_json
+def expand_normalized_graph(graph_dict):
+    """Convert a normalized graph dictionary to the standard graph JSON layout.
+
+    Args:
+        graph_dict (dict): Parsed output of translate_graph_to_normalized_json().
+
+    Returns:
+        (dict): Dictionary with "nodes" and "relationships" in the
+            translate_graph_to_json() format.
+    """
+    labels = graph_dict['labels']
+    types = graph_dict['types']
+    keys = graph_dict['keys']
+    node_rows = graph_dict['nodes']
+
+    nodes = [{
+        "id_": id_,
+        "element_id": element_id,
+        "labels": [labels[i] for i in label_positions],
+        "properties": _decode_normalized_properties(keys, properties)}
+        for id_, element_id, label_positions, properties in node_rows]
+
+    relationships = []
+    for id_, element_id, type_position, start_row, end_row, properties in graph_dict['relationships']:
+        start_node = node_rows[start_row]
+        end_node = node_rows[end_row]
+        relationships.append({
+            "id_": id_,
+            "n0_id": start_node[0],
+            "n1_id": end_node[0],
+            "type_": types[type_position],
+            "properties": _decode_normalized_properties(keys, properties),
+            "element_id": element_id,
+            "n0_element_id": start_node[1],
+            "n1_element_id": end_node[1]})
+    return {"nodes": nodes, "relationships": relationships}
+
+class GraphJsonHydrator:
+    """Hydrate graph payloads into neo4j.graph.Graph objects.
+
+    Creating a HydrationHandler is the most expensive part of hydrating
+    a small graph, so a hydrator is meant to be created once (e.g. at
+    module level in a Cloud Function) and reused for every message.
+    Each call gets a fresh hydration scope, and so a separate Graph.
+    """
+
+    def __init__(self):
+        self.hydration_handler = HydrationHandler()
+
+    def hydrate(self, graph_json):
+        """Hydrate graph JSON into a Graph.
+
+        Args:
+            graph_json (str, bytes or dict): Graph JSON, or the
+                dictionary it has already been parsed into.
+
+        Returns:
+            graph (neo4j.graph.Graph): Hydrated graph.
+        """
+        if isinstance(graph_json, dict):
+            return self.hydrate_many(graph_json)
+        return self.hydrate_many(codec.loads(graph_json), codec.may_contain_tags(graph_json))
+
+    def hydrate_many(self, graph_dict, tagged=True):
+        """Hydrate every node and relationship of a parsed graph dictionary.
+
+        Args:
+            graph_dict (dict): Dictionary with "nodes" and "relationships"
+                lists in the translate_graph_to_json() format.
+            tagged (bool): False if no property value is tagged, so
+                decoding them can be skipped.
+
+        Returns:
+            graph (neo4j.graph.Graph): Hydrated graph.
+        """
+        if graph_dict.get('format') == NORMALIZED_FORMAT:
+            return self.hydrate_normalized(graph_dict)
+
+        hydration_scope = self.hydration_handler.new_hydration_scope()
+        graph_hydrator = hydration_scope._graph_hydrator
+        hydrate_node = graph_hydrator.hydrate_node
+        hydrate_relationship = graph_hydrator.hydrate_relationship
+        decode_properties = codec.decode_properties
+
+        # Positional calls avoid building a kwargs dict per entity.
+        for node in graph_dict['nodes']:
+            properties = node['properties']
+            hydrate_node(
+                node['id_'],
+                node['labels'],
+                decode_properties(properties) if tagged else properties,
+                node['element_id'])
+        for rel in graph_dict['relationships']:
+            properties = rel['properties']
+            hydrate_relationship(
+                rel['id_'],
+                rel['n0_id'],
+                rel['n1_id'],
+                rel['type_'],
+                decode_properties(properties) if tagged else properties,
+                rel['element_id'],
+                rel['n0_element_id'],
+                rel['n1_element_id'])
+        return hydration_scope.get_graph()
+
+    def hydrate_normalized(self, graph_dict):
+        """Hydrate a parsed translate_graph_to_normalized_json() payload.
+
+        Args:
+            graph_dict (dict): Normalized graph dictionary.
+
+        Returns:
+            graph (neo4j.graph.Graph): Hydrated graph.
+        """
+        labels = graph_dict['labels']
+        types = graph_dict['types']
+        keys = graph_dict['keys']
+        node_rows = graph_dict['nodes']
+
+        hydration_scope = self.hydration_handler.new_hydration_scope()
+        graph_hydrator = hydration_scope._graph_hydrator
+        hydrate_node = graph_hydrator.hydrate_node
+        hydrate_relationship = graph_hydrator.hydrate_relationship
+
+        for id_, element_id, label_positions, properties in node_rows:
+            hydrate_node(
+                id_,
+                [labels[i] for i in label_positions],
+                _decode_normalized_properties(keys, properties),
+                element_id)
+        for id_, element_id, type_position, start_row, end_row, properties in graph_dict['relationships']:
+            start_node = node_rows[start_row]
+            end_node = node_rows[end_row]
+            hydrate_relationship(
+                id_,
+                start_node[0],
+                end_node[0],
+                types[type_position],
+                _decode_normalized_properties(keys, properties),
+                element_id,
+                start_node[1],
+                end_node[1])
+        return hydration_scope.get_graph()
+
+    def hydrate_packstream(self, payload):
+        """Hydrate a payload created by translate_graph_to_packstream().
+
+        Args:
+            payload (bytes): PackStream encoded graph.
+
+        Returns:
+            graph (neo4j.graph.Graph): Hydrated graph.
+        """
+        unpacker = codec.new_packstream_unpacker(payload)
+        hydration_scope = self.hydration_handler.new_hydration_scope()
+        hydration_hooks = hydration_scope.hydration_hooks
+
+        # Each structure is hydrated into the scope's graph as it is unpacked.
+        for _ in range(unpacker.unpack()):
+            codec.unpack_value(unpacker, hydration_hooks)
+        for _ in range(unpacker.unpack()):
+            codec.unpack_value(unpacker, hydration_hooks)
+        return hydration_scope.get_graph()
+
+_hydrator = GraphJsonHydrator()
 
 def translate_json_to_graph(graph_json):
-    hydration_handler = HydrationHandler()
-    hydration_scope = hydration_handler.new_hydration_scope()
-    
-    graph_dict = json.loads(graph_json)
-
-    hydration_scope = hydration_handler.new_hydration_scope()
-    for node in graph_dict['nodes']:
-        hydration_scope._graph_hydrator.hydrate_node(**node)
-    for rel in graph_dict['relationships']:
-        hydration_scope._graph_hydrator.hydrate_relationship(**rel)
-    return hydration_scope.get_graph()
+    """Hydrate graph JSON into a Graph using a shared GraphJsonHydrator.
+
+    Args:
+        graph_json (str, bytes or dict): Graph JSON or parsed graph dictionary.
+
+    Returns:
+        graph (neo4j.graph.Graph): Hydrated graph.
+    """
+    return _hydrator.hydrate(graph_json)
+
+def translate_graph_to_packstream(graph):
+    """Encode a neo4j.graph.Graph as a versioned PackStream payload.
+
+    Nodes and relationships are packed as the same Bolt structures
+    (b'N' and b'R') the database sends to the driver, preceded by the
+    PackStream version byte and an entity count for each section.
+
+    Args:
+        graph (neo4j.graph.Graph): Graph to encode.
+
+    Returns:
+        payload (bytes): PackStream encoded graph.
+    """
+    packer, buffer = codec.new_packstream_packer()
+
+    nodes = graph.nodes
+    codec.pack_value(packer, len(nodes))
+    for node in nodes:
+        codec.pack_structure(packer, b'N', (
+            node.id,
+            list(node.labels),
+            dict(node.items()),
+            node.element_id))
+
+    relationships = graph.relationships
+    codec.pack_value(packer, len(relationships))
+    for rel in relationships:
+        codec.pack_structure(packer, b'R', (
+            rel.id,
+            rel.start_node.id,
+            rel.end_node.id,
+            rel.type,
+            dict(rel.items()),
+            rel.element_id,
+            rel.start_node.element_id,
+            rel.end_node.element_id))
+    return bytes(buffer.data)
+
+def translate_packstream_to_graph(payload):
+    """Decode a payload created by translate_graph_to_packstream().
+
+    Args:
+        payload (bytes): PackStream encoded graph.
+
+    Returns:
+        graph (neo4j.graph.Graph): Hydrated graph.
+    """
+    return _hydrator.hydrate_packstream(payload)
 
 def translate_record_to_json(record):
     """ Adapted from the RecordExporter class in neo4j.
@@ -120,70 +440,121 @@ def translate_record_to_json(record):
         "relationships": relationships
     }
 
-    graph_json = json.dumps(graph_dict)
+    graph_json = codec.dumps_str(graph_dict, default=codec.encode_value)
     return graph_json
 
 
-# Todo: Convert this to work on graph json. Instead of
-# changing behavior based on "pattern", implement a fixed
-# logic for splitting all nodes and relationships. If a 
-# node is in a relationship it should be removed from the
-# node pool.
-def split_json_graph_entities(graph_json):
+def _graph_json_from_chunks(node_chunks, relationship_chunks):
+    return (b'{"nodes":[' + b','.join(node_chunks) +
+            b'],"relationships":[' + b','.join(relationship_chunks) +
+            b']}').decode('utf-8')
+
+def iter_records_to_json(records, flush_every=None):
+    """Translate a stream of records into deduplicated graph JSON documents.
+
+    Walks every value of every record, including the members of paths
+    and lists, and encodes each node and relationship the first time its
+    element_id is seen. Entities repeated across records are skipped, so
+    a node returned by 5,000 rows is only serialized once.
+
+    Args:
+        records (neo4j.Result or iterable of neo4j.Record): Records to translate.
+        flush_every (int): If set, emit a graph document each time this
+            many new entities have been encoded. Entities are never repeated
+            across documents; a relationship whose endpoint nodes were sent
+            in an earlier document still refers to them by element_id.
+
+    Yields:
+        graph_json (str): Graph JSON in the translate_graph_to_json() format.
+            Exactly one document is yielded when flush_every is None.
     """
-    Todo: Convert this to work on graph json. Instead of
-    changing behavior based on "pattern", implement a fixed
-    logic for splitting all nodes and relationships. If a 
-    node is in a relationship it should be removed from the
-    node pool.
+    dumps = codec.dumps
+    encode_value = codec.encode_value
+    seen_nodes = set()
+    seen_relationships = set()
+    node_chunks = []
+    relationship_chunks = []
+
+    for record in records:
+        pending = list(record.values())
+        while pending:
+            value = pending.pop()
+            if isinstance(value, Node):
+                if value.element_id not in seen_nodes:
+                    seen_nodes.add(value.element_id)
+                    node_chunks.append(dumps(_get_node_dict(value), default=encode_value))
+            elif isinstance(value, Relationship):
+                if value.element_id not in seen_relationships:
+                    seen_relationships.add(value.element_id)
+                    relationship_chunks.append(dumps(_get_relationship_dict(value), default=encode_value))
+            elif isinstance(value, Path):
+                pending.extend(value.nodes)
+                pending.extend(value.relationships)
+            elif isinstance(value, (list, tuple)):
+                pending.extend(value)
+            else:
+                continue
+
+            if flush_every and len(node_chunks) + len(relationship_chunks) >= flush_every:
+                yield _graph_json_from_chunks(node_chunks, relationship_chunks)
+                node_chunks = []
+                relationship_chunks = []
+
+    if node_chunks or relationship_chunks or not flush_every:
+        yield _graph_json_from_chunks(node_chunks, relationship_chunks)
+
+def translate_records_to_json(records):
+    """Translate all records of a result into one deduplicated graph JSON.
+
+    Args:
+        records (neo4j.Result or iterable of neo4j.Record): Records to translate.
+
+    Returns:
+        graph_json (str): Graph JSON in the translate_graph_to_json() format.
     """
-    #summary_dict = self._get_result_summary_dict(self.result_summary)
-
-    # Create a dictionary of nodes, indexed by element_id
-    # Every node in a relationship will be removed from this
-    # dictionary, by their element_id.
-    nodes_by_id = {}
-    for node in graph_json['nodes']:
-        nodes_by_id[node['element_id']] = node
-
-    for relationship in graph_json['relationships']:
-        start_node = relationship['n0_element_id']
-        end_node = relationship['n1_element_id']
-        
-        del nodes_by_id[start_node]
-        del nodes_by_id[end_node]
-
-    # Return a list of dictionaries corresponding
-    if self.pattern == "node":
-        for node in self.nodes:
-            message = super().format_json_header()
-            body = {
-                    "body": {
-                        "queryName": self.query_name,
-                        "jobRequest": self.job_request,
-                        "nodes": [self._get_node_dict(node)],
-                        "relationship": {},
-                        "resultSummary": summary_dict
-                    }
-            }
-            message.update(body)
-            yield message
-    elif self.pattern == "relationship":
-        for relationship in self.relationships:
-            message = super().format_json_header()
-            body = {
-                    "body": {
-                        "queryName": self.query_name,
-                        "jobRequest": self.job_request,
-                        "nodes": [],
-                        "relationship": self._get_relationship_dict(relationship),
-                        "resultSummary": summary_dict
-                    }
-            }
-            message.update(body)
-            yield message
-    else:
-        raise ValueError(f"Pattern '{self.pattern}' not in supported patterns: {self.supported_patterns}.")
+    return next(iter_records_to_json(records))
+
+def split_json_graph_entities(graph_json):
+    """Split graph JSON into one single-entity graph per relationship or lone node.
+
+    Every relationship is yielded together with its start and end nodes,
+    or its one node if it is a self-loop.
+    Nodes that are not an endpoint of any relationship are then yielded
+    on their own. Endpoints are looked up in an element_id index, so the
+    split is a single O(nodes + relationships) pass and shared endpoint
+    nodes can appear in any number of relationship graphs.
+
+    Args:
+        graph_json (str, bytes or dict): Graph JSON in the standard or
+            normalized layout, or its parsed dictionary.
+
+    Yields:
+        entity_graph (dict): Dictionary with "nodes" and "relationships"
+            lists in the translate_graph_to_json() format, holding either
+            one relationship and its endpoints or one standalone node.
+    """
+    graph_dict = graph_json if isinstance(graph_json, dict) else codec.loads(graph_json)
+    if graph_dict.get('format') == NORMALIZED_FORMAT:
+        graph_dict = expand_normalized_graph(graph_dict)
+
+    nodes_by_id = {node['element_id']: node for node in graph_dict['nodes']}
+    connected_ids = set()
+
+    for relationship in graph_dict['relationships']:
+        start_id, end_id = relationship['n0_element_id'], relationship['n1_element_id']
+        # A self-loop has one endpoint node
+        endpoint_ids = (start_id,) if end_id == start_id else (start_id, end_id)
+        endpoints = []
+        for element_id in endpoint_ids:
+            connected_ids.add(element_id)
+            node = nodes_by_id.get(element_id)
+            if node is not None:
+                endpoints.append(node)
+        yield {"nodes": endpoints, "relationships": [relationship]}
+
+    for element_id, node in nodes_by_id.items():
+        if element_id not in connected_ids:
+            yield {"nodes": [node], "relationships": []}
 
 def translate_result_summary_to_json(result_summary):
     # Create a copy of the dict so that metadata and server
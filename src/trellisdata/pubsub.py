@@ -0,0 +1,419 @@
+"""Batched, asynchronous publishing to Pub/Sub topics.
+
+utils.publish_to_pubsub_topic() waits for every message to be
+acknowledged before returning, so a function that fans out one message
+per node pays a network round trip per message. BatchPublisher queues
+messages and returns futures instead; callers only wait when they need
+the results, typically once at the end of the function.
+
+InMemoryPublisher stands in for pubsub.PublisherClient in tests and
+benchmarks. InMemoryBroker also delivers published messages to
+subscribed functions, with Cloud Function event and context arguments,
+so a pipeline of functions can be run in one process.
+"""
+
+import time
+import queue
+import base64
+import threading
+import functools
+import datetime
+import itertools
+import collections
+
+from concurrent.futures import Future, wait
+
+from . import codec
+from . import latency
+
+
+class BatchPublisher:
+    """Publish messages in batches without blocking on each publish.
+
+    Messages are queued per topic and handed to the client when a topic
+    has max_messages queued, when its queued payloads reach max_bytes,
+    or max_latency seconds after the first message was queued, whichever
+    comes first. At most max_in_flight messages can be queued or
+    awaiting acknowledgement; publish() blocks until earlier messages
+    are acknowledged when that limit is reached.
+
+    Use as a context manager, or call close(), to send the remaining
+    messages and wait for them to be acknowledged.
+
+    Args:
+        publisher (pubsub.PublisherClient): Pub/Sub client.
+        project_id (str): Google Cloud Project ID.
+        max_messages (int): Flush a topic after this many messages.
+        max_bytes (int): Flush a topic after this many payload bytes.
+        max_latency (float): Seconds a message can wait to be flushed.
+        max_in_flight (int): Messages allowed to be queued or awaiting
+            acknowledgement.
+        compress_threshold (int): Compress payloads of at least this
+            many bytes. None disables compression.
+    """
+
+    def __init__(
+                 self,
+                 publisher,
+                 project_id,
+                 max_messages=100,
+                 max_bytes=1024 * 1024,
+                 max_latency=0.01,
+                 max_in_flight=1000,
+                 compress_threshold=codec.DEFAULT_COMPRESSION_THRESHOLD):
+
+        self.publisher = publisher
+        self.project_id = project_id
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+        self.compress_threshold = compress_threshold
+
+        self._topic_paths = {}
+        # topic path -> [(data, attributes, future), ...] and byte count
+        self._batches = {}
+        self._batch_bytes = {}
+        self._lock = threading.Lock()
+        self._timer = None
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._pending = set()
+        self._closed = False
+
+    def topic_path(self, topic):
+        """Return the cached full path of a topic."""
+        topic_path = self._topic_paths.get(topic)
+        if topic_path is None:
+            topic_path = self._topic_paths[topic] = self.publisher.topic_path(self.project_id, topic)
+        return topic_path
+
+    def publish(self, topic, message, wire_format='json'):
+        """Encode a message dictionary and queue it for publishing.
+
+        The header is stamped with the time of publishing; the
+        message passed in is not changed.
+
+        Args:
+            topic (str): Pub/Sub topic name.
+            message (dict): Dictionary with header and body fields.
+            wire_format (str): 'json' or 'packstream'.
+
+        Returns:
+            future (concurrent.futures.Future): Resolves to the
+                message ID once Pub/Sub has acknowledged the message.
+        """
+        data = codec.encode_message(latency.stamp_message(message), wire_format, default=codec.encode_default)
+        return self.publish_bytes(topic, data)
+
+    def publish_bytes(self, topic, data):
+        """Queue an already encoded message, such as the payloads from
+        QueryResponseWriter.generate_separate_entity_payloads().
+
+        Args:
+            topic (str): Pub/Sub topic name.
+            data (bytes): Encoded message.
+
+        Returns:
+            future (concurrent.futures.Future): Resolves to the message ID.
+        """
+        if self._closed:
+            raise RuntimeError("Cannot publish with a closed BatchPublisher.")
+
+        data, attributes = codec.compress_payload(data, self.compress_threshold)
+        topic_path = self.topic_path(topic)
+        future = Future()
+
+        self._in_flight.acquire()
+        with self._lock:
+            self._pending.add(future)
+            batch = self._batches.setdefault(topic_path, [])
+            batch.append((data, attributes, future))
+            batch_bytes = self._batch_bytes.get(topic_path, 0) + len(data)
+            self._batch_bytes[topic_path] = batch_bytes
+
+            if len(batch) >= self.max_messages or batch_bytes >= self.max_bytes:
+                del self._batches[topic_path]
+                del self._batch_bytes[topic_path]
+            else:
+                batch = None
+                if self._timer is None:
+                    self._timer = threading.Timer(self.max_latency, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+
+        if batch is not None:
+            self._send(topic_path, batch)
+        return future
+
+    def flush(self):
+        """Hand every queued message to the client without waiting."""
+        with self._lock:
+            batches = self._batches
+            self._batches = {}
+            self._batch_bytes = {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        for topic_path, batch in batches.items():
+            self._send(topic_path, batch)
+
+    def close(self, timeout=None):
+        """Flush queued messages and wait until all are acknowledged.
+
+        Returns:
+            futures (set): Futures that are not done after timeout.
+        """
+        self._closed = True
+        self.flush()
+        with self._lock:
+            pending = set(self._pending)
+        return wait(pending, timeout=timeout).not_done
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _send(self, topic_path, batch):
+        publish = self.publisher.publish
+        for data, attributes, future in batch:
+            try:
+                publish_future = publish(topic_path, data=data, **attributes)
+            except Exception as exception:
+                self._resolve(future, None, exception)
+            else:
+                publish_future.add_done_callback(functools.partial(self._on_published, future))
+
+    def _on_published(self, future, publish_future):
+        try:
+            result = publish_future.result()
+        except Exception as exception:
+            self._resolve(future, None, exception)
+        else:
+            self._resolve(future, result, None)
+
+    def _resolve(self, future, result, exception):
+        with self._lock:
+            self._pending.discard(future)
+        self._in_flight.release()
+        if exception is None:
+            future.set_result(result)
+        else:
+            future.set_exception(exception)
+
+
+class InMemoryPublisher:
+    """Stand-in for pubsub.PublisherClient that records published messages.
+
+    Futures are resolved by a background thread latency seconds after
+    publish() is called, simulating the acknowledgement round trip.
+
+    Args:
+        latency (float): Seconds before each publish is acknowledged.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        # topic path -> [(data, attributes), ...]
+        self.messages = {}
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1)
+        self._acknowledgements = queue.Queue()
+        self._worker = None
+
+    def topic_path(self, project_id, topic):
+        return f"projects/{project_id}/topics/{topic}"
+
+    def publish(self, topic, data, **attributes):
+        if not isinstance(data, bytes):
+            raise TypeError("Data being published to Pub/Sub must be sent as a bytestring.")
+
+        message_id = self._record(topic, data, attributes)
+        future = Future()
+        if not self.latency:
+            future.set_result(message_id)
+            return future
+
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._acknowledge, daemon=True)
+                    self._worker.start()
+        deadline = time.monotonic() + self.latency
+        self._acknowledgements.put((deadline, future, message_id))
+        return future
+
+    def _record(self, topic, data, attributes):
+        with self._lock:
+            self.messages.setdefault(topic, []).append((data, attributes))
+            return str(next(self._message_ids))
+
+    def _acknowledge(self):
+        # Latency is constant, so deadlines arrive in order.
+        while True:
+            deadline, future, message_id = self._acknowledgements.get()
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            future.set_result(message_id)
+
+    def events(self, topic):
+        """Published messages as Cloud Function Pub/Sub event dicts."""
+        return [
+            {'data': base64.b64encode(data), 'attributes': attributes}
+            for data, attributes in self.messages.get(topic, [])]
+
+
+# The context argument of a Pub/Sub triggered Cloud Function
+EventContext = collections.namedtuple('EventContext', ['event_id', 'timestamp', 'event_type', 'resource'])
+
+
+class Subscription:
+    """Delivers the messages of one topic to a function.
+
+    Created by InMemoryBroker.subscribe().
+
+    Attributes:
+        delivered (int): Messages the function returned from.
+        redelivered (int): Messages delivered again after the function
+            raised.
+        failed (int): Messages dropped after max_delivery_attempts.
+    """
+
+    def __init__(self, broker, topic, function, workers, max_delivery_attempts):
+        self.topic = topic
+        self.function = function
+        self.max_delivery_attempts = max_delivery_attempts
+        self.delivered = 0
+        self.redelivered = 0
+        self.failed = 0
+
+        self._broker = broker
+        self._queue = queue.Queue()
+        self._workers = [
+            threading.Thread(target=self._deliver, daemon=True)
+            for _ in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def close(self):
+        """Stop the workers once queued messages are delivered."""
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def _enqueue(self, message):
+        self._queue.put((message, 1))
+
+    def _deliver(self):
+        resource = {'service': 'pubsub.googleapis.com', 'name': self.topic}
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            (message_id, timestamp, data, attributes), attempt = item
+            event = {
+                     '@type': 'type.googleapis.com/google.pubsub.v1.PubsubMessage',
+                     'data': base64.b64encode(data).decode('ascii'),
+                     'attributes': dict(attributes)}
+            context = EventContext(message_id, timestamp, 'google.pubsub.topic.publish', resource)
+            try:
+                self.function(event, context)
+            except Exception:
+                if attempt < self.max_delivery_attempts:
+                    # Redeliveries keep the event ID, like Pub/Sub
+                    self._broker._delivery_done(self, redelivered=True)
+                    self._queue.put(((message_id, timestamp, data, attributes), attempt + 1))
+                else:
+                    self._broker._delivery_done(self, failed=True)
+            else:
+                self._broker._delivery_done(self)
+
+
+class InMemoryBroker(InMemoryPublisher):
+    """In-process Pub/Sub with topics and subscriptions.
+
+    Has the topic_path() and publish() methods of pubsub.PublisherClient,
+    so it can be given to BatchPublisher or utils.publish_to_pubsub_topic.
+    Every message published to a topic is delivered to each of the
+    topic's subscriptions, whose worker threads call the subscribed
+    function with (event, context) arguments shaped like a Pub/Sub
+    triggered Cloud Function's. Functions that raise are called again
+    with the same event, up to max_delivery_attempts times.
+
+    Args:
+        latency (float): Seconds before each publish is acknowledged.
+        max_delivery_attempts (int): Calls of a function per message.
+        keep_messages (bool): Record published messages in messages,
+            like InMemoryPublisher. Disable for long load tests.
+    """
+
+    def __init__(self, latency=0.0, max_delivery_attempts=5, keep_messages=True):
+        super().__init__(latency)
+        self.max_delivery_attempts = max_delivery_attempts
+        self.keep_messages = keep_messages
+        # topic path -> [Subscription, ...]
+        self.subscriptions = {}
+        self._undelivered = 0
+        self._delivered = threading.Condition(self._lock)
+
+    def subscribe(self, topic, function, workers=1):
+        """Call function(event, context) with each message published to
+        the topic from now on.
+
+        Args:
+            topic (str): Topic path.
+            function (callable): Cloud Function style entry point.
+            workers (int): Threads calling the function concurrently.
+
+        Returns:
+            subscription (Subscription)
+        """
+        subscription = Subscription(self, topic, function, workers, self.max_delivery_attempts)
+        with self._lock:
+            self.subscriptions.setdefault(topic, []).append(subscription)
+        return subscription
+
+    def join(self, timeout=None):
+        """Wait until every published message has been delivered,
+        including messages published by the subscribed functions.
+
+        Returns:
+            done (bool): False if timeout expired first.
+        """
+        with self._delivered:
+            return self._delivered.wait_for(lambda: self._undelivered == 0, timeout)
+
+    def close(self):
+        """Deliver the queued messages and stop every subscription."""
+        for subscriptions in list(self.subscriptions.values()):
+            for subscription in subscriptions:
+                subscription.close()
+
+    def _record(self, topic, data, attributes):
+        timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        with self._lock:
+            if self.keep_messages:
+                self.messages.setdefault(topic, []).append((data, attributes))
+            message_id = str(next(self._message_ids))
+            subscriptions = self.subscriptions.get(topic, ())
+            self._undelivered += len(subscriptions)
+        message = (message_id, timestamp, data, attributes)
+        for subscription in subscriptions:
+            subscription._enqueue(message)
+        return message_id
+
+    def _delivery_done(self, subscription, redelivered=False, failed=False):
+        with self._delivered:
+            if redelivered:
+                subscription.redelivered += 1
+                return
+            if failed:
+                subscription.failed += 1
+            else:
+                subscription.delivered += 1
+            self._undelivered -= 1
+            if not self._undelivered:
+                self._delivered.notify_all()
@@ -8,6 +8,9 @@ from anytree.search import find
 
 from datetime import datetime
 
+from . import codec
+from . import latency
+
 class TaxonomyParser:
     """
     This class is a wrapper on a Tree class from the anytree library to hold
@@ -159,14 +162,27 @@ def make_unique_task_id(nodes):
     task_id = f"{datetime_stamp}-{trunc_nodes_hash}"
     return(task_id, trunc_nodes_hash)
 
-def publish_to_pubsub_topic(publisher, project_id,  topic, message):
-    """Convert dictionary to JSON and publish to Pub/Sub topic.
+def publish_to_pubsub_topic(
+                            publisher,
+                            project_id,
+                            topic,
+                            message,
+                            wire_format='json',
+                            compress_threshold=codec.DEFAULT_COMPRESSION_THRESHOLD):
+    """Convert dictionary to JSON or PackStream and publish to Pub/Sub topic.
+
+    Blocks until the message is acknowledged. Use pubsub.BatchPublisher
+    to publish many messages without waiting on each one.
 
     Args:
         publisher (pubsub.PublisherClient): Pub/Sub client
         project_id (str): Google Cloud Project ID
         topic (str): Pub/Sub topic name
         message (dict): Dictionary with header and body fields.
+        wire_format (str): 'json' or 'packstream'. Readers detect
+            the format automatically.
+        compress_threshold (int): Compress payloads of at least this
+            many bytes. None disables compression.
 
     Returns:
         result (???)
@@ -174,14 +190,41 @@ def publish_to_pubsub_topic(publisher, project_id,  topic, message):
 
     topic_path = publisher.topic_path(project_id, topic)
     # https://stackoverflow.com/questions/11875770/how-to-overcome-datetime-datetime-not-json-serializable/36142844#36142844
-    json_message = json.dumps(message, indent=4, sort_keys=True, default=str).encode('utf-8')
-    result = publisher.publish(topic_path, data=json_message).result()
+    # Stamp send times now rather than when the message was formatted
+    encoded_message = codec.encode_message(latency.stamp_message(message), wire_format, default=codec.encode_default)
+    data, attributes = codec.compress_payload(encoded_message, compress_threshold)
+    result = publisher.publish(topic_path, data=data, **attributes).result()
     return result
 
-def publish_str_to_topic(publisher, project_id, topic, str_data):
-    topic_path = publisher.topic_path(project_id, topic)
+def publish_str_to_topic(
+                         publisher,
+                         project_id,
+                         topic,
+                         str_data,
+                         compress_threshold=codec.DEFAULT_COMPRESSION_THRESHOLD):
     message = str_data.encode('utf-8')
-    result = publisher.publish(topic_path, data=message).result()
+    return publish_bytes_to_topic(publisher, project_id, topic, message, compress_threshold)
+
+def publish_bytes_to_topic(
+                           publisher,
+                           project_id,
+                           topic,
+                           data,
+                           compress_threshold=codec.DEFAULT_COMPRESSION_THRESHOLD):
+    """Publish an already encoded message, such as the payloads from
+    QueryResponseWriter.generate_separate_entity_payloads().
+
+    Args:
+        publisher (pubsub.PublisherClient): Pub/Sub client
+        project_id (str): Google Cloud Project ID
+        topic (str): Pub/Sub topic name
+        data (bytes): Encoded message.
+        compress_threshold (int): Compress payloads of at least this
+            many bytes. None disables compression.
+    """
+    topic_path = publisher.topic_path(project_id, topic)
+    data, attributes = codec.compress_payload(data, compress_threshold)
+    result = publisher.publish(topic_path, data=data, **attributes).result()
     return result
 
 def convert_timestamp_to_rfc_3339(timestamp):
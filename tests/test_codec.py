@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+
+import json
+import base64
+import pytest
+
+import pytz
+
+from datetime import datetime
+
+from neo4j.time import (
+    Date,
+    DateTime,
+    Duration,
+    Time,
+)
+from neo4j.spatial import (
+    CartesianPoint,
+    WGS84Point,
+)
+
+from trellisdata import codec
+
+
+@pytest.fixture(params=codec.available_backends())
+def backend(request):
+    previous = codec.get_backend().name
+    yield codec.set_backend(request.param)
+    codec.set_backend(previous)
+
+
+class TestJsonCodec:
+
+    @pytest.fixture
+    def message(self):
+        return {
+            "header": {
+                "messageKind": "queryResponse",
+                "sender": "db-query",
+                "seedId": 123,
+                "previousEventId": 456,
+            },
+            "body": {
+                "queryName": "relateFastqToSample",
+                "nodes": [{"id_": 1, "labels": ["Blob", "Fastq"], "properties": {"size": 6495426765, "name": "SHIP123_2_R1"}}],
+                "relationship": {},
+            },
+        }
+
+    def test_round_trip(self, backend, message):
+        data = codec.dumps(message)
+        assert isinstance(data, bytes)
+        assert codec.loads(data) == message
+
+    def test_output_is_compact(self, backend, message):
+        data = codec.dumps(message)
+        assert b'": ' not in data
+        assert b', "' not in data
+        assert json.loads(data) == message
+
+    def test_loads_accepts_buffers(self, backend, message):
+        data = codec.dumps(message)
+        assert codec.loads(bytearray(data)) == message
+        assert codec.loads(memoryview(data)) == message
+        assert codec.loads(data.decode('utf-8')) == message
+
+    def test_loads_base64_decoded_payload(self, backend, message):
+        event_data = base64.b64encode(json.dumps(message, indent=4).encode('utf-8'))
+        assert codec.loads(base64.b64decode(event_data)) == message
+
+    def test_dumps_with_default(self, backend):
+        stamp = datetime(2022, 3, 24, 23, 44, 43)
+        data = codec.dumps({"updated": stamp}, default=str)
+        assert codec.loads(data)["updated"].startswith("2022-03-24")
+
+    def test_dumps_str(self, backend, message):
+        assert codec.loads(codec.dumps_str(message)) == message
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            codec.set_backend("not-a-backend")
+
+    def test_stdlib_always_available(self):
+        assert "json" in codec.available_backends()
+
+
+class TestPropertyValues:
+
+    @pytest.fixture
+    def properties(self):
+        return {
+            "name": "SHIP123_2_R1",
+            "size": 6495426765,
+            "timeCreated": DateTime(2022, 3, 24, 23, 44, 43, 241000001, tzinfo=pytz.utc),
+            "timeLocal": pytz.timezone("America/Los_Angeles").localize(DateTime(2022, 3, 24, 16, 44, 43)),
+            "dateCreated": Date(2022, 3, 24),
+            "startTime": Time(12, 30, 0, 5),
+            "runTime": Duration(months=1, days=2, seconds=3, nanoseconds=4),
+            "location": WGS84Point((-122.1, 37.4)),
+            "position": CartesianPoint((1.0, 2.0, 3.0)),
+            "checksum": b"\x00\xffcrc",
+            "dates": [Date(2022, 3, 24), Date(2022, 3, 25)],
+            "zones": ["us-west1-a", "us-west1-b"],
+        }
+
+    def test_round_trip(self, backend, properties):
+        data = codec.dumps(codec.tag_tuple_values(dict(properties)), default=codec.encode_value)
+        decoded = codec.decode_properties(codec.loads(data))
+        assert decoded == properties
+        assert decoded["timeLocal"].tzinfo.zone == "America/Los_Angeles"
+        assert type(decoded["location"]) is WGS84Point
+
+    def test_compact_tags(self, backend, properties):
+        encoded = codec.loads(codec.dumps(codec.tag_tuple_values(properties), default=codec.encode_value))
+        assert encoded["dateCreated"] == {"$d": "2022-03-24"}
+        assert encoded["runTime"] == {"$du": [1, 2, 3, 4]}
+        assert encoded["position"] == {"$pt": [9157, 1.0, 2.0, 3.0]}
+        assert encoded["dates"] == [{"$d": "2022-03-24"}, {"$d": "2022-03-25"}]
+        assert encoded["name"] == "SHIP123_2_R1"
+
+    def test_python_datetime(self, backend):
+        data = codec.dumps({"timeCreated": datetime(2022, 3, 24, 23, 44, 43)}, default=codec.encode_value)
+        encoded = codec.loads(data)
+        assert encoded == {"timeCreated": {"$dt": "2022-03-24T23:44:43"}}
+        assert codec.decode_properties(encoded)["timeCreated"] == DateTime(2022, 3, 24, 23, 44, 43)
+
+    def test_unsupported_type(self, backend):
+        with pytest.raises(TypeError):
+            codec.dumps({"value": object()}, default=codec.encode_value)
+
+    def test_untagged_properties_not_copied(self):
+        properties = {"sample": "SHIP123", "readGroup": 2}
+        assert codec.decode_properties(properties) is properties
+
+    def test_unknown_tag(self):
+        with pytest.raises(ValueError):
+            codec.decode_properties({"value": {"$xyz": 1}})
+
+    def test_tag_tuple_values(self):
+        untagged = {"sample": "SHIP123", "readGroups": [1, 2]}
+        assert codec.tag_tuple_values(untagged) == {"sample": "SHIP123", "readGroups": [1, 2]}
+
+        properties = {"runTime": Duration(days=2), "path": [CartesianPoint((1.0, 2.0))]}
+        assert codec.tag_tuple_values(properties) is properties
+        assert properties == {"runTime": {"$du": [0, 2, 0, 0]}, "path": [{"$pt": [7203, 1.0, 2.0]}]}
+
+    def test_may_contain_tags(self, properties):
+        data = codec.dumps(properties, default=codec.encode_value)
+        assert codec.may_contain_tags(data)
+        assert codec.may_contain_tags(data.decode('utf-8'))
+        assert not codec.may_contain_tags(b'{"sample":"SHIP123"}')
+        assert codec.may_contain_tags(memoryview(b'{"sample":"SHIP123"}'))
+
+    def test_decode_values(self):
+        parameters = {
+            "sample": "SHIP123",
+            "timeCreated": {"$dt": "2022-03-24T23:44:43.241000000"},
+            "timeLocal": {"$dt": "2022-03-24T16:44:43-07:00", "$tz": "America/Los_Angeles"},
+            "props": {"readGroup": 2, "dates": [{"$d": "2022-03-24"}]},
+            "price": {"$": 5},
+        }
+        decoded = codec.decode_values(parameters)
+        assert decoded["timeCreated"] == DateTime(2022, 3, 24, 23, 44, 43, 241000000)
+        assert decoded["timeLocal"].tzinfo.zone == "America/Los_Angeles"
+        assert decoded["props"] == {"readGroup": 2, "dates": [Date(2022, 3, 24)]}
+        # Maps that are not tags are kept
+        assert decoded["price"] == {"$": 5}
+        assert parameters["timeCreated"] == {"$dt": "2022-03-24T23:44:43.241000000"}
+
+    def test_decode_values_not_copied(self):
+        parameters = {"sample": "SHIP123", "props": {"readGroup": 2}, "ids": [1, 2]}
+        assert codec.decode_values(parameters) is parameters
+
+    def test_encode_default(self, backend):
+        data = codec.dumps({"jobDict": {"date": Date(2022, 3, 24), "other": object}}, default=codec.encode_default)
+        assert codec.loads(data)["jobDict"] == {"date": {"$d": "2022-03-24"}, "other": str(object)}
+
+
+class TestPackstreamMessages:
+
+    @pytest.fixture
+    def message(self):
+        return {
+            "header": {"messageKind": "jobCreated", "sender": "job-launcher", "seedId": 123, "previousEventId": 456},
+            "body": {"jobDict": {"name": "fastq-to-ubam", "inputIds": [1, 2], "preemptible": True, "minRam": 7.5,
+                                 "timeCreated": DateTime(2022, 3, 24, 23, 44, 43)}},
+        }
+
+    def test_round_trip(self, message):
+        payload = codec.encode_message(message, wire_format='packstream')
+        assert payload[0] == codec.PACKSTREAM_V1
+        assert codec.decode_message(payload) == message
+
+    def test_detects_json(self):
+        message = {"header": {"messageKind": "queryRequest"}, "body": {}}
+        payload = codec.encode_message(message)
+        assert codec.decode_message(payload) == message
+
+    def test_unknown_wire_format(self, message):
+        with pytest.raises(ValueError):
+            codec.encode_message(message, wire_format='avro')
+
+
+class TestEventPayload:
+
+    @staticmethod
+    def read(event):
+        # As MessageReader decodes an event
+        payload = codec.event_payload(event)
+        header, body, body_start = codec.split_message(payload)
+        if body_start is not None:
+            body = codec.load_message_body(payload, body_start)
+        return {"header": header, "body": body}
+
+    @pytest.fixture
+    def message(self):
+        return {"header": {"messageKind": "queryRequest", "sender": "check-triggers", "seedId": 1, "previousEventId": 2},
+                "body": {"queryName": "dummyTrigger", "queryParameters": {}, "custom": False}}
+
+    def test_decode_bytes(self, backend, message):
+        event = {'data': base64.b64encode(json.dumps(message).encode('utf-8'))}
+        assert self.read(event) == message
+
+    def test_decode_memoryview(self, backend, message):
+        event = {'data': memoryview(base64.b64encode(codec.dumps(message)))}
+        assert self.read(event) == message
+
+    def test_decode_str(self, backend, message):
+        event = {'data': base64.b64encode(codec.dumps(message)).decode('ascii')}
+        assert self.read(event) == message
+
+    def test_decode_double_encoded(self, backend, message):
+        double_encoded = json.dumps(json.dumps(message)).encode('utf-8')
+        event = {'data': base64.b64encode(double_encoded)}
+        assert self.read(event) == message
+
+    def test_reject_python_literal(self, backend, message):
+        # Previously accepted through eval()
+        literal = json.dumps(str(message)).encode('utf-8')
+        event = {'data': base64.b64encode(literal)}
+        with pytest.raises(ValueError):
+            self.read(event)
+
+    def test_reject_non_object(self, backend):
+        event = {'data': base64.b64encode(b'[1, 2, 3]')}
+        with pytest.raises(ValueError):
+            self.read(event)
+
+
+class TestSplitMessage:
+
+    @pytest.fixture
+    def message(self):
+        return {"header": {"messageKind": "jobCreated", "sender": "job-launcher", "seedId": 1, "previousEventId": 2},
+                "body": {"jobDict": {"name": "fastq-to-ubam", "label": "\u00e9t\u00e9"}}}
+
+    @pytest.mark.parametrize("separators", [(',', ':'), (', ', ': ')])
+    def test_body_deferred(self, backend, message, separators):
+        payload = json.dumps(message, separators=separators).encode('utf-8')
+        header, body, body_start = codec.split_message(payload)
+        assert header == message['header']
+        assert body is None
+        assert codec.load_message_body(payload, body_start) == message['body']
+
+    @pytest.mark.parametrize("sender", ["d\u00e9j\u00e0", "a}b", "{x}\u00e9}"])
+    def test_header_strings(self, backend, message, sender):
+        message['header']['sender'] = sender
+        payload = json.dumps(message, ensure_ascii=False).encode('utf-8')
+        header, body, body_start = codec.split_message(payload)
+        assert header == message['header']
+        if body is None:
+            body = codec.load_message_body(payload, body_start)
+        assert body == message['body']
+
+    def test_nested_header(self, backend, message):
+        message['header']['stamps'] = {"sent": 1}
+        payload = codec.dumps(message)
+        header, body, body_start = codec.split_message(payload)
+        assert header == message['header']
+        assert codec.load_message_body(payload, body_start) == message['body']
+
+    def test_packstream_parsed_in_full(self, message):
+        payload = codec.encode_message(message, wire_format='packstream')
+        assert codec.split_message(payload) == (message['header'], message['body'], None)
+
+    def test_trailing_whitespace(self, backend, message):
+        payload = json.dumps(message, indent=4).encode('utf-8') + b'\n\r\n '
+        header, body, body_start = codec.split_message(payload)
+        assert header == message['header']
+        assert body is None
+        assert codec.load_message_body(payload, body_start) == message['body']
+
+    def test_missing_body(self):
+        assert codec.split_message(b'{"header":{"messageKind":"jobCreated"}}') == ({"messageKind": "jobCreated"}, None, None)
+
+    def test_not_object(self):
+        with pytest.raises(ValueError):
+            codec.split_message(b'[1]')
+
+    def test_body_not_object(self):
+        payload = b'{"header":{"messageKind":"jobCreated"},"body":[1]}'
+        header, body, body_start = codec.split_message(payload)
+        with pytest.raises(ValueError):
+            codec.load_message_body(payload, body_start)
+
+
+class TestCompression:
+
+    @pytest.fixture
+    def large_message(self):
+        nodes = [{"id_": i, "labels": ["Fastq"], "properties": {"sample": "SHIP123", "readGroup": i % 4}} for i in range(5000)]
+        return {"header": {"messageKind": "queryResponse", "sender": "db-query", "seedId": 1, "previousEventId": 2},
+                "body": {"nodes": nodes}}
+
+    def test_small_payload_uncompressed(self):
+        payload = codec.dumps({"header": {}, "body": {}})
+        data, attributes = codec.compress_payload(payload)
+        assert data is payload
+        assert attributes == {}
+
+    def test_large_payload_compressed(self, large_message):
+        payload = codec.dumps(large_message)
+        assert len(payload) > codec.DEFAULT_COMPRESSION_THRESHOLD
+        data, attributes = codec.compress_payload(payload)
+        assert attributes == {codec.CONTENT_ENCODING_ATTRIBUTE: codec.ZLIB_ENCODING}
+        assert len(data) < len(payload) / 5
+        assert codec.decompress_payload(data, attributes) == payload
+
+    def test_threshold_disabled(self, large_message):
+        payload = codec.dumps(large_message)
+        assert codec.compress_payload(payload, threshold=None) == (payload, {})
+
+    def test_decode_compressed_event(self, large_message):
+        data, attributes = codec.compress_payload(codec.dumps(large_message), threshold=0)
+        event = {'data': base64.b64encode(data), 'attributes': attributes}
+        assert codec.loads(codec.event_payload(event)) == large_message
+
+    def test_unknown_encoding(self):
+        with pytest.raises(ValueError):
+            codec.decompress_payload(b'abc', {codec.CONTENT_ENCODING_ATTRIBUTE: 'br'})
@@ -292,6 +292,9 @@ class TestDatabaseTriggerController(TestCase):
 
 		assert len(controller.node_triggers['PersonalisSequencing']) == 1
 
+		assert len(controller.relationship_index[('PersonalisSequencing', 'GENERATED', 'Fastq')]) == 2
+		assert len(controller.relationship_index[('Gvcf', 'HAS_INDEX', 'Tbi')]) == 1
+
 	@classmethod
 	def test_evaluate_rel_triggers_single_label(cls):
 
@@ -430,9 +433,136 @@ class TestDatabaseTriggerController(TestCase):
 
 		assert not triggers
 
+	@classmethod
+	def _relationship_response(cls, start_labels, relationship_type, end_labels, read_group=0):
+		header = {'messageKind': 'queryResponse', 'previousEventId': '4393280078988728', 'seedId': 4393288756907900, 'sender': 'trellis-db-query'}
+		body = {
+			'nodes': [],
+			'queryName': 'relateFastqToSequencing',
+			'relationship': {
+				'id': 1,
+				'start_node': {'id': 2, 'labels': start_labels, 'properties': {'sample': 'SAMPLE123'}},
+				'end_node': {'id': 3, 'labels': end_labels, 'properties': {'sample': 'SAMPLE123', 'readGroup': read_group}},
+				'type': relationship_type,
+				'properties': {}
+			},
+			'resultSummary': {},
+			'jobRequest': None
+		}
+		data_utf8 = json.dumps({"header": header, "body": body}).encode('utf-8')
+		return trellis.QueryResponseReader(mock_context, {'data': base64.b64encode(data_utf8)})
+
 	@classmethod
 	def test_eval_rel_triggers_multi_label(cls):
-		pass
+		controller = trellis.TriggerController(pilot_triggers)
+		read_response = cls._relationship_response(
+			['Blob', 'PersonalisSequencing'], 'GENERATED', ['Fastq', 'Blob'])
+		activated_triggers = controller.evaluate_trigger_conditions(read_response)
+
+		names = sorted(trigger.name for trigger, parameters in activated_triggers)
+		assert names == ['LaunchFastqToUbam', 'RelateGenomeToFastq']
+		parameters = dict(activated_triggers)
+		launch = [trigger for trigger in parameters if trigger.name == 'LaunchFastqToUbam'][0]
+		assert parameters[launch] == {'sample': 'SAMPLE123', 'read_group': 0}
+
+	@classmethod
+	def test_evaluate_many(cls):
+		controller = trellis.TriggerController(pilot_triggers)
+		responses = [
+			cls._relationship_response(['PersonalisSequencing'], 'GENERATED', ['Fastq'], read_group=read_group)
+			for read_group in (0, 1, 0)]
+		responses.append(cls._relationship_response(['Fastq'], 'GENERATED', ['PersonalisSequencing']))
+
+		activations = controller.evaluate_many(responses)
+		assert activations == {
+			'launchFastqToUbam': [
+				{'sample': 'SAMPLE123', 'read_group': 0},
+				{'sample': 'SAMPLE123', 'read_group': 1}],
+			'relateGenomeToFastq': [{'sample': 'SAMPLE123'}],
+		}
+
+	@classmethod
+	def test_evaluate_many_nodes(cls):
+		controller = trellis.TriggerController(pilot_triggers)
+		response = mock.Mock(
+			message_kind = 'queryResponse',
+			relationship = {},
+			nodes = [
+				{'id': i, 'labels': ['Fastq', 'Blob'], 'properties': {'sample': 'SAMPLE123', 'uri': f'gs://bucket/{i % 2}.fastq.gz'}}
+				for i in range(4)])
+		activations = controller.evaluate_many([response])
+		assert activations == {
+			'relateFastqToPersonalisSequencing': [
+				{'sample': 'SAMPLE123', 'uri': 'gs://bucket/0.fastq.gz'},
+				{'sample': 'SAMPLE123', 'uri': 'gs://bucket/1.fastq.gz'}],
+		}
+
+	@classmethod
+	def test_evaluate_many_batch(cls):
+		controller = trellis.TriggerController(pilot_triggers)
+		response = cls._relationship_response(['PersonalisSequencing'], 'GENERATED', ['Fastq'])
+		message = {
+			"header": dict(response.header, messageKind='queryResponseBatch'),
+			"body": {
+				"queryName": "relateFastqToSequencing",
+				"jobRequest": None,
+				"resultSummary": {},
+				"entities": [
+					{"header": {"batchIndex": i}, "nodes": [], "relationship": response.relationship}
+					for i in range(3)]}}
+		batch = trellis.read_message({'data': base64.b64encode(json.dumps(message).encode('utf-8'))}, mock_context)
+
+		activations = controller.evaluate_many([batch])
+		assert sorted(activations) == ['launchFastqToUbam', 'relateGenomeToFastq']
+		assert len(activations['launchFastqToUbam']) == 1
+
+	@classmethod
+	def test_relationship_property_parameters(cls):
+		controller = trellis.TriggerController("""
+--- !DatabaseTrigger
+name: RelateReadGroup
+pattern: relationship
+start:
+    label: PersonalisSequencing
+    properties:
+        sample: sample
+end:
+    label: Fastq
+    properties:
+        readGroup: read_group
+        sample: fastq_sample
+relationship:
+    type: GENERATED
+    properties:
+        ordinal: ordinal
+query: relateReadGroup
+""")
+		trigger = controller.relationship_triggers['PersonalisSequencing'][0]
+		parameters = trigger.extract_parameters(
+			{'sample': 'SAMPLE123'},
+			{'sample': 'SAMPLE123', 'readGroup': 1},
+			{'ordinal': 2})
+		assert parameters == {'sample': 'SAMPLE123', 'read_group': 1, 'fastq_sample': 'SAMPLE123', 'ordinal': 2}
+
+		with pytest.raises(KeyError, match="RelateReadGroup: GENERATED is missing property ordinal"):
+			trigger.extract_parameters({'sample': 'SAMPLE123'}, {'sample': 'SAMPLE123', 'readGroup': 1}, {})
+
+	@classmethod
+	def test_missing_node_property(cls):
+		controller = trellis.TriggerController(pilot_triggers)
+		trigger = controller.node_triggers['Fastq'][0]
+		with pytest.raises(KeyError, match="RelateFastqToPersonalisSequencing: Fastq is missing property uri"):
+			trigger.extract_parameters({'sample': 'SAMPLE123'})
+
+	@classmethod
+	def test_eval_rel_triggers_no_match(cls):
+		controller = trellis.TriggerController(pilot_triggers)
+		# Right labels, wrong relationship type
+		read_response = cls._relationship_response(['PersonalisSequencing'], 'HAS_INDEX', ['Fastq'])
+		assert controller.evaluate_trigger_conditions(read_response) == []
+		# Labels reversed
+		read_response = cls._relationship_response(['Fastq'], 'GENERATED', ['PersonalisSequencing'])
+		assert controller.evaluate_trigger_conditions(read_response) == []
 	
 	@classmethod
 	def test_eval_node_triggers_single_label(cls):
@@ -541,4 +671,216 @@ class TestTriggerControllerLoadTriggers(TestCase):
 	def test_load_trigger_no_end_label(cls):
 		match_pattern = "Trigger end node missing label."
 		with pytest.raises(ValueError, match=match_pattern):
-			controller = trellis.TriggerController(no_end_label)
\ No newline at end of file
+			controller = trellis.TriggerController(no_end_label)
+	@classmethod
+	def test_load_trigger_bad_condition(cls):
+		match_pattern = "Trigger MergeVcfs condition on 'wdlCallAlias' uses unsupported operators \\['like'\\]"
+		with pytest.raises(ValueError, match=match_pattern):
+			controller = trellis.TriggerController(condition_triggers.replace("in:", "like:"))
+
+
+condition_triggers = """
+--- !DatabaseTrigger
+name: MergeVcfs
+pattern: node
+start:
+    label: CromwellStep
+    properties:
+        sample: sample
+    conditions:
+        wdlCallAlias:
+            in: [MergeVCFs, HaplotypeCaller]
+        sample:
+            prefix: SHIP
+        shardIndex:
+            gte: 0
+            lt: 24
+        cromwellWorkflowId:
+            exists: true
+        status: STOPPED
+query: mergeVcfs
+--- !DatabaseTrigger
+name: LaunchFastqToUbam
+pattern: relationship
+start:
+    label: PersonalisSequencing
+end:
+    label: Fastq
+    properties:
+        sample: sample
+    conditions:
+        matePair: 1
+relationship:
+    type: GENERATED
+    conditions:
+        ordinal:
+            exists: false
+query: launchFastqToUbam
+"""
+
+
+class TestTriggerConditions(TestCase):
+
+	step = {
+		'id': 1,
+		'labels': ['CromwellStep'],
+		'properties': {
+			'wdlCallAlias': 'MergeVCFs',
+			'sample': 'SHIP000001',
+			'shardIndex': 3,
+			'cromwellWorkflowId': 'a1b2c3d4',
+			'status': 'STOPPED'}}
+
+	@classmethod
+	def _activated_queries(cls, controller, **properties):
+		node = dict(cls.step, properties=dict(cls.step['properties'], **properties))
+		return [trigger.query for trigger, parameters in controller._match_node_triggers(node)]
+
+	@classmethod
+	def test_all_conditions_met(cls):
+		controller = trellis.TriggerController(condition_triggers)
+		assert cls._activated_queries(controller) == ['mergeVcfs']
+
+	@classmethod
+	def test_membership(cls):
+		controller = trellis.TriggerController(condition_triggers)
+		assert cls._activated_queries(controller, wdlCallAlias='BaseRecalibrator') == []
+		assert cls._activated_queries(controller, wdlCallAlias=['MergeVCFs']) == []
+
+	@classmethod
+	def test_prefix(cls):
+		controller = trellis.TriggerController(condition_triggers)
+		assert cls._activated_queries(controller, sample='SAMPLE123') == []
+		assert cls._activated_queries(controller, sample=None) == []
+
+	@classmethod
+	def test_range(cls):
+		controller = trellis.TriggerController(condition_triggers)
+		assert cls._activated_queries(controller, shardIndex=23) == ['mergeVcfs']
+		assert cls._activated_queries(controller, shardIndex=24) == []
+		assert cls._activated_queries(controller, shardIndex=-1) == []
+		assert cls._activated_queries(controller, shardIndex='3') == []
+
+	@classmethod
+	def test_exists_and_equality(cls):
+		controller = trellis.TriggerController(condition_triggers)
+		properties = dict(cls.step['properties'])
+		del properties['cromwellWorkflowId']
+		assert [trigger.query for trigger, _ in controller._match_node_triggers(dict(cls.step, properties=properties))] == []
+		assert cls._activated_queries(controller, status='RUNNING') == []
+
+	@classmethod
+	def test_relationship_conditions(cls):
+		controller = trellis.TriggerController(condition_triggers)
+		relationship = {
+			'start_node': {'labels': ['PersonalisSequencing'], 'properties': {}},
+			'end_node': {'labels': ['Fastq'], 'properties': {'sample': 'SHIP1', 'matePair': 1}},
+			'type': 'GENERATED',
+			'properties': {}}
+		assert len(controller._match_relationship_triggers(relationship)) == 1
+
+		mate_two = dict(relationship, end_node={'labels': ['Fastq'], 'properties': {'sample': 'SHIP1', 'matePair': 2}})
+		assert controller._match_relationship_triggers(mate_two) == []
+		ordinal = dict(relationship, properties={'ordinal': 0})
+		assert controller._match_relationship_triggers(ordinal) == []
+
+	@classmethod
+	def test_no_conditions(cls):
+		controller = trellis.TriggerController(pilot_triggers)
+		assert all(trigger.match_conditions is None for trigger in controller.node_triggers['Fastq'])
+
+	@classmethod
+	def test_invalid_operands(cls):
+		trigger = """--- !DatabaseTrigger
+name: CheckOperands
+pattern: node
+start:
+    label: CromwellStep
+    conditions:
+        shardIndex:
+            {condition}
+query: mergeVcfs
+"""
+		for condition in (
+						  "in: MergeVCFs",
+						  "prefix: 1",
+						  "prefix: [SHIP, 1]",
+						  "prefix: []",
+						  "gte: '0'",
+						  "gte: true",
+						  "lt: 2022-01-01",
+						  "exists: 'no'",
+						  "exists: 1"):
+			with pytest.raises(ValueError, match="CheckOperands"):
+				trellis.TriggerController(trigger.format(condition=condition))
+
+		controller = trellis.TriggerController(trigger.format(condition="gte: 2.5"))
+		assert cls._activated_queries(controller, shardIndex=3) == ['mergeVcfs']
+
+
+class FakeClock:
+
+	def __init__(self):
+		self.now = 0.0
+
+	def __call__(self):
+		return self.now
+
+
+class TestActivationCoalescer(TestCase):
+
+	@classmethod
+	def _coalescer(cls, window=5.0, max_entries=10000):
+		controller = trellis.TriggerController(pilot_triggers)
+		clock = FakeClock()
+		cache = trellis.IdempotencyCache(max_entries=max_entries, ttl=window, clock=clock)
+		return trellis.ActivationCoalescer(controller, window=window, cache=cache), clock
+
+	@classmethod
+	def _fastq_response(cls, read_group=0):
+		return TestDatabaseTriggerController._relationship_response(
+			['PersonalisSequencing'], 'GENERATED', ['Fastq'], read_group=read_group)
+
+	@classmethod
+	def test_suppress_within_window(cls):
+		coalescer, clock = cls._coalescer()
+		assert len(coalescer.evaluate_trigger_conditions(cls._fastq_response())) == 2
+		clock.now = 4.9
+		assert coalescer.evaluate_trigger_conditions(cls._fastq_response()) == []
+		# Different parameters for one of the two queries
+		activated = coalescer.evaluate_trigger_conditions(cls._fastq_response(read_group=1))
+		assert [trigger.query for trigger, parameters in activated] == ['launchFastqToUbam']
+
+		clock.now = 5.0
+		assert len(coalescer.evaluate_trigger_conditions(cls._fastq_response())) == 2
+		assert coalescer.stats() == {
+			'emitted': 5,
+			'suppressed': 3,
+			'suppressedByQuery': {'launchFastqToUbam': 1, 'relateGenomeToFastq': 2},
+		}
+
+	@classmethod
+	def test_evaluate_many(cls):
+		coalescer, clock = cls._coalescer()
+		responses = [cls._fastq_response(read_group) for read_group in (0, 1)]
+		assert coalescer.evaluate_many(responses) == {
+			'launchFastqToUbam': [
+				{'sample': 'SAMPLE123', 'read_group': 0},
+				{'sample': 'SAMPLE123', 'read_group': 1}],
+			'relateGenomeToFastq': [{'sample': 'SAMPLE123'}],
+		}
+		# A later batch from the same worker
+		assert coalescer.evaluate_many(responses + [cls._fastq_response(2)]) == {
+			'launchFastqToUbam': [{'sample': 'SAMPLE123', 'read_group': 2}],
+		}
+		assert coalescer.suppressed == 3
+
+	@classmethod
+	def test_size_cap(cls):
+		coalescer, clock = cls._coalescer(max_entries=2)
+		for read_group in range(3):
+			coalescer.evaluate_trigger_conditions(cls._fastq_response(read_group))
+		# The least recently seen activation was forgotten to stay within
+		# the cap; relateGenomeToFastq was seen in every response.
+		activated = coalescer.evaluate_trigger_conditions(cls._fastq_response(0))
+		assert [trigger.query for trigger, parameters in activated] == ['launchFastqToUbam']
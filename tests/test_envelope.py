@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from trellisdata import envelope
+
+
+@pytest.fixture
+def header():
+    return {"messageKind": "queryRequest", "sender": "check-triggers", "seedId": 123, "previousEventId": "456"}
+
+
+@pytest.fixture
+def body():
+    return {"queryName": "relateFastqToSample", "queryParameters": {"sample": "SHIP123"}, "custom": False}
+
+
+class TestValidateEnvelope:
+
+    def test_valid(self, header, body):
+        assert envelope.validate_envelope(header, body, 'queryRequest') is None
+
+    def test_header_only(self, header):
+        assert envelope.validate_envelope(header) is None
+
+    @pytest.mark.parametrize("field", ["messageKind", "sender", "seedId", "previousEventId"])
+    def test_missing_header_field(self, header, field):
+        del header[field]
+        assert field in envelope.validate_envelope(header)
+
+    @pytest.mark.parametrize("seed_id", [None, "12a", 1.5, True])
+    def test_invalid_seed_id(self, header, seed_id):
+        header["seedId"] = seed_id
+        assert "seedId" in envelope.validate_envelope(header)
+
+    def test_header_not_object(self):
+        assert "expected an object" in envelope.validate_envelope(["queryRequest"])
+
+    def test_wrong_kind(self, header, body):
+        assert "expected 'queryResponse'" in envelope.validate_envelope(header, body, 'queryResponse')
+
+    def test_missing_body_fields(self, header):
+        error = envelope.validate_envelope(header, {"queryName": "q"})
+        assert "custom, queryParameters" in error
+
+    def test_invalid_body_field(self, header, body):
+        body["queryParameters"] = "sample=SHIP123"
+        assert "queryParameters" in envelope.validate_envelope(header, body)
+
+    def test_custom_query_fields(self, header, body):
+        body["custom"] = True
+        assert "cypher" in envelope.validate_envelope(header, body)
+        body.update({"cypher": "RETURN 1", "writeTransaction": False, "aggregateResults": 0, "publishTo": ["TOPIC"]})
+        assert envelope.validate_envelope(header, body) is None
+
+    def test_optional_field_checked_when_present(self):
+        header = {"messageKind": "queryResponse", "sender": "db-query", "seedId": 1, "previousEventId": 2}
+        body = {"queryName": "q", "nodes": [], "relationship": {}, "resultSummary": {}}
+        assert envelope.validate_envelope(header, body) is None
+        body["jobRequest"] = 5
+        assert "jobRequest" in envelope.validate_envelope(header, body)
+
+    def test_unknown_kind_body_not_checked(self, header):
+        header["messageKind"] = "jobLauncherResponse"
+        assert envelope.validate_envelope(header, {}) is None
+
+
+class TestCompileValidator:
+
+    def test_error_is_subclass_of_value_error(self):
+        assert issubclass(envelope.MessageValidationError, ValueError)
+
+    def test_compile(self):
+        validate = envelope.compile_validator("test", {"a": lambda value: value > 0}, {"b": lambda value: value is None})
+        assert validate({"a": 1}) is None
+        assert "missing a" in validate({})
+        assert "'a'" in validate({"a": 0})
+        assert "'b'" in validate({"a": 1, "b": 2})
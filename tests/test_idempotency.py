@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+import json
+import base64
+import pytest
+import threading
+
+from types import SimpleNamespace
+
+import trellisdata as trellis
+
+from trellisdata import idempotency
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestIdempotencyCache:
+
+    @pytest.fixture
+    def clock(self):
+        return FakeClock()
+
+    def test_seen(self, clock):
+        cache = trellis.IdempotencyCache(clock=clock)
+        assert not cache.seen("a")
+        assert cache.seen("a")
+        assert not cache.seen("b")
+        assert cache.stats() == {"hits": 1, "misses": 2, "hitRate": 1 / 3, "evictions": 0, "entries": 2}
+
+    def test_ttl(self, clock):
+        cache = trellis.IdempotencyCache(ttl=10, clock=clock)
+        cache.seen("a")
+        clock.now += 9
+        assert "a" in cache
+        clock.now += 1
+        assert "a" not in cache
+        assert not cache.seen("a")
+
+    def test_lru_eviction(self, clock):
+        cache = trellis.IdempotencyCache(max_entries=2, clock=clock)
+        cache.seen("a")
+        cache.seen("b")
+        # Seeing "a" again makes "b" the least recently seen
+        assert cache.seen("a")
+        cache.seen("c")
+        assert "a" in cache
+        assert "b" not in cache
+        assert cache.evictions == 1
+
+    def test_discard(self, clock):
+        cache = trellis.IdempotencyCache(clock=clock)
+        cache.add("a")
+        cache.discard("a")
+        assert not cache.seen("a")
+
+    def test_check_does_not_record(self, clock):
+        cache = trellis.IdempotencyCache(clock=clock)
+        assert not cache.check("a")
+        assert not cache.check("a")
+        cache.add("a")
+        assert cache.check("a")
+        assert (cache.hits, cache.misses) == (1, 2)
+
+    def test_store_claims_once_across_processes(self, tmp_path):
+        # Each cache has its own connection, like separate processes
+        path = str(tmp_path / "seen.sqlite")
+        keys = [f"event:{i}" for i in range(200)]
+        claims = []
+
+        def claim():
+            cache = trellis.IdempotencyCache(path=path)
+            claims.extend(key for key in keys if not cache.seen(key))
+            cache.close()
+
+        threads = [threading.Thread(target=claim) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(claims) == sorted(keys)
+
+    def test_store_reclaims_expired_key(self, clock, tmp_path):
+        path = str(tmp_path / "seen.sqlite")
+        first = trellis.IdempotencyCache(ttl=10, path=path, clock=clock)
+        second = trellis.IdempotencyCache(ttl=10, path=path, clock=clock)
+        assert not first.seen("a")
+        assert second.seen("a")
+        clock.now += 10
+        assert not second.seen("a")
+        assert first.seen("a")
+        first.close()
+        second.close()
+
+    def test_store_survives_restart(self, clock, tmp_path):
+        path = str(tmp_path / "seen.sqlite")
+        cache = trellis.IdempotencyCache(max_entries=1, ttl=10, path=path, clock=clock)
+        cache.seen("a")
+        cache.seen("b")
+        # Evicted from memory but still in the store
+        assert cache.seen("a")
+        cache.close()
+
+        cache = trellis.IdempotencyCache(ttl=10, path=path, clock=clock)
+        assert cache.seen("b")
+        clock.now += 10
+        assert not cache.seen("b")
+        cache.close()
+
+
+class TestMessageKeys:
+
+    message = {
+        "header": {"messageKind": "queryRequest", "sender": "test", "seedId": 1, "previousEventId": 2},
+        "body": {"queryName": "q", "queryParameters": {}, "custom": False}}
+
+    def _reader(self, message, event_id):
+        event = {'data': base64.b64encode(json.dumps(message).encode('utf-8'))}
+        return trellis.QueryRequestReader(SimpleNamespace(event_id=event_id), event)
+
+    def test_event_id_key(self):
+        assert idempotency.message_key(self._reader(self.message, 123)) == "event:123"
+
+    def test_content_key(self):
+        key = idempotency.message_key(self._reader(self.message, None))
+        assert key.startswith("content:1:2:")
+        assert idempotency.message_key(self._reader(self.message, None)) == key
+
+        changed = dict(self.message, body=dict(self.message["body"], queryName="r"))
+        assert idempotency.message_key(self._reader(changed, None)) != key
+
+    def test_is_duplicate(self):
+        cache = trellis.IdempotencyCache()
+        reader = self._reader(self.message, 123)
+        assert not reader.is_duplicate(cache)
+        # Not recorded until handling has succeeded
+        assert not self._reader(self.message, 123).is_duplicate(cache)
+        reader.mark_done(cache)
+        assert self._reader(self.message, 123).is_duplicate(cache)
+        assert not self._reader(self.message, 124).is_duplicate(cache)
+        assert cache.hits == 1
+
+    def test_handle_once(self):
+        cache = trellis.IdempotencyCache()
+        with pytest.raises(RuntimeError):
+            with self._reader(self.message, 123).handle_once(cache) as duplicate:
+                assert not duplicate
+                raise RuntimeError("Query failed")
+
+        # The redelivery is handled again
+        with self._reader(self.message, 123).handle_once(cache) as duplicate:
+            assert not duplicate
+        with self._reader(self.message, 123).handle_once(cache) as duplicate:
+            assert duplicate
+
+    def test_batch_entity_keys(self):
+        message = {
+            "header": {"messageKind": "queryResponseBatch", "sender": "db-query", "seedId": 1, "previousEventId": 2},
+            "body": {"queryName": "q", "jobRequest": None, "resultSummary": {}, "entities": [
+                {"header": {"batchIndex": i}, "nodes": [], "relationship": {}} for i in range(3)]}}
+        event = {'data': base64.b64encode(json.dumps(message).encode('utf-8'))}
+        for event_id in (123, None):
+            batch = trellis.read_message(event, SimpleNamespace(event_id=event_id))
+            cache = trellis.IdempotencyCache()
+            assert [cache.seen(idempotency.message_key(reader)) for reader in batch] == [False, False, False]
+            assert [cache.seen(idempotency.message_key(reader)) for reader in batch] == [True, True, True]
+        assert idempotency.message_key(next(iter(batch))).endswith(":0")
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+import json
+import base64
+import pytest
+
+from types import SimpleNamespace
+
+import trellisdata as trellis
+
+from trellisdata import latency
+from trellisdata.latency import LatencyAnalyzer
+
+
+def record(event_id, previous_event_id, sender, sent, received, seed_id=1):
+    return {
+        "eventId": event_id,
+        "seedId": seed_id,
+        "previousEventId": previous_event_id,
+        "sender": sender,
+        "messageKind": "queryResponse",
+        "sentAtNs": sent,
+        "sentMonotonicNs": sent,
+        "receivedAtNs": received,
+        "receivedMonotonicNs": received,
+    }
+
+
+class TestSendStamps:
+
+    def test_writer_stamps_header(self):
+        message = trellis.QueryRequestWriter(
+            sender="test",
+            seed_id=1,
+            previous_event_id=1,
+            query_name="q",
+            query_parameters={}).format_json_message()
+        assert isinstance(message["header"][latency.SENT_AT_FIELD], int)
+        assert isinstance(message["header"][latency.SENT_MONOTONIC_FIELD], int)
+
+    def test_stamp_message(self):
+        message = {"header": {"messageKind": "jobCreated"}, "body": {}}
+        stamped = latency.stamp_message(message)
+        assert set(stamped["header"]) == {"messageKind", latency.SENT_AT_FIELD, latency.SENT_MONOTONIC_FIELD}
+        assert message["header"] == {"messageKind": "jobCreated"}
+        assert latency.stamp_message({"header": None}) == {"header": None}
+
+    def test_stamp_encoded_header(self):
+        header = json.loads(latency.stamp_encoded_header(b'{"messageKind":"jobCreated"}'))
+        assert header["messageKind"] == "jobCreated"
+        assert isinstance(header[latency.SENT_AT_FIELD], int)
+        assert isinstance(header[latency.SENT_MONOTONIC_FIELD], int)
+
+    def test_reader_records_receipt(self):
+        message = trellis.QueryRequestWriter(
+            sender="test",
+            seed_id=1,
+            previous_event_id=2,
+            query_name="q",
+            query_parameters={}).format_json_message()
+        event = {'data': base64.b64encode(json.dumps(message).encode('utf-8'))}
+        reader = trellis.QueryRequestReader(SimpleNamespace(event_id="3"), event)
+
+        record = reader.latency_record()
+        assert record["eventId"] == "3"
+        assert record["previousEventId"] == 2
+        assert record["sentAtNs"] == message["header"]["sentAtNs"]
+        assert record["receivedMonotonicNs"] >= record["sentMonotonicNs"]
+
+    def test_unstamped_header(self):
+        message = {
+            "header": {"messageKind": "jobCreated", "sender": "test", "seedId": 1, "previousEventId": 2},
+            "body": {"jobDict": {}}}
+        event = {'data': base64.b64encode(json.dumps(message).encode('utf-8'))}
+        record = trellis.read_message(event, SimpleNamespace(event_id="3")).latency_record()
+        assert record["sentAtNs"] is None
+
+        analyzer = LatencyAnalyzer()
+        analyzer.add(record)
+        assert list(analyzer.hops()) == []
+
+    def test_invalid_stamp(self):
+        message = {
+            "header": {"messageKind": "jobCreated", "sender": "test", "seedId": 1, "previousEventId": 2, "sentAtNs": "now"},
+            "body": {"jobDict": {}}}
+        event = {'data': base64.b64encode(json.dumps(message).encode('utf-8'))}
+        with pytest.raises(trellis.MessageValidationError):
+            trellis.read_message(event, SimpleNamespace(event_id="3"))
+
+
+class TestLatencyAnalyzer:
+
+    @pytest.fixture
+    def analyzer(self):
+        # create-blob-node sends event 10, which db-query answers with
+        # two messages
+        analyzer = LatencyAnalyzer()
+        analyzer.add(record("10", 1, "create-blob-node", sent=0, received=2_000_000))
+        analyzer.add(record("11", 10, "db-query", sent=5_000_000, received=6_000_000))
+        analyzer.add(record("12", 10, "db-query", sent=5_000_000, received=9_000_000))
+        return analyzer
+
+    def test_hops(self, analyzer):
+        hops = {hop.event_id: hop for hop in analyzer.hops()}
+        assert hops["10"].queueing_ns == 2_000_000
+        assert hops["10"].processing_ns is None
+        assert hops["11"].queueing_ns == 1_000_000
+        # Event IDs are matched as strings
+        assert hops["11"].processing_ns == 3_000_000
+        assert hops["12"].processing_ns == 3_000_000
+
+    def test_chains(self, analyzer):
+        analyzer.add(record("20", 2, "create-blob-node", sent=0, received=1, seed_id=2))
+        chains = analyzer.chains()
+        assert [r["eventId"] for r in chains[1]] == ["10", "11", "12"]
+        assert [r["eventId"] for r in chains[2]] == ["20"]
+
+    def test_end_to_end(self, analyzer):
+        assert analyzer.end_to_end() == {1: 9_000_000}
+
+    def test_summary(self, analyzer):
+        summary = analyzer.summary(percentiles=(0.5,))
+        assert summary[("db-query", "queryResponse")] == {
+            "count": 2,
+            "queueing": {0.5: 4.0},
+            "processing": {0.5: 3.0},
+        }
+        assert summary["endToEnd"] == {"count": 1, "total": {0.5: 9.0}}
+        assert "db-query queryResponse" in analyzer.format_summary()
+
+    def test_batch_entities(self, analyzer):
+        # db-query answers event 12 with a batch of two entities, each
+        # of which check-triggers answers
+        for batch_index in range(2):
+            analyzer.add(dict(record("13", 12, "db-query", sent=10_000_000, received=11_000_000), batchIndex=batch_index))
+        analyzer.add(record("14", 13, "check-triggers", sent=12_000_000, received=13_000_000))
+        assert len(analyzer.records) == 6
+
+        hops = [hop for hop in analyzer.hops() if hop.event_id == "13"]
+        assert len(hops) == 2
+        assert all(hop.processing_ns == 1_000_000 for hop in hops)
+        hop = next(hop for hop in analyzer.hops() if hop.event_id == "14")
+        assert hop.processing_ns == 1_000_000
+
+    def test_batch_reader_records(self):
+        message = {
+            "header": {"messageKind": "queryResponseBatch", "sender": "db-query", "seedId": 1, "previousEventId": 2},
+            "body": {"queryName": "q", "jobRequest": None, "resultSummary": {}, "entities": [
+                {"header": {"batchIndex": i}, "nodes": [], "relationship": {}} for i in range(3)]}}
+        event = {'data': base64.b64encode(json.dumps(message).encode('utf-8'))}
+        analyzer = LatencyAnalyzer()
+        for reader in trellis.read_message(event, SimpleNamespace(event_id="3")):
+            analyzer.add_reader(reader)
+        assert [record["batchIndex"] for record in analyzer.records.values()] == [0, 1, 2]
+
+    def test_clock(self):
+        with pytest.raises(ValueError):
+            LatencyAnalyzer(clock="sundial")
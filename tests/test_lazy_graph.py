@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import json
+import pytest
+
+from neo4j.graph import (
+    Node,
+    Relationship,
+)
+
+import trellisdata as trellis
+
+
+class TestLazyGraph:
+
+    @pytest.fixture
+    def payload(self):
+        graph_dict = {
+            "nodes": [
+                {"id_": 1, "element_id": "s1", "labels": ["Sample"], "properties": {"sample": "SHIP123"}},
+                {"id_": 2, "element_id": "f1", "labels": ["Blob", "Fastq"], "properties": {"readGroup": 1}},
+                {"id_": 3, "element_id": "f2", "labels": ["Blob", "Fastq"], "properties": {"readGroup": 2}},
+            ],
+            "relationships": [
+                {"id_": 10, "n0_id": 1, "n1_id": 2, "type_": "HAS", "properties": {}, "element_id": "r1", "n0_element_id": "s1", "n1_element_id": "f1"},
+                {"id_": 11, "n0_id": 2, "n1_id": 3, "type_": "MATE", "properties": {}, "element_id": "r2", "n0_element_id": "f1", "n1_element_id": "f2"},
+            ],
+        }
+        return json.dumps(graph_dict).encode('utf-8')
+
+    def test_payload_not_parsed_until_read(self, payload):
+        graph = trellis.LazyGraph(payload)
+        assert graph._graph_dict is None
+        assert len(graph) == 5
+        assert graph._graph_dict is not None
+
+    def test_dict_only_label_filter(self, payload):
+        graph = trellis.LazyGraph(payload, dict_only=True)
+        fastqs = list(graph.nodes(label="Fastq"))
+        assert [node['element_id'] for node in fastqs] == ["f1", "f2"]
+        assert all(isinstance(node, dict) for node in fastqs)
+        assert graph._hydration_scope is None
+        assert graph.labels() == {"Sample", "Blob", "Fastq"}
+
+    def test_hydrate_on_access(self, payload):
+        graph = trellis.LazyGraph(payload)
+        samples = list(graph.nodes(label="Sample"))
+        assert len(samples) == 1
+        assert isinstance(samples[0], Node)
+        assert samples[0]['sample'] == "SHIP123"
+
+        # Only the requested node has been hydrated
+        assert len(graph._hydration_scope.get_graph().nodes) == 1
+
+    def test_get_by_element_id(self, payload):
+        graph = trellis.LazyGraph(payload)
+        rel = graph.get("r1")
+        assert isinstance(rel, Relationship)
+        assert rel.type == "HAS"
+        assert rel.start_node['sample'] == "SHIP123"
+        assert rel.end_node['readGroup'] == 1
+        assert graph.get("f1") is rel.end_node
+        assert graph.get("missing") is None
+        assert "f2" in graph
+
+    def test_relationship_type_filter(self, payload):
+        graph = trellis.LazyGraph(payload, dict_only=True)
+        assert [rel['element_id'] for rel in graph.relationships(type="MATE")] == ["r2"]
+
+    def test_to_graph(self, payload):
+        graph = trellis.LazyGraph(payload).to_graph()
+        assert len(graph.nodes) == 3
+        assert len(graph.relationships) == 2
@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+
+import json
+import time
+import mock
+import neo4j
+import base64
+import pytest
+
+from neo4j._codec.hydration.v2 import HydrationHandler
+
+from unittest import TestCase
+from types import SimpleNamespace
+
+import trellisdata as trellis
+
+mock_context = mock.Mock()
+mock_context.event_id = '617187464135194'
+mock_context.timestamp = '2019-07-15T22:09:03.761Z'
+
+
+
+class TestMessageReaderWireFormats(TestCase):
+
+	data = {
+		'header': {
+			'messageKind': 'queryRequest',
+			'sender': 'check-triggers',
+			'seedId': 123,
+			'previousEventId': 345
+		},
+		'body': {
+			'queryName': 'dummyTrigger',
+			'queryParameters': {'sample': 'SHIP123'},
+			'custom': False
+		}
+	}
+
+	@classmethod
+	def test_read_packstream_query_request(cls):
+		payload = trellis.codec.encode_message(cls.data, wire_format='packstream')
+		event = {'data': base64.b64encode(payload)}
+
+		request = trellis.QueryRequestReader(mock_context, event)
+		assert request.message_kind == "queryRequest"
+		assert request.seed_id == 123
+		assert request.previous_event_id == 345
+		assert request.query_parameters == {'sample': 'SHIP123'}
+
+	@classmethod
+	def test_publish_packstream(cls):
+		parameters = {
+			'sample': 'SHIP123',
+			'timeCreated': neo4j.time.DateTime(2022, 3, 4, 5, 6, 7),
+			'runTime': neo4j.time.Duration(seconds=90),
+		}
+		message = trellis.QueryRequestWriter(
+			sender = "check-triggers",
+			seed_id = 123,
+			previous_event_id = 345,
+			query_name = "dummyTrigger",
+			query_parameters = parameters).format_json_message()
+		client = trellis.InMemoryPublisher()
+		with trellis.BatchPublisher(client, "project") as publisher:
+			publisher.publish("topic", message, wire_format='packstream')
+		event = client.events("projects/project/topics/topic")[0]
+		assert base64.b64decode(event['data'])[0] == trellis.codec.PACKSTREAM_V1
+
+		request = trellis.read_message(event, mock_context)
+		assert isinstance(request, trellis.QueryRequestReader)
+		assert request.query_parameters == parameters
+		assert request.latency_record()['sentAtNs'] >= message['header']['sentAtNs']
+
+	@classmethod
+	def test_read_compact_json_query_request(cls):
+		payload = trellis.codec.encode_message(cls.data)
+		event = {'data': base64.b64encode(payload)}
+
+		request = trellis.QueryRequestReader(mock_context, event)
+		assert request.query_name == "dummyTrigger"
+
+
+class TestTypedValueRoundTrip(TestCase):
+	"""Values copied from node properties into other message fields
+	are read back as the same types, with either JSON backend.
+	"""
+
+	time_created = neo4j.time.DateTime(2022, 3, 4, 5, 6, 7)
+
+	@staticmethod
+	def _publish(message):
+		# Encoded as by utils.publish_to_pubsub_topic()
+		payload = trellis.codec.dumps(message, default=trellis.codec.encode_default)
+		return {'data': base64.b64encode(payload)}
+
+	@classmethod
+	def test_query_parameters(cls):
+		parameters = {
+			'sample': 'SHIP123',
+			'timeCreated': cls.time_created,
+			'runTime': neo4j.time.Duration(seconds=90),
+			'dates': [neo4j.time.Date(2022, 3, 4)],
+		}
+		writer = trellis.QueryRequestWriter(
+			sender = "check-triggers",
+			seed_id = 123,
+			previous_event_id = 456,
+			query_name = "relateFastqToSample",
+			query_parameters = parameters)
+		previous = trellis.codec.get_backend().name
+		try:
+			for backend in trellis.codec.available_backends():
+				trellis.codec.set_backend(backend)
+				event = cls._publish(writer.format_json_message())
+				request = trellis.QueryRequestReader(mock_context, event)
+				assert request.query_parameters == parameters
+		finally:
+			trellis.codec.set_backend(previous)
+		assert isinstance(writer.query_parameters['runTime'], neo4j.time.Duration)
+
+	@classmethod
+	def test_job_dict(cls):
+		message = {
+			'header': {
+				'messageKind': 'jobCreated',
+				'sender': 'job-launcher',
+				'seedId': 123,
+				'previousEventId': 456,
+			},
+			'body': {
+				'jobDict': {'name': 'fastq-to-ubam', 'inputs': {'timeCreated': cls.time_created}},
+			},
+		}
+		job = trellis.JobCreatedReader(mock_context, cls._publish(message))
+		assert job.job_dict == {'name': 'fastq-to-ubam', 'inputs': {'timeCreated': cls.time_created}}
+
+	@classmethod
+	def test_node_properties_to_query_parameters(cls):
+		hydration_scope = HydrationHandler().new_hydration_scope()
+		hydration_scope._graph_hydrator.hydrate_node(1, ["Fastq"], {"timeCreated": cls.time_created}, "f1")
+		writer = trellis.QueryResponseWriter(
+			sender = "db-query",
+			seed_id = 123,
+			previous_event_id = 456,
+			query_name = "mergeFastq",
+			result_summary = TestQueryResponseWriterPayloads._make_result_summary(),
+			graph = hydration_scope.get_graph(),
+			job_request = None)
+		payload = next(writer.generate_separate_entity_payloads())
+		response = trellis.QueryResponseReader(mock_context, {'data': base64.b64encode(payload)})
+
+		# A trigger copies the property into the next request
+		request_writer = trellis.QueryRequestWriter(
+			sender = "check-triggers",
+			seed_id = 123,
+			previous_event_id = 789,
+			query_name = "relateFastqToSample",
+			query_parameters = {'timeCreated': response.nodes[0]['properties']['timeCreated']})
+		request = trellis.QueryRequestReader(mock_context, cls._publish(request_writer.format_json_message()))
+		assert request.query_parameters == {'timeCreated': cls.time_created}
+
+
+class TestQueryResponseWriterPayloads(TestCase):
+
+	@staticmethod
+	def _make_result_summary():
+		return SimpleNamespace(
+			metadata = {},
+			server = None,
+			query = "MATCH (s:Sample)-[r:HAS]->(f:Fastq) RETURN s, r, f",
+			parameters = {"sample": "SHIP123"},
+			counters = SimpleNamespace(relationships_created = 1))
+
+	@staticmethod
+	def _without_send_times(message):
+		# Every header is stamped when it is written
+		header = {key: value for key, value in message['header'].items() if not key.startswith('sent')}
+		return dict(message, header=header)
+
+	@staticmethod
+	def _make_writer(graph, result_summary):
+		return trellis.QueryResponseWriter(
+			sender = "db-query",
+			seed_id = 123,
+			previous_event_id = 456,
+			query_name = "relateFastqToSample",
+			result_summary = result_summary,
+			graph = graph,
+			job_request = "fastq-to-ubam")
+
+	@classmethod
+	def test_node_payloads_match_messages(cls):
+		hydration_scope = HydrationHandler().new_hydration_scope()
+		for i in range(3):
+			hydration_scope._graph_hydrator.hydrate_node(i, ["Fastq"], {"readGroup": i}, f"f{i}")
+		writer = cls._make_writer(hydration_scope.get_graph(), cls._make_result_summary())
+
+		payloads = list(writer.generate_separate_entity_payloads())
+		messages = list(writer.generate_separate_entity_jsons())
+		assert len(payloads) == 3
+		assert all(isinstance(payload, bytes) for payload in payloads)
+		assert [cls._without_send_times(json.loads(payload)) for payload in payloads] == [
+			cls._without_send_times(message) for message in messages]
+
+	@classmethod
+	def test_relationship_payloads_match_messages(cls):
+		hydration_scope = HydrationHandler().new_hydration_scope()
+		graph_hydrator = hydration_scope._graph_hydrator
+		graph_hydrator.hydrate_node(1, ["Sample"], {"sample": "SHIP123"}, "s")
+		for i in range(2, 5):
+			graph_hydrator.hydrate_node(i, ["Fastq"], {"readGroup": i}, f"f{i}")
+			graph_hydrator.hydrate_relationship(10 + i, 1, i, "HAS", {}, f"r{i}", "s", f"f{i}")
+		writer = cls._make_writer(hydration_scope.get_graph(), cls._make_result_summary())
+
+		payloads = list(writer.generate_separate_entity_payloads())
+		messages = list(writer.generate_separate_entity_jsons())
+		assert len(payloads) == 3
+		assert [cls._without_send_times(json.loads(payload)) for payload in payloads] == [
+			cls._without_send_times(message) for message in messages]
+
+		# Payloads are readable by the response reader
+		response = trellis.QueryResponseReader(mock_context, {'data': base64.b64encode(payloads[0])})
+		assert response.relationship['type'] == "HAS"
+		assert response.job_request == "fastq-to-ubam"
+
+	@classmethod
+	def test_temporal_properties_round_trip(cls):
+		time_created = neo4j.time.DateTime(2022, 3, 24, 23, 44, 43, 241000000)
+		hydration_scope = HydrationHandler().new_hydration_scope()
+		hydration_scope._graph_hydrator.hydrate_node(1, ["Fastq"], {"timeCreated": time_created}, "f1")
+		writer = cls._make_writer(hydration_scope.get_graph(), cls._make_result_summary())
+
+		payload = next(writer.generate_separate_entity_payloads())
+		assert json.loads(payload)['body']['nodes'][0]['properties'] == {"timeCreated": {"$dt": "2022-03-24T23:44:43.241000000"}}
+
+		response = trellis.QueryResponseReader(mock_context, {'data': base64.b64encode(payload)})
+		assert response.nodes[0]['properties']['timeCreated'] == time_created
+
+	@classmethod
+	def _make_relationship_graph(cls, n_relationships):
+		hydration_scope = HydrationHandler().new_hydration_scope()
+		graph_hydrator = hydration_scope._graph_hydrator
+		graph_hydrator.hydrate_node(1, ["Sample"], {"sample": "SHIP123"}, "s")
+		for i in range(2, n_relationships + 2):
+			graph_hydrator.hydrate_node(i, ["Fastq"], {"readGroup": i}, f"f{i}")
+			graph_hydrator.hydrate_relationship(100 + i, 1, i, "HAS", {}, f"r{i}", "s", f"f{i}")
+		return hydration_scope.get_graph()
+
+	@classmethod
+	def test_batch_entities_match_separate_messages(cls):
+		writer = cls._make_writer(cls._make_relationship_graph(5), cls._make_result_summary())
+
+		payloads = list(writer.generate_batch_payloads())
+		assert len(payloads) == 1
+		batch = trellis.read_message({'data': base64.b64encode(payloads[0])}, mock_context)
+		assert isinstance(batch, trellis.QueryResponseBatchReader)
+		assert len(batch) == 5
+
+		messages = list(writer.generate_separate_entity_jsons())
+		for batch_index, (response, message) in enumerate(zip(batch, messages)):
+			assert isinstance(response, trellis.QueryResponseReader)
+			assert response.header == dict(message['header'], batchIndex=batch_index, **{
+				field: batch.header[field] for field in ('sentAtNs', 'sentMonotonicNs')})
+			assert response.body == message['body']
+			assert response.relationship['type'] == "HAS"
+			assert response.seed_id == 123
+
+	@classmethod
+	def test_payloads_stamped_when_yielded(cls):
+		writer = cls._make_writer(cls._make_relationship_graph(2), cls._make_result_summary())
+		for generate in (writer.generate_separate_entity_payloads, lambda: writer.generate_batch_payloads(max_bytes=0)):
+			payloads = generate()
+			first = json.loads(next(payloads))['header']
+			between = time.monotonic_ns()
+			second = json.loads(next(payloads))['header']
+			assert first['sentMonotonicNs'] <= between <= second['sentMonotonicNs']
+
+	@classmethod
+	def test_batch_byte_budget(cls):
+		writer = cls._make_writer(cls._make_relationship_graph(20), cls._make_result_summary())
+		single = next(writer.generate_batch_payloads(max_bytes=0))
+		max_bytes = 3 * len(single)
+
+		payloads = list(writer.generate_batch_payloads(max_bytes=max_bytes))
+		assert len(payloads) > 1
+		assert all(len(payload) <= max_bytes for payload in payloads)
+
+		batch_indexes = [
+			response.header['batchIndex']
+			for payload in payloads
+			for response in trellis.QueryResponseBatchReader(mock_context, {'data': base64.b64encode(payload)})]
+		assert batch_indexes == list(range(20))
+
+	@classmethod
+	def test_batch_oversized_entity_sent_alone(cls):
+		writer = cls._make_writer(cls._make_relationship_graph(3), cls._make_result_summary())
+		payloads = list(writer.generate_batch_payloads(max_bytes=1))
+		assert [len(json.loads(payload)['body']['entities']) for payload in payloads] == [1, 1, 1]
+
+	@classmethod
+	def test_batch_invalid_entity(cls):
+		message = {
+			"header": {"messageKind": "queryResponseBatch", "sender": "db-query", "seedId": 1, "previousEventId": 1},
+			"body": {"queryName": "q", "resultSummary": {}, "entities": [{"header": {}, "nodes": {}}]}}
+		batch = trellis.read_message({'data': base64.b64encode(json.dumps(message).encode('utf-8'))}, mock_context)
+		with pytest.raises(trellis.MessageValidationError):
+			list(batch)
+
+
+class TestLazyMessageReader(TestCase):
+
+	message = {
+		"header": {"messageKind": "queryResponse", "sender": "db-query", "seedId": 123, "previousEventId": 456},
+		"body": {
+			"queryName": "relateFastqToSample",
+			"jobRequest": None,
+			"nodes": [{"id": 1, "labels": ["Fastq"], "properties": {"timeCreated": {"$d": "2022-03-24"}}}],
+			"relationship": {},
+			"resultSummary": {}}}
+
+	@classmethod
+	def _event(cls, data_bytes):
+		return {'data': base64.b64encode(data_bytes)}
+
+	@classmethod
+	def test_body_parsed_on_access(cls):
+		response = trellis.QueryResponseReader(mock_context, cls._event(json.dumps(cls.message).encode('utf-8')))
+		assert response.message_kind == "queryResponse"
+		assert response.seed_id == 123
+		assert response._body is None
+
+		assert response.query_name == "relateFastqToSample"
+		assert response.body == cls.message['body']
+		assert response._payload is None
+		assert response.nodes[0]['properties']['timeCreated'] == neo4j.time.Date(2022, 3, 24)
+		assert response.nodes is response.nodes
+
+	@classmethod
+	def test_slotted(cls):
+		response = trellis.QueryResponseReader(mock_context, cls._event(json.dumps(cls.message).encode('utf-8')))
+		assert not hasattr(response, '__dict__')
+
+	@classmethod
+	def test_body_before_header(cls):
+		message = {"body": cls.message['body'], "header": cls.message['header']}
+		response = trellis.QueryResponseReader(mock_context, cls._event(json.dumps(message).encode('utf-8')))
+		assert response._body == cls.message['body']
+		assert response.sender == "db-query"
+
+	@classmethod
+	def test_trailing_fields(cls):
+		message = dict(cls.message, trailer={"x": 1})
+		response = trellis.QueryResponseReader(mock_context, cls._event(json.dumps(message).encode('utf-8')))
+		assert response.body == cls.message['body']
+
+	@classmethod
+	def test_custom_fields(cls):
+		message = {
+			"header": {"messageKind": "queryRequest", "sender": "test", "seedId": 1, "previousEventId": 2},
+			"body": {"queryName": "q", "queryParameters": {}, "custom": False}}
+		request = trellis.QueryRequestReader(mock_context, cls._event(json.dumps(message).encode('utf-8')))
+		assert request.custom is False
+		assert not hasattr(request, 'cypher')
+
+
+class TestMessageValidation(TestCase):
+
+	header = {"messageKind": "queryResponse", "sender": "db-query", "seedId": 123, "previousEventId": 456}
+
+	@classmethod
+	def _event(cls, message):
+		return {'data': base64.b64encode(json.dumps(message).encode('utf-8'))}
+
+	@classmethod
+	def test_wrong_kind_raises(cls):
+		event = cls._event({"header": cls.header, "body": {}})
+		with pytest.raises(trellis.MessageValidationError):
+			trellis.QueryRequestReader(mock_context, event)
+
+	@classmethod
+	def test_missing_header_field_raises(cls):
+		header = dict(cls.header)
+		del header['sender']
+		with pytest.raises(trellis.MessageValidationError):
+			trellis.QueryResponseReader(mock_context, cls._event({"header": header, "body": {}}))
+
+	@classmethod
+	def test_invalid_seed_id_raises(cls):
+		header = dict(cls.header, seedId=None)
+		with pytest.raises(trellis.MessageValidationError):
+			trellis.QueryResponseReader(mock_context, cls._event({"header": header, "body": {}}))
+
+	@classmethod
+	def test_invalid_body_raises_on_access(cls):
+		response = trellis.QueryResponseReader(mock_context, cls._event({"header": cls.header, "body": {"queryName": "q"}}))
+		assert response.sender == "db-query"
+		with pytest.raises(trellis.MessageValidationError):
+			response.nodes
+		# The body is not cached when it fails validation
+		assert response._body is None
+
+	@classmethod
+	def test_invalid_parsed_body_raises(cls):
+		# Bodies that come before the header are parsed, and validated, immediately
+		event = cls._event({"body": {"queryName": "q"}, "header": cls.header})
+		with pytest.raises(trellis.MessageValidationError):
+			trellis.QueryResponseReader(mock_context, event)
+
+	@classmethod
+	def test_job_created_writer_round_trip(cls):
+		writer = trellis.messages.JobCreatedWriter(
+			sender = "job-launcher",
+			seed_id = 123,
+			previous_event_id = 456,
+			job_dict = {"name": "fastq-to-ubam"})
+		event = cls._event(writer.format_json_message())
+
+		job = trellis.JobCreatedReader(mock_context, event)
+		assert job.message_kind == "jobCreated"
+		assert job.job_dict == {"name": "fastq-to-ubam"}
+
+		dispatcher = trellis.MessageDispatcher()
+		dispatcher.register('jobCreated', lambda reader: reader.job_dict['name'])
+		assert dispatcher(event, mock_context) == "fastq-to-ubam"
+
+
+class TestReadMessage(TestCase):
+
+	messages = {
+		"queryRequest": {
+			"header": {"messageKind": "queryRequest", "sender": "check-triggers", "seedId": 1, "previousEventId": 2},
+			"body": {"queryName": "relateFastqToSample", "queryParameters": {}, "custom": False}},
+		"queryResponse": {
+			"header": {"messageKind": "queryResponse", "sender": "db-query", "seedId": 1, "previousEventId": 2},
+			"body": {"queryName": "relateFastqToSample", "jobRequest": None, "nodes": [], "relationship": {}, "resultSummary": {}}},
+		"jobCreated": {
+			"header": {"messageKind": "jobCreated", "sender": "job-launcher", "seedId": 1, "previousEventId": 2},
+			"body": {"jobDict": {"name": "fastq-to-ubam"}}},
+	}
+
+	@classmethod
+	def _event(cls, message):
+		return {'data': base64.b64encode(json.dumps(message).encode('utf-8'))}
+
+	@classmethod
+	def test_reader_class_by_kind(cls):
+		expected = {
+			"queryRequest": trellis.QueryRequestReader,
+			"queryResponse": trellis.QueryResponseReader,
+			"jobCreated": trellis.JobCreatedReader}
+		for message_kind, message in cls.messages.items():
+			reader = trellis.read_message(cls._event(message), mock_context)
+			assert type(reader) is expected[message_kind]
+			assert reader.body == message['body']
+		assert trellis.read_message(cls._event(cls.messages['jobCreated']), mock_context).job_dict == {"name": "fastq-to-ubam"}
+
+	@classmethod
+	def test_unregistered_kind(cls):
+		message = {"header": dict(cls.messages['jobCreated']['header'], messageKind="jobLauncherResponse"), "body": {}}
+		reader = trellis.read_message(cls._event(message), mock_context)
+		assert type(reader) is trellis.messages.MessageReader
+		assert reader.message_kind == "jobLauncherResponse"
+
+	@classmethod
+	def test_invalid_header(cls):
+		with pytest.raises(trellis.MessageValidationError):
+			trellis.read_message(cls._event({"header": [], "body": {}}), mock_context)
+
+	@classmethod
+	def test_from_payload(cls):
+		payload = json.dumps(cls.messages['queryResponse']).encode('utf-8')
+		reader = trellis.QueryResponseReader.from_payload(mock_context, payload)
+		assert reader.query_name == "relateFastqToSample"
+		assert reader.nodes == []
+
+	@classmethod
+	def test_dispatcher(cls):
+		dispatcher = trellis.MessageDispatcher()
+
+		@dispatcher.register('queryResponse')
+		def handle_response(reader):
+			return ('response', reader.query_name)
+
+		dispatcher.register('jobCreated', lambda reader: ('job', reader.job_dict['name']))
+
+		assert dispatcher(cls._event(cls.messages['queryResponse']), mock_context) == ('response', "relateFastqToSample")
+		assert dispatcher.dispatch(cls._event(cls.messages['jobCreated']), mock_context) == ('job', "fastq-to-ubam")
+		with pytest.raises(ValueError):
+			dispatcher(cls._event(cls.messages['queryRequest']), mock_context)
+
+	@classmethod
+	def test_dispatcher_default(cls):
+		dispatcher = trellis.MessageDispatcher(default=lambda reader: reader.message_kind)
+		assert dispatcher(cls._event(cls.messages['queryRequest']), mock_context) == "queryRequest"
+
+	@classmethod
+	def test_missing_body(cls):
+		with pytest.raises(trellis.MessageValidationError):
+			trellis.read_message(cls._event({"header": cls.messages['jobCreated']['header']}), mock_context)
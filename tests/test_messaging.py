@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import io
 import re
 import pdb
 import json
@@ -7,6 +8,7 @@ import mock
 import neo4j
 import base64
 import pytest
+import pytz
 
 from neo4j._codec.hydration.v2 import HydrationHandler
 from neo4j._codec.packstream import Structure
@@ -34,6 +36,8 @@ import trellisdata as trellis
 
 from trellisdata.messaging import (
     translate_record_to_json,
+    translate_records_to_json,
+    iter_records_to_json,
     translate_json_to_graph
     )
 
@@ -350,6 +354,44 @@ class TestTranslateGraphToJson:
         # GraphHydrator object embedded in the HydrationScope object.
         # HydrationScope
 
+    def test_stream_graph_json_matches_translation(self, graph_entities):
+        hydration_scope = HydrationHandler().new_hydration_scope()
+        for value in graph_entities.values():
+            hydration_scope.hydration_hooks[Structure](value)
+        graph = hydration_scope.get_graph()
+
+        chunks = list(trellis.messaging.iter_graph_json(graph))
+        assert len(chunks) > 1
+        graph_json = b''.join(chunks).decode('utf-8')
+        assert graph_json == trellis.messaging.translate_graph_to_json(graph)
+
+        graph_dict = json.loads(graph_json)
+        assert len(graph_dict['nodes']) == 2
+        assert len(graph_dict['relationships']) == 1
+
+    def test_write_graph_json_to_sinks(self, graph_entities):
+        hydration_scope = HydrationHandler().new_hydration_scope()
+        for value in graph_entities.values():
+            hydration_scope.hydration_hooks[Structure](value)
+        graph = hydration_scope.get_graph()
+        expected = trellis.messaging.translate_graph_to_json(graph)
+
+        text_sink = io.StringIO()
+        trellis.messaging.write_graph_json(graph, text_sink)
+        assert text_sink.getvalue() == expected
+
+        binary_sink = io.BytesIO()
+        trellis.messaging.write_graph_json(graph, binary_sink)
+        assert binary_sink.getvalue() == expected.encode('utf-8')
+
+        buffer = bytearray()
+        trellis.messaging.write_graph_json(graph, buffer)
+        assert bytes(buffer) == expected.encode('utf-8')
+
+    def test_stream_empty_graph(self):
+        graph_json = b''.join(trellis.messaging.iter_graph_json(Graph()))
+        assert json.loads(graph_json) == {"nodes": [], "relationships": []}
+
 class TestTranslateJsonToGraph:
 
     @pytest.fixture
@@ -373,6 +415,211 @@ class TestTranslateJsonToGraph:
         assert rel.start_node.element_id == 'abc'
         assert rel.end_node.element_id == 'abd'
 
+class TestTranslatePackstream:
+
+    @pytest.fixture
+    def graph(self):
+        hydration_scope = HydrationHandler().new_hydration_scope()
+        alice = Structure(b'N', 123, ["Person"], {"name": "Alice", "born": neo4j.time.Date(1980, 5, 17)}, "abc")
+        bob = Structure(b'N', 124, ["Person", "Admin"], {"name": "Bob", "scores": [1, 2, 3]}, "abd")
+        knows = Structure(b'R', 456, 123, 124, "KNOWS", {"since": 1999}, "ghi", "abc", "abd")
+        for value in (alice, bob, knows):
+            hydration_scope.hydration_hooks[Structure](value)
+        return hydration_scope.get_graph()
+
+    def test_round_trip(self, graph):
+        payload = trellis.translate_graph_to_packstream(graph)
+        assert isinstance(payload, bytes)
+        assert payload[0] == trellis.codec.PACKSTREAM_V1
+
+        new_graph = trellis.translate_packstream_to_graph(payload)
+        nodes = {node.element_id: node for node in new_graph.nodes}
+        assert set(nodes) == {"abc", "abd"}
+        assert nodes["abc"]["born"] == neo4j.time.Date(1980, 5, 17)
+        assert nodes["abd"].labels == {"Person", "Admin"}
+        assert nodes["abd"]["scores"] == [1, 2, 3]
+
+        relationships = list(new_graph.relationships)
+        assert len(relationships) == 1
+        rel = relationships[0]
+        assert rel.type == "KNOWS"
+        assert rel["since"] == 1999
+        assert rel.start_node.element_id == "abc"
+        assert rel.end_node.element_id == "abd"
+
+    def test_rejects_json_payload(self):
+        with pytest.raises(ValueError):
+            trellis.translate_packstream_to_graph(b'{"nodes":[],"relationships":[]}')
+
+class TestGraphJsonHydrator:
+
+    @pytest.fixture
+    def graph_json(self):
+        return '{"nodes": [{"id_": 123, "element_id": "abc", "labels": ["Person"], "properties": {"name": "Alice"}}, {"id_": 124, "element_id": "abd", "labels": ["Person"], "properties": {"name": "Bob"}}], "relationships": [{"id_": 456, "n0_id": 123, "n1_id": 124, "type_": "KNOWS", "properties": {"since": 1999}, "element_id": "ghi", "n0_element_id": "abc", "n1_element_id": "abd"}]}'
+
+    def test_reuse_hydrator(self, graph_json):
+        hydrator = trellis.GraphJsonHydrator()
+        first = hydrator.hydrate(graph_json)
+        second = hydrator.hydrate(graph_json.encode('utf-8'))
+
+        # Each call produces an independent graph
+        assert first is not second
+        assert len(first.nodes) == len(second.nodes) == 2
+        assert len(first.relationships) == len(second.relationships) == 1
+
+    def test_hydrate_parsed_dict(self, graph_json):
+        hydrator = trellis.GraphJsonHydrator()
+        graph = hydrator.hydrate_many(json.loads(graph_json))
+
+        rel = list(graph.relationships)[0]
+        assert rel.type == 'KNOWS'
+        assert rel.start_node['name'] == 'Alice'
+        assert rel.end_node['name'] == 'Bob'
+
+    def test_translate_accepts_dict(self, graph_json):
+        graph = trellis.messaging.translate_json_to_graph(json.loads(graph_json))
+        assert {node.element_id for node in graph.nodes} == {'abc', 'abd'}
+
+class TestNormalizedGraphJson:
+
+    @pytest.fixture
+    def graph(self):
+        hydration_scope = HydrationHandler().new_hydration_scope()
+        hydrator = hydration_scope._graph_hydrator
+        hydrator.hydrate_node(1, ["Sample"], {"sample": "SHIP123"}, "s")
+        for i in range(2, 12):
+            hydrator.hydrate_node(i, ["Blob", "Fastq"], {"sample": "SHIP123", "readGroup": i, "matePair": 1}, f"f{i}")
+            hydrator.hydrate_relationship(100 + i, 1, i, "GENERATED", {"ordinal": i}, f"r{i}", "s", f"f{i}")
+        return hydration_scope.get_graph()
+
+    def test_layout(self, graph):
+        graph_dict = json.loads(trellis.translate_graph_to_normalized_json(graph))
+        assert graph_dict['format'] == "normalized"
+        assert sorted(graph_dict['labels']) == ["Blob", "Fastq", "Sample"]
+        assert graph_dict['types'] == ["GENERATED"]
+        assert sorted(graph_dict['keys']) == ["matePair", "ordinal", "readGroup", "sample"]
+        assert len(graph_dict['nodes']) == 11
+        assert len(graph_dict['relationships']) == 10
+
+    def test_smaller_than_standard_layout(self, graph):
+        normalized = trellis.translate_graph_to_normalized_json(graph)
+        standard = trellis.translate_graph_to_json(graph)
+        assert len(normalized) < len(standard)
+
+    def test_round_trip(self, graph):
+        new_graph = trellis.translate_json_to_graph(trellis.translate_graph_to_normalized_json(graph))
+        nodes = {node.element_id: node for node in new_graph.nodes}
+        assert len(nodes) == 11
+        assert nodes["f5"].labels == {"Blob", "Fastq"}
+        assert dict(nodes["f5"]) == {"sample": "SHIP123", "readGroup": 5, "matePair": 1}
+
+        rels = {rel.element_id: rel for rel in new_graph.relationships}
+        assert len(rels) == 10
+        assert rels["r5"].type == "GENERATED"
+        assert rels["r5"]["ordinal"] == 5
+        assert rels["r5"].start_node is nodes["s"]
+        assert rels["r5"].end_node is nodes["f5"]
+
+    def test_expand_matches_standard_layout(self, graph):
+        normalized = json.loads(trellis.translate_graph_to_normalized_json(graph))
+        standard = json.loads(trellis.translate_graph_to_json(graph))
+        expanded = trellis.messaging.expand_normalized_graph(normalized)
+
+        by_id = lambda entities: {entity['element_id']: entity for entity in entities}
+        expanded_nodes = by_id(expanded['nodes'])
+        for element_id, node in by_id(standard['nodes']).items():
+            assert sorted(node.pop('labels')) == sorted(expanded_nodes[element_id].pop('labels'))
+            assert node == expanded_nodes[element_id]
+        assert by_id(expanded['relationships']) == by_id(standard['relationships'])
+
+    def test_lazy_graph(self, graph):
+        lazy_graph = trellis.LazyGraph(trellis.translate_graph_to_normalized_json(graph), dict_only=True)
+        assert len(list(lazy_graph.nodes(label="Fastq"))) == 10
+        assert lazy_graph.get("r3")['type_'] == "GENERATED"
+
+class TestTypedPropertyValues:
+
+    @pytest.fixture
+    def graph(self):
+        hydration_scope = HydrationHandler().new_hydration_scope()
+        hydrator = hydration_scope._graph_hydrator
+        hydrator.hydrate_node(1, ["Sample"], {"sample": "SHIP123"}, "s")
+        hydrator.hydrate_node(2, ["Blob", "Fastq"], {
+            "timeCreated": neo4j.time.DateTime(2022, 3, 24, 23, 44, 43, 241000000, tzinfo=pytz.utc),
+            "dateCreated": neo4j.time.Date(2022, 3, 24),
+            "crc32c": b"A\xe0P@"}, "f")
+        hydrator.hydrate_relationship(3, 1, 2, "HAS", {"runTime": neo4j.time.Duration(seconds=90)}, "r", "s", "f")
+        return hydration_scope.get_graph()
+
+    @pytest.mark.parametrize("translate", [
+        trellis.translate_graph_to_json,
+        trellis.translate_graph_to_normalized_json,
+    ])
+    def test_round_trip(self, graph, translate):
+        new_graph = trellis.translate_json_to_graph(translate(graph))
+        nodes = {node.element_id: node for node in new_graph.nodes}
+        assert dict(nodes["f"]) == dict(graph.nodes["f"])
+        rel = list(new_graph.relationships)[0]
+        assert rel["runTime"] == neo4j.time.Duration(seconds=90)
+
+    def test_lazy_graph(self, graph):
+        lazy_graph = trellis.LazyGraph(trellis.translate_graph_to_json(graph))
+        assert lazy_graph.get("f")["dateCreated"] == neo4j.time.Date(2022, 3, 24)
+        assert lazy_graph.get("r")["runTime"] == neo4j.time.Duration(seconds=90)
+
+class TestSplitJsonGraphEntities:
+
+    @pytest.fixture
+    def graph_json(self):
+        # Sample "s" is the start node of two relationships and "lone"
+        # is not connected to anything.
+        return json.dumps({
+            "nodes": [
+                {"id_": 1, "element_id": "s", "labels": ["Sample"], "properties": {}},
+                {"id_": 2, "element_id": "f1", "labels": ["Fastq"], "properties": {}},
+                {"id_": 3, "element_id": "f2", "labels": ["Fastq"], "properties": {}},
+                {"id_": 4, "element_id": "lone", "labels": ["Ubam"], "properties": {}},
+            ],
+            "relationships": [
+                {"id_": 10, "n0_id": 1, "n1_id": 2, "type_": "HAS", "properties": {}, "element_id": "r1", "n0_element_id": "s", "n1_element_id": "f1"},
+                {"id_": 11, "n0_id": 1, "n1_id": 3, "type_": "HAS", "properties": {}, "element_id": "r2", "n0_element_id": "s", "n1_element_id": "f2"},
+            ]})
+
+    def test_split_shared_endpoints(self, graph_json):
+        entities = list(trellis.split_json_graph_entities(graph_json))
+        assert len(entities) == 3
+
+        first, second, lone = entities
+        assert [rel['element_id'] for rel in first['relationships']] == ["r1"]
+        assert [node['element_id'] for node in first['nodes']] == ["s", "f1"]
+        assert [rel['element_id'] for rel in second['relationships']] == ["r2"]
+        assert [node['element_id'] for node in second['nodes']] == ["s", "f2"]
+        assert lone == {"nodes": [json.loads(graph_json)['nodes'][3]], "relationships": []}
+
+    def test_entities_hydrate(self, graph_json):
+        for entity in trellis.split_json_graph_entities(graph_json):
+            graph = trellis.translate_json_to_graph(entity)
+            assert len(graph.relationships) == len(entity['relationships'])
+
+    def test_split_self_loop(self):
+        graph_json = {
+            "nodes": [{"id_": 1, "element_id": "a", "labels": ["Sample"], "properties": {}}],
+            "relationships": [
+                {"id_": 10, "n0_id": 1, "n1_id": 1, "type_": "SELF", "properties": {}, "element_id": "r", "n0_element_id": "a", "n1_element_id": "a"},
+            ]}
+        entities = list(trellis.split_json_graph_entities(graph_json))
+        assert len(entities) == 1
+        assert [node['element_id'] for node in entities[0]['nodes']] == ["a"]
+        graph = trellis.translate_json_to_graph(entities[0])
+        assert len(graph.nodes) == 1
+        assert len(graph.relationships) == 1
+
+    def test_split_nodes_only(self):
+        graph_json = {"nodes": [{"id_": i, "element_id": str(i), "labels": [], "properties": {}} for i in range(3)],
+                      "relationships": []}
+        entities = list(trellis.split_json_graph_entities(graph_json))
+        assert [entity['nodes'][0]['element_id'] for entity in entities] == ["0", "1", "2"]
+
 class TestTranslateResultSummaryToJson:
 
     @pytest.fixture
@@ -447,4 +694,50 @@ class TestTranslateRecordsToJson:
         assert rel.get('since') == 1999
         assert rel.start_node.element_id == 'abc'
         assert rel.end_node.element_id == 'abd'
-        
\ No newline at end of file
+        
+
+class TestTranslateMultipleRecordsToJson:
+
+    @pytest.fixture
+    def records(self):
+        sample = Structure(b'N', 100, ["Sample"], {"sample": "SHIP123"}, "s")
+        rows = []
+        for i in range(5):
+            rows.append([
+                sample,
+                Structure(b'N', i, ["Fastq"], {"readGroup": i}, f"f{i}"),
+                Structure(b'R', 200 + i, 100, i, "HAS", {}, f"r{i}", "s", f"f{i}"),
+            ])
+        records = Records(fields=["sample", "fastq", "relationship"], records=rows)
+        connection = ConnectionStub(records=records)
+        result = Result(connection, 2, noop, noop)
+        result._run("CYPHER", {}, None, None, "r", None, None, None)
+        return result.fetch(10)
+
+    def test_deduplicate_nodes(self, records):
+        graph_json = translate_records_to_json(records)
+        graph_dict = json.loads(graph_json)
+
+        element_ids = [node['element_id'] for node in graph_dict['nodes']]
+        assert sorted(element_ids) == ["f0", "f1", "f2", "f3", "f4", "s"]
+        assert len(graph_dict['relationships']) == 5
+
+        graph = translate_json_to_graph(graph_json)
+        assert len(graph.nodes) == 6
+        assert len(graph.relationships) == 5
+
+    def test_flush_every(self, records):
+        graph_jsons = list(iter_records_to_json(records, flush_every=4))
+        assert len(graph_jsons) == 3
+
+        element_ids = []
+        for graph_json in graph_jsons:
+            graph_dict = json.loads(graph_json)
+            element_ids.extend(node['element_id'] for node in graph_dict['nodes'])
+            element_ids.extend(rel['element_id'] for rel in graph_dict['relationships'])
+        assert len(element_ids) == 11
+        assert len(set(element_ids)) == 11
+
+    def test_empty_result(self):
+        assert json.loads(translate_records_to_json([])) == {"nodes": [], "relationships": []}
+        assert list(iter_records_to_json([], flush_every=10)) == []
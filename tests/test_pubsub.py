@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+import json
+import time
+import zlib
+import pytest
+
+from concurrent.futures import Future
+
+import trellisdata as trellis
+
+from trellisdata import codec
+from trellisdata import latency
+
+
+def unstamped(message):
+    """Drop the send times BatchPublisher.publish() adds to a header."""
+    header = dict(message["header"])
+    assert header.pop(latency.SENT_AT_FIELD) > 0
+    assert header.pop(latency.SENT_MONOTONIC_FIELD) > 0
+    return dict(message, header=header)
+
+
+class TestInMemoryPublisher:
+
+    def test_publish_records_message(self):
+        publisher = trellis.InMemoryPublisher()
+        topic_path = publisher.topic_path("project", "topic")
+        assert publisher.publish(topic_path, b'{}').result() == "1"
+        assert publisher.messages == {"projects/project/topics/topic": [(b'{}', {})]}
+
+    def test_latency(self):
+        publisher = trellis.InMemoryPublisher(latency=0.05)
+        future = publisher.publish("topic", b'{}')
+        assert not future.done()
+        assert future.result(timeout=1) == "1"
+
+    def test_requires_bytes(self):
+        with pytest.raises(TypeError):
+            trellis.InMemoryPublisher().publish("topic", '{}')
+
+
+class TestBatchPublisher:
+
+    @pytest.fixture
+    def message(self):
+        return {"header": {"messageKind": "queryRequest", "sender": "test", "seedId": 1, "previousEventId": 2}, "body": {}}
+
+    def test_flush_on_count(self, message):
+        client = trellis.InMemoryPublisher()
+        publisher = trellis.BatchPublisher(client, "project", max_messages=3, max_latency=60)
+        futures = [publisher.publish("topic", message) for _ in range(2)]
+        assert client.messages == {}
+        assert not any(future.done() for future in futures)
+
+        futures.append(publisher.publish("topic", message))
+        assert [future.result(timeout=1) for future in futures] == ["1", "2", "3"]
+        data, attributes = client.messages["projects/project/topics/topic"][0]
+        assert unstamped(json.loads(data)) == message
+
+    def test_stamps_at_publish(self, message):
+        client = trellis.InMemoryPublisher()
+        with trellis.BatchPublisher(client, "project") as publisher:
+            before = time.time_ns()
+            publisher.publish("topic", message)
+        data, attributes = client.messages["projects/project/topics/topic"][0]
+        assert json.loads(data)["header"][latency.SENT_AT_FIELD] >= before
+        # The caller's message is not stamped
+        assert latency.SENT_AT_FIELD not in message["header"]
+
+    def test_flush_on_bytes(self):
+        client = trellis.InMemoryPublisher()
+        publisher = trellis.BatchPublisher(client, "project", max_bytes=10, max_latency=60)
+        publisher.publish_bytes("topic", b'{"a":1}')
+        assert client.messages == {}
+        publisher.publish_bytes("topic", b'{"b":2}')
+        assert len(client.messages["projects/project/topics/topic"]) == 2
+
+    def test_flush_on_latency(self, message):
+        client = trellis.InMemoryPublisher()
+        publisher = trellis.BatchPublisher(client, "project", max_latency=0.01)
+        future = publisher.publish("topic", message)
+        assert future.result(timeout=1) == "1"
+
+    def test_batches_per_topic(self, message):
+        client = trellis.InMemoryPublisher()
+        with trellis.BatchPublisher(client, "project", max_messages=2, max_latency=60) as publisher:
+            publisher.publish("a", message)
+            publisher.publish("b", message)
+            assert client.messages == {}
+        assert sorted(client.messages) == ["projects/project/topics/a", "projects/project/topics/b"]
+
+    def test_topic_path_cached(self):
+        client = trellis.InMemoryPublisher()
+        calls = []
+        topic_path = client.topic_path
+        client.topic_path = lambda *args: calls.append(args) or topic_path(*args)
+        publisher = trellis.BatchPublisher(client, "project")
+        for _ in range(5):
+            publisher.publish_bytes("topic", b'{}')
+        publisher.close()
+        assert calls == [("project", "topic")]
+
+    def test_compress_large_payloads(self):
+        client = trellis.InMemoryPublisher()
+        with trellis.BatchPublisher(client, "project", compress_threshold=16) as publisher:
+            publisher.publish_bytes("topic", b'{"sample":"' + b'SHIP123' * 10 + b'"}')
+        data, attributes = client.messages["projects/project/topics/topic"][0]
+        assert attributes == {codec.CONTENT_ENCODING_ATTRIBUTE: codec.ZLIB_ENCODING}
+        assert zlib.decompress(data).startswith(b'{"sample"')
+
+    def test_flow_control(self):
+        client = trellis.InMemoryPublisher(latency=0.05)
+        publisher = trellis.BatchPublisher(client, "project", max_messages=1, max_in_flight=2)
+        start = time.monotonic()
+        for _ in range(3):
+            publisher.publish_bytes("topic", b'{}')
+        # The third publish waits for the first acknowledgement
+        assert time.monotonic() - start >= 0.04
+        assert not publisher.close(timeout=1)
+
+    def test_publish_error(self):
+        class FailingPublisher(trellis.InMemoryPublisher):
+            def publish(self, topic, data, **attributes):
+                future = Future()
+                future.set_exception(RuntimeError("Topic not found"))
+                return future
+
+        publisher = trellis.BatchPublisher(FailingPublisher(), "project", max_messages=1, max_in_flight=1)
+        futures = [publisher.publish_bytes("topic", b'{}') for _ in range(2)]
+        for future in futures:
+            with pytest.raises(RuntimeError):
+                future.result(timeout=1)
+
+    def test_publish_after_close(self):
+        publisher = trellis.BatchPublisher(trellis.InMemoryPublisher(), "project")
+        publisher.close()
+        with pytest.raises(RuntimeError):
+            publisher.publish_bytes("topic", b'{}')
+
+    def test_events_readable(self, message):
+        client = trellis.InMemoryPublisher()
+        with trellis.BatchPublisher(client, "project") as publisher:
+            publisher.publish("topic", message)
+        event = client.events("projects/project/topics/topic")[0]
+        assert unstamped(codec.loads(codec.event_payload(event))) == message
+
+
+class TestInMemoryBroker:
+
+    @pytest.fixture
+    def message(self):
+        return {"header": {"messageKind": "jobCreated", "sender": "test", "seedId": 1, "previousEventId": 2}, "body": {"jobDict": {}}}
+
+    def test_delivers_cloud_function_events(self, message):
+        broker = trellis.InMemoryBroker()
+        topic_path = broker.topic_path("project", "topic")
+        received = []
+        broker.subscribe(topic_path, lambda event, context: received.append(trellis.read_message(event, context)))
+        with trellis.BatchPublisher(broker, "project") as publisher:
+            publisher.publish("topic", message)
+        assert broker.join(timeout=1)
+
+        reader, = received
+        assert isinstance(reader, trellis.JobCreatedReader)
+        assert reader.event_id == "1"
+        assert reader.context.resource["name"] == topic_path
+        broker.close()
+
+    def test_fan_out_to_subscriptions(self):
+        broker = trellis.InMemoryBroker()
+        first = broker.subscribe("topic", lambda event, context: None)
+        second = broker.subscribe("topic", lambda event, context: None, workers=2)
+        for _ in range(3):
+            broker.publish("topic", b'{}')
+        assert broker.join(timeout=1)
+        assert (first.delivered, second.delivered) == (3, 3)
+        broker.close()
+
+    def test_chained_functions(self):
+        broker = trellis.InMemoryBroker()
+        received = []
+        broker.subscribe("first", lambda event, context: broker.publish("second", b'{"from":"first"}'))
+        broker.subscribe("second", lambda event, context: received.append(codec.event_payload(event)))
+        broker.publish("first", b'{}')
+        assert broker.join(timeout=1)
+        assert received == [b'{"from":"first"}']
+        broker.close()
+
+    def test_redelivery(self):
+        broker = trellis.InMemoryBroker(max_delivery_attempts=3)
+        event_ids = []
+
+        def flaky(event, context):
+            event_ids.append(context.event_id)
+            if len(event_ids) < 2:
+                raise RuntimeError("Transient failure")
+
+        always_fails = broker.subscribe("other", lambda event, context: 1 / 0)
+        subscription = broker.subscribe("topic", flaky)
+        broker.publish("topic", b'{}')
+        broker.publish("other", b'{}')
+        assert broker.join(timeout=1)
+        assert event_ids == ["1", "1"]
+        assert (subscription.delivered, subscription.redelivered, subscription.failed) == (1, 1, 0)
+        assert (always_fails.redelivered, always_fails.failed) == (2, 1)
+        broker.close()
@@ -2,6 +2,9 @@
 
 import re
 import pdb
+import zlib
+import json
+import mock
 
 from collections import deque
 from unittest import TestCase
@@ -64,3 +67,36 @@ class TestConvertTimestampToRfc3339(TestCase):
 		pass
 
 
+class TestPublishToPubsubTopic(TestCase):
+
+	@staticmethod
+	def _make_publisher():
+		publisher = mock.Mock()
+		publisher.topic_path.side_effect = lambda project, topic: f"projects/{project}/topics/{topic}"
+		return publisher
+
+	def test_publish_small_message(cls):
+		publisher = cls._make_publisher()
+		message = {"header": {"messageKind": "jobCreated"}, "body": {"jobDict": {"name": "fastq-to-ubam"}}}
+		trellis.utils.publish_to_pubsub_topic(publisher, "project", "topic", message)
+
+		args, kwargs = publisher.publish.call_args
+		assert args == ("projects/project/topics/topic",)
+		assert list(kwargs) == ["data"]
+		# Send times are stamped at publish and follow the header fields
+		prefix, stamps = kwargs["data"].split(b',"sentAtNs":')
+		assert prefix == b'{"header":{"messageKind":"jobCreated"'
+		assert re.fullmatch(rb'\d+,"sentMonotonicNs":\d+\},"body":\{"jobDict":\{"name":"fastq-to-ubam"\}\}\}', stamps)
+		assert message["header"] == {"messageKind": "jobCreated"}
+
+	def test_publish_compressed_message(cls):
+		publisher = cls._make_publisher()
+		message = {"header": {"messageKind": "jobCreated"}, "body": {"jobDict": {"inputs": ["gs://bucket/SHIP123.bam"] * 100}}}
+		trellis.utils.publish_to_pubsub_topic(publisher, "project", "topic", message, compress_threshold=100)
+
+		args, kwargs = publisher.publish.call_args
+		assert kwargs["contentEncoding"] == "zlib"
+		published = json.loads(zlib.decompress(kwargs["data"]))
+		assert published["body"] == message["body"]
+		assert published["header"]["messageKind"] == "jobCreated"
+		assert "sentAtNs" in published["header"]